@@ -0,0 +1,119 @@
+"""Shared boto3 clients and resources.
+
+Creating a client takes milliseconds and each one holds its own pool of
+HTTP connections, so every module gets its clients from here instead. They
+are created lazily on first use and reused for the lifetime of the process,
+which also keeps connections alive between warm Lambda invocations.
+"""
+import threading
+
+import boto3
+from botocore.config import Config
+
+from app.constants import (
+    AWS_CONNECT_TIMEOUT_S,
+    AWS_LAMBDA_READ_TIMEOUT_S,
+    AWS_MAX_POOL_CONNECTIONS,
+    AWS_MAX_RETRY_ATTEMPTS,
+    AWS_READ_TIMEOUT_S
+)
+
+DEFAULT_CONFIG = Config(
+    max_pool_connections=AWS_MAX_POOL_CONNECTIONS,
+    connect_timeout=AWS_CONNECT_TIMEOUT_S,
+    read_timeout=AWS_READ_TIMEOUT_S,
+    retries={'max_attempts': AWS_MAX_RETRY_ATTEMPTS}
+)
+
+SERVICE_CONFIGS = {
+    # DynamoDB keeps botocore's own retry policy for throttled requests
+    'dynamodb': Config(
+        max_pool_connections=AWS_MAX_POOL_CONNECTIONS,
+        connect_timeout=AWS_CONNECT_TIMEOUT_S,
+        read_timeout=AWS_READ_TIMEOUT_S
+    ),
+    # Synchronous invocations wait for a whole function to run
+    'lambda': DEFAULT_CONFIG.merge(Config(
+        read_timeout=AWS_LAMBDA_READ_TIMEOUT_S
+    )),
+}
+
+# Clients of a service with a config for one use, keyed on (service, purpose)
+PURPOSE_CONFIGS = {
+    # Queries are cleaned synchronously inside an API request, so the cleaner
+    # gets the default read timeout. Retrying an invocation that timed out
+    # would run it twice and outlast the request.
+    ('lambda', 'query-cleaner'): DEFAULT_CONFIG.merge(Config(
+        retries={'max_attempts': 0}
+    )),
+}
+
+_lock = threading.Lock()
+_session = None
+_clients = {}
+# Resources are not thread safe, so each thread gets its own
+_local = threading.local()
+
+
+def get_session():
+    global _session
+    with _lock:
+        if _session is None:
+            _session = boto3.session.Session()
+        return _session
+
+
+def get_client(service_name, region_name=None, purpose=None):
+    """Returns the shared client of a service, creating it on first use.
+
+    Args:
+        service_name (str): The name of the AWS service, e.g. 's3'
+        region_name (str): The region of the client, defaults to the region of
+            the environment
+        purpose (str): The use of a client with its own config, one of the
+            purposes of the service in PURPOSE_CONFIGS
+
+    Returns:
+        botocore.client.BaseClient: The client of the service
+    """
+    key = service_name, region_name, purpose
+    client = _clients.get(key)
+    if client is None:
+        if purpose is None:
+            config = SERVICE_CONFIGS.get(service_name, DEFAULT_CONFIG)
+        else:
+            config = PURPOSE_CONFIGS[(service_name, purpose)]
+        session = get_session()
+        with _lock:
+            client = _clients.get(key)
+            if client is None:
+                client = session.client(service_name, region_name=region_name,
+                                        config=config)
+                _clients[key] = client
+    return client
+
+
+def get_resource(service_name, region_name=None):
+    """Returns the resource of a service for the current thread, creating it
+    on first use.
+
+    Args:
+        service_name (str): The name of the AWS service, e.g. 'dynamodb'
+        region_name (str): The region of the resource, defaults to the region
+            of the environment
+
+    Returns:
+        boto3.resources.base.ServiceResource: The resource of the service
+    """
+    resources = getattr(_local, 'resources', None)
+    if resources is None:
+        resources = _local.resources = {}
+
+    key = service_name, region_name
+    if key not in resources:
+        session = get_session()
+        with _lock:
+            resources[key] = session.resource(
+                service_name, region_name=region_name,
+                config=SERVICE_CONFIGS.get(service_name, DEFAULT_CONFIG))
+    return resources[key]
@@ -5,6 +5,42 @@ SCORE_THRESHOLD = 0.1
 COURSE_PARSE_TRAIN_TIMEOUT_S = 600  # seconds
 COURSE_PARSE_TRAIN_INTERVAL_S = 1800  # seconds
 COURSE_MODEL_RELOAD_DELAY_S = 3600  # seconds
+COURSE_REGISTRY_TTL_S = 60  # seconds
+COURSE_MODEL_MEMORY_BUDGET_MB = 512  # megabytes
+COURSE_MODEL_VERSION_CHECK_S = 60  # seconds
+POST_METADATA_CHECK_S = 60  # seconds
+DASHBOARD_CACHE_TTL_S = 300  # seconds
+DASHBOARD_VERSION_CHECK_S = 5  # seconds
+INSTRUCTOR_RECS_PAGE_SIZE = 50
+INSTRUCTOR_RECS_MAX_PAGE_SIZE = 500
+BATCH_QUERY_CHUNK_SIZE = 256
+BATCH_QUERY_MAX_QUERIES = 2048
+MODEL_FULL_REFIT_INTERVAL_S = 86400  # seconds
+MODEL_DRIFT_THRESHOLD = 0.25
+MODEL_TRAIN_CLEAN_CHUNK_SIZE = 200
+DDB_BATCH_GET_MAX_KEYS = 100
+DDB_MAX_RETRIES = 5
+DDB_WRITE_BATCH_SIZE = 25
+DDB_WRITE_WORKERS = 8
+
+AWS_MAX_POOL_CONNECTIONS = 32
+AWS_CONNECT_TIMEOUT_S = 5  # seconds
+AWS_READ_TIMEOUT_S = 30  # seconds
+AWS_MAX_RETRY_ATTEMPTS = 3
+AWS_LAMBDA_READ_TIMEOUT_S = 300  # seconds
+
+PIAZZA_FETCH_WORKERS = 4
+PIAZZA_MAX_REQUESTS_PER_S = 5
+FEED_PAGE_SIZE = 50
+FEED_FULL_SYNC_INTERVAL_S = 21600  # seconds
+MODEL_FETCH_WORKERS = 8
+
+QUERY_CLEANER_LOCAL = "local"
+QUERY_CLEANER_REMOTE = "remote"
+QUERY_CLEAN_CACHE_SIZE = 4096
+CLEAN_BATCH_SIZE = 64
+CLEAN_N_PROCESS = 1
+CLEAN_CACHE_PATH = "/tmp/parqr-clean-cache.sqlite"
 
 DATETIME_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
 
@@ -20,3 +56,12 @@ class TFIDF_MODELS(Enum):
     I_ANSWER = 1
     S_ANSWER = 2
     FOLLOWUP = 3
+
+
+# The contribution of each model to the final similarity score of a post
+TFIDF_MODEL_WEIGHTS = {
+    TFIDF_MODELS.POST: 0.4,
+    TFIDF_MODELS.I_ANSWER: 0.2,
+    TFIDF_MODELS.S_ANSWER: 0.2,
+    TFIDF_MODELS.FOLLOWUP: 0.2,
+}
@@ -0,0 +1,225 @@
+import threading
+import time
+
+from boto3.dynamodb.conditions import Attr
+from botocore.exceptions import ClientError
+
+from app.aws import get_resource
+from app.constants import DASHBOARD_CACHE_TTL_S, DASHBOARD_VERSION_CHECK_S
+
+# The kinds of dashboard data of a course, each with its own version counter
+# on the course's item in the Courses table
+INSTRUCTOR_QUEUE = "instructor-queue"
+STUDENT_RECS = "student-recs"
+DASHBOARD_POSTS = "dashboard-posts"
+VERSION_ATTRIBUTES = {
+    INSTRUCTOR_QUEUE: "instructor_queue_version",
+    STUDENT_RECS: "student_recs_version",
+    DASHBOARD_POSTS: "dashboard_posts_version",
+}
+
+
+def get_courses_table():
+    return get_resource("dynamodb").Table("Courses")
+
+
+def get_dashboard_versions(course_id):
+    """Returns the version counter of each kind of dashboard data of a
+    course."""
+    item = get_courses_table().get_item(
+        Key={"course_id": course_id},
+        ProjectionExpression=", ".join(VERSION_ATTRIBUTES.values())
+    ).get("Item") or {}
+    return {kind: int(item.get(attribute, 0))
+            for kind, attribute in VERSION_ATTRIBUTES.items()}
+
+
+def bump_dashboard_version(course_id, kind):
+    """Signals every container that one kind of dashboard data of a course
+    changed.
+
+    Returns:
+        int: The new version of the data
+    """
+    attribute = VERSION_ATTRIBUTES[kind]
+    attributes = get_courses_table().update_item(
+        Key={"course_id": course_id},
+        UpdateExpression="ADD {} :one".format(attribute),
+        ExpressionAttributeValues={":one": 1},
+        ReturnValues="UPDATED_NEW"
+    ).get("Attributes", {})
+    return int(attributes.get(attribute, 0))
+
+
+def _legacy_assignees(posts):
+    """Reads the assignees that earlier dashboards stored on the posts of a
+    course. This is the only scan of the posts, made once per course.
+
+    Returns:
+        dict: The entry of each assigned post in dashboard_posts, keyed on pid
+    """
+    kwargs = {
+        "ProjectionExpression": "post_id, assignees",
+        "FilterExpression": Attr("assignees").exists(),
+    }
+    response = posts.scan(**kwargs)
+    items = response.get("Items")
+    while "LastEvaluatedKey" in response:
+        response = posts.scan(ExclusiveStartKey=response["LastEvaluatedKey"],
+                              **kwargs)
+        items.extend(response["Items"])
+    return {str(int(item["post_id"])): {
+        "assignees": {assignee: True for assignee in item["assignees"]},
+    } for item in items}
+
+
+def _compact_dashboard_posts(dashboard_posts):
+    posts = {}
+    for pid, entry in dashboard_posts.items():
+        posts[int(pid)] = {"assignees": sorted(entry.get("assignees") or {})}
+        if "resolved" in entry:
+            posts[int(pid)]["resolved"] = bool(entry["resolved"])
+    return posts
+
+
+def get_dashboard_posts(course_id):
+    """Returns the attributes of the posts of a course that are set from the
+    dashboard. They are kept in the dashboard_posts map of the course's item
+    in the Courses table, which is started from the assignees of earlier
+    dashboards the first time it is read.
+
+    Returns:
+        dict: The sorted assignees of each post keyed on pid, and its
+            resolved state if it was set from the dashboard
+    """
+    courses = get_courses_table()
+    item = courses.get_item(
+        Key={"course_id": course_id},
+        ProjectionExpression="dashboard_posts"
+    ).get("Item") or {}
+    if "dashboard_posts" in item:
+        return _compact_dashboard_posts(item["dashboard_posts"])
+
+    seed = _legacy_assignees(get_resource("dynamodb").Table(course_id))
+    # Another writer may have started the map in the meantime
+    attributes = courses.update_item(
+        Key={"course_id": course_id},
+        UpdateExpression="SET dashboard_posts = if_not_exists(dashboard_posts, :seed)",
+        ExpressionAttributeValues={":seed": seed},
+        ReturnValues="UPDATED_NEW"
+    ).get("Attributes", {})
+    return _compact_dashboard_posts(attributes.get("dashboard_posts", seed))
+
+
+def update_dashboard_post(course_id, post_id, update_expression,
+                          attribute_names, attribute_values):
+    """Atomically updates the entry of a post in the dashboard_posts map of a
+    course and bumps the version of the dashboard posts. The expressions
+    address the entry of the post as #post.
+
+    Raises:
+        botocore.exceptions.ClientError: ConditionalCheckFailedException if
+            the course does not exist
+    """
+    courses = get_courses_table()
+    attribute_names = dict(attribute_names, **{"#post": str(int(post_id))})
+    attribute_values = dict(attribute_values, **{":one": 1})
+    update = {
+        "Key": {"course_id": course_id},
+        "UpdateExpression": "{} ADD {} :one".format(
+            update_expression, VERSION_ATTRIBUTES[DASHBOARD_POSTS]),
+        "ExpressionAttributeNames": attribute_names,
+        "ExpressionAttributeValues": attribute_values,
+        "ConditionExpression": "attribute_exists(course_id)",
+    }
+    try:
+        courses.update_item(**update)
+        return
+    except ClientError as e:
+        # The map or the entry of the post does not exist yet
+        if e.response["Error"]["Code"] != "ValidationException":
+            raise
+
+    get_dashboard_posts(course_id)
+    courses.update_item(
+        Key={"course_id": course_id},
+        UpdateExpression="SET dashboard_posts.#post = "
+                         "if_not_exists(dashboard_posts.#post, :entry)",
+        ExpressionAttributeNames={"#post": attribute_names["#post"]},
+        ExpressionAttributeValues={":entry": {"assignees": {}}},
+        ConditionExpression="attribute_exists(course_id)"
+    )
+    courses.update_item(**update)
+
+
+class DashboardCache(object):
+    """A warm, in-memory cache of the dashboard data of each course.
+
+    Entries are keyed on the kind of data, the course and the versions of
+    the kinds of data they were built from, and expire after ttl_s seconds.
+    The version counters live in the Courses table and are checked at most
+    once every check_interval_s seconds, so a write in any container makes
+    every other container reload the entries built from that data.
+    """
+
+    def __init__(self, ttl_s=DASHBOARD_CACHE_TTL_S,
+                 check_interval_s=DASHBOARD_VERSION_CHECK_S):
+        self._ttl_s = ttl_s
+        self._check_interval_s = check_interval_s
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._versions = {}
+
+    @staticmethod
+    def key(kind, course_id, version):
+        return "{}:{}:v{}".format(kind, course_id, version)
+
+    def versions(self, course_id):
+        """Returns the dashboard versions of a course, reading the Courses
+        table if they were not checked recently.
+        """
+        now = time.time()
+        with self._lock:
+            versions, last_check = self._versions.get(course_id, (None, 0))
+        if now - last_check < self._check_interval_s:
+            return versions
+
+        versions = get_dashboard_versions(course_id)
+        with self._lock:
+            self._versions[course_id] = versions, now
+        return versions
+
+    def get(self, kind, course_id, loader, depends_on=None):
+        """Returns the cached data of a course, calling loader to read it if
+        the entry is missing, expired or built from older data. Nothing is
+        cached if loader returns None.
+
+        Args:
+            kind (str): The kind of the data
+            course_id (str): The course id of the data
+            loader (callable): Reads the data
+            depends_on (tuple): The kinds of data the entry is built from
+                (Default: (kind,))
+        """
+        versions = self.versions(course_id)
+        version = ".".join(str(versions[name]) for name in depends_on or (kind,))
+        with self._lock:
+            entry = self._entries.get(self.key(kind, course_id, version))
+        if entry is not None and entry[1] > time.time():
+            return entry[0]
+
+        value = loader()
+        if value is not None:
+            self.put(kind, course_id, version, value)
+        return value
+
+    def put(self, kind, course_id, version, value):
+        """Stores the data of a course at a version, dropping the entries of
+        older versions.
+        """
+        prefix = "{}:{}:".format(kind, course_id)
+        with self._lock:
+            for key in [key for key in self._entries if key.startswith(prefix)]:
+                del self._entries[key]
+            self._entries[self.key(kind, course_id, version)] = \
+                value, time.time() + self._ttl_s
@@ -0,0 +1,227 @@
+import itertools
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from botocore.exceptions import ClientError
+
+from app.constants import (
+    DDB_MAX_RETRIES,
+    DDB_WRITE_BATCH_SIZE,
+    DDB_WRITE_WORKERS
+)
+
+RETRYABLE_ERRORS = {
+    "ProvisionedThroughputExceededException",
+    "ThrottlingException",
+    "RequestLimitExceeded",
+    "InternalServerError",
+}
+
+
+def with_backoff(func, max_retries=DDB_MAX_RETRIES):
+    """Calls func, retrying throttled DynamoDB requests with exponential
+    backoff and jitter.
+    """
+    retries = 0
+    while True:
+        try:
+            return func()
+        except ClientError as e:
+            code = e.response.get("Error", {}).get("Code")
+            if code not in RETRYABLE_ERRORS or retries >= max_retries:
+                raise
+            time.sleep(random.uniform(0, 0.05 * 2 ** retries))
+            retries += 1
+
+
+class _PooledWriter(object):
+    """Buffers requests on a table and flushes them in batches through a
+    bounded pool of threads. At most max_workers calls of write are in
+    flight, and flushing only waits when all of them are, so callers keep
+    working while earlier requests are written.
+
+    Args:
+        table: The boto3 Table the requests are written to
+        write (callable): Writes a list of requests and records the outcome
+        request_key (callable): Returns the key of the item of a request
+        requests_per_call (int): The number of requests passed to each call
+            of write
+        batch_size (int): The number of buffered requests that triggers a
+            flush
+        max_workers (int): The number of threads writing requests
+    """
+
+    def __init__(self, table, write, request_key, requests_per_call,
+                 batch_size=DDB_WRITE_BATCH_SIZE, max_workers=DDB_WRITE_WORKERS):
+        self._table_name = table.name
+        # The resource's client serializes python types and is thread safe
+        self._client = table.meta.client
+        self._write = write
+        self._request_key = request_key
+        self._requests_per_call = requests_per_call
+        self._batch_size = batch_size
+        self._max_workers = max_workers
+        self._pool = ThreadPoolExecutor(max_workers=max_workers)
+        # Requests are keyed so a later request can replace a buffered one
+        self._buffer = {}
+        # The keys written by each call in flight
+        self._pending = {}
+        self._lock = threading.Lock()
+        self.persisted = 0
+        self.failed = 0
+        self.failed_keys = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _record(self, persisted=0, failed_keys=()):
+        with self._lock:
+            self.persisted += persisted
+            self.failed += len(failed_keys)
+            self.failed_keys.extend(failed_keys)
+
+    def _add(self, buffer_key, request):
+        self._buffer[buffer_key] = request
+        if len(self._buffer) >= self._batch_size:
+            self.flush()
+
+    def _submit(self, requests):
+        if len(self._pending) >= self._max_workers:
+            done, _ = wait(list(self._pending), return_when=FIRST_COMPLETED)
+            self._collect(done)
+        keys = [self._request_key(request) for request in requests]
+        self._pending[self._pool.submit(self._write, requests)] = keys
+
+    def _collect(self, futures):
+        """Forgets finished calls. The keys of a call that raised are
+        reported as failed, as it is unknown which of them were written.
+        """
+        for future in futures:
+            keys = self._pending.pop(future)
+            error = future.exception()
+            if error is not None:
+                print("Unable to write {} to {}: {!r}".format(
+                    keys, self._table_name, error))
+                self._record(failed_keys=keys)
+
+    def flush(self):
+        """Submits the buffered requests to the pool of writers,
+        requests_per_call requests per call of write.
+        """
+        batch, self._buffer = list(self._buffer.values()), {}
+        for i in range(0, len(batch), self._requests_per_call):
+            self._submit(batch[i:i + self._requests_per_call])
+
+    def close(self):
+        """Writes every buffered request and waits for all of them to finish."""
+        self.flush()
+        done, _ = wait(list(self._pending))
+        self._collect(done)
+        self._pool.shutdown()
+
+
+class UpdateWriter(_PooledWriter):
+    """Writes update_item calls on a table concurrently.
+
+    Usage:
+        with UpdateWriter(table) as writer:
+            writer.update({"post_id": 1}, "SET a = :a", {":a": "b"})
+        print(writer.persisted, writer.failed, writer.failed_keys)
+    """
+
+    def __init__(self, table, batch_size=DDB_WRITE_BATCH_SIZE,
+                 max_workers=DDB_WRITE_WORKERS):
+        super(UpdateWriter, self).__init__(
+            table, self._update, lambda request: request["Key"], 1,
+            batch_size, max_workers)
+        # Every update is applied, so each gets its own place in the buffer
+        self._updates = itertools.count()
+
+    def update(self, key, update_expression, values):
+        self._add(next(self._updates), {
+            "TableName": self._table_name,
+            "Key": key,
+            "UpdateExpression": update_expression,
+            "ExpressionAttributeValues": values,
+        })
+
+    def _update(self, requests):
+        request, = requests
+        try:
+            with_backoff(lambda: self._client.update_item(**request))
+        except ClientError as e:
+            print("Unable to update {} in {}: {}".format(
+                request["Key"], self._table_name, e))
+            self._record(failed_keys=[request["Key"]])
+        else:
+            self._record(persisted=1)
+
+
+class BatchWriter(_PooledWriter):
+    """Groups whole item puts and deletes on a table into BatchWriteItem
+    requests of up to DDB_WRITE_BATCH_SIZE items, which are written
+    concurrently. Unprocessed items are retried with exponential backoff and
+    the keys of the items that could not be written are reported in
+    failed_keys.
+
+    Usage:
+        with BatchWriter(table, key_names=("post_id",)) as writer:
+            writer.put({"post_id": 1, "subject": "a"})
+            writer.delete({"post_id": 2})
+        print(writer.persisted, writer.failed, writer.failed_keys)
+    """
+
+    def __init__(self, table, key_names=("post_id",),
+                 batch_size=DDB_WRITE_BATCH_SIZE,
+                 max_workers=DDB_WRITE_WORKERS):
+        super(BatchWriter, self).__init__(
+            table, self._batch_write, self._batch_request_key, batch_size,
+            batch_size, max_workers)
+        self._key_names = key_names
+
+    def _key(self, item):
+        return {name: item[name] for name in self._key_names}
+
+    def _add_item(self, item, request):
+        # A batch may not touch the same item twice, so the last write wins
+        self._add(tuple(item[name] for name in self._key_names), request)
+
+    def put(self, item):
+        self._add_item(item, {"PutRequest": {"Item": item}})
+
+    def delete(self, key):
+        self._add_item(key, {"DeleteRequest": {"Key": key}})
+
+    def _batch_request_key(self, request):
+        if "PutRequest" in request:
+            return self._key(request["PutRequest"]["Item"])
+        return self._key(request["DeleteRequest"]["Key"])
+
+    def _batch_write(self, requests):
+        retries = 0
+        while requests:
+            try:
+                response = with_backoff(lambda: self._client.batch_write_item(
+                    RequestItems={self._table_name: requests}))
+            except ClientError as e:
+                print("Unable to write {} items to {}: {}".format(
+                    len(requests), self._table_name, e))
+                break
+            unprocessed = response.get("UnprocessedItems", {}).get(
+                self._table_name, [])
+            self._record(persisted=len(requests) - len(unprocessed))
+            requests = unprocessed
+            if not requests or retries >= DDB_MAX_RETRIES:
+                break
+            time.sleep(random.uniform(0, 0.05 * 2 ** retries))
+            retries += 1
+
+        if requests:
+            failed_keys = [self._batch_request_key(request) for request in requests]
+            print("Unable to write {} to {}".format(failed_keys, self._table_name))
+            self._record(failed_keys=failed_keys)
@@ -0,0 +1,223 @@
+import json
+import time
+from datetime import datetime
+
+from botocore.exceptions import ClientError
+
+from app.aws import get_client
+from app.constants import (
+    DATETIME_FORMAT,
+    FEED_FULL_SYNC_INTERVAL_S,
+    FEED_PAGE_SIZE
+)
+
+
+def get_boto3_s3():
+    return get_client('s3')
+
+
+def _modified(feed_item):
+    return int(datetime.strptime(feed_item["modified"],
+                                 DATETIME_FORMAT).timestamp())
+
+
+class FeedIndex(object):
+    """Tracks the last modification time of every post of a course so the
+    Parser only pages through the part of the Piazza feed that changed.
+
+    The index is persisted in S3 between Parser runs as a compact mapping of
+    pid to modified timestamp, together with the time of the last full feed
+    pull, and the content fingerprint of every stored post. Posts that are
+    private or deleted on Piazza are tracked separately so they are not
+    fetched again until they change. Posts that could not be fetched or
+    stored are kept in a pending set and retried on every run. Deleted posts
+    can only be found by comparing the complete feed with the index, so that
+    is done every FEED_FULL_SYNC_INTERVAL_S seconds. The first full sync also
+    backfills the counts of posts stored before they were added.
+    """
+    bucket = 'parqr'
+    key_format = "feeds/{}.json"
+
+    def __init__(self, course_id):
+        self._course_id = course_id
+        self._modified = {}
+        self._hidden = {}
+        self._fingerprints = {}
+        self._pending = {}
+        self._last_full_sync = 0
+        self._counts_backfilled = False
+        self._changed = False
+
+    def load(self):
+        try:
+            response = get_boto3_s3().get_object(
+                Bucket=self.bucket,
+                Key=self.key_format.format(self._course_id)
+            )
+            index = json.loads(response['Body'].read().decode("utf-8"))
+            self._modified = {int(pid): modified for pid, modified
+                              in index.get("modified", {}).items()}
+            self._hidden = {int(pid): modified for pid, modified
+                            in index.get("hidden", {}).items()}
+            self._fingerprints = {int(pid): fingerprint for pid, fingerprint
+                                  in index.get("fingerprints", {}).items()}
+            self._pending = {int(pid): modified for pid, modified
+                             in index.get("pending", {}).items()}
+            self._last_full_sync = index.get("last_full_sync", 0)
+            self._counts_backfilled = index.get("counts_backfilled", False)
+        except ClientError:
+            print("No feed index saved for course {}".format(self._course_id))
+
+    def save(self):
+        if not self._changed:
+            return
+        index = {
+            "modified": {str(pid): modified for pid, modified
+                         in self._modified.items()},
+            "hidden": {str(pid): modified for pid, modified
+                       in self._hidden.items()},
+            "fingerprints": {str(pid): fingerprint for pid, fingerprint
+                             in self._fingerprints.items()},
+            "pending": {str(pid): modified for pid, modified
+                        in self._pending.items()},
+            "last_full_sync": self._last_full_sync,
+            "counts_backfilled": self._counts_backfilled,
+        }
+        get_boto3_s3().put_object(
+            Bucket=self.bucket,
+            Key=self.key_format.format(self._course_id),
+            Body=bytes(json.dumps(index, separators=(",", ":")),
+                       encoding='utf8')
+        )
+        self._changed = False
+
+    def __contains__(self, pid):
+        return pid in self._modified
+
+    @property
+    def pids(self):
+        return set(self._modified)
+
+    def needs_full_sync(self):
+        return (not self._modified or not self._counts_backfilled or
+                time.time() - self._last_full_sync > FEED_FULL_SYNC_INTERVAL_S)
+
+    @property
+    def counts_backfilled(self):
+        return self._counts_backfilled
+
+    def mark_counts_backfilled(self):
+        """Records that every stored post has the counts added to the posts
+        after the course was first parsed
+        """
+        if not self._counts_backfilled:
+            self._counts_backfilled = True
+            self._changed = True
+
+    def seed(self, pids, modified):
+        """Starts an empty index from the pids and course wide last_modified
+        time stored by earlier versions of the Parser.
+        """
+        for pid in pids:
+            self._modified.setdefault(int(pid), int(modified))
+        self._changed = True
+
+    def fingerprint(self, pid):
+        """Returns the content fingerprint of the stored version of a post"""
+        return self._fingerprints.get(pid)
+
+    def mark_synced(self, pid, modified, fingerprint=None):
+        """Records that the given modification of a post has been stored"""
+        self._hidden.pop(pid, None)
+        if self._pending.pop(pid, None) is not None:
+            self._changed = True
+        if self._modified.get(pid) != modified:
+            self._modified[pid] = modified
+            self._changed = True
+        if fingerprint is not None and self._fingerprints.get(pid) != fingerprint:
+            self._fingerprints[pid] = fingerprint
+            self._changed = True
+
+    def mark_hidden(self, pid, modified):
+        """Records that the given modification of a post is not stored as the
+        post is private or deleted
+        """
+        self._modified.pop(pid, None)
+        self._fingerprints.pop(pid, None)
+        self._pending.pop(pid, None)
+        self._hidden[pid] = modified
+        self._changed = True
+
+    def mark_pending(self, pid, modified):
+        """Records that the given modification of a post could not be fetched
+        or stored, so it is retried on the next run
+        """
+        if self._pending.get(pid) != modified:
+            self._pending[pid] = modified
+            self._changed = True
+
+    def discard(self, pid):
+        self._fingerprints.pop(pid, None)
+        self._pending.pop(pid, None)
+        if self._modified.pop(pid, None) is not None:
+            self._changed = True
+
+    def is_current(self, feed_item):
+        pid = feed_item["nr"]
+        synced = self._modified.get(pid, self._hidden.get(pid, -1))
+        return synced >= _modified(feed_item)
+
+    def changes(self, network, full=False):
+        """Finds the posts of the course that changed since they were last
+        synced.
+
+        Parameters
+        ----------
+        network : piazza_api.network.Network
+            The network of the course
+        full : boolean
+            Download the whole feed, which is required to detect deleted posts
+
+        Returns
+        -------
+        changed : dict
+            The modified timestamp of every new or changed post keyed on pid,
+            including the posts that are pending a retry
+        missing : set or None
+            The pids in the index that are no longer in the feed, or None if
+            only part of the feed was read
+        """
+        if full:
+            feed = network.get_feed(limit=99999)["feed"]
+            changed = {item["nr"]: _modified(item) for item in feed
+                       if not self.is_current(item)}
+            feed_pids = set(item["nr"] for item in feed)
+            self._hidden = {pid: modified for pid, modified
+                            in self._hidden.items() if pid in feed_pids}
+            self._pending = {pid: modified for pid, modified
+                             in self._pending.items() if pid in feed_pids}
+            self._last_full_sync = int(time.time())
+            self._changed = True
+            return changed, self.pids - feed_pids
+
+        # The feed is ordered by modification time, newest first, except for
+        # pinned posts which are always at the top. Stop at the first
+        # unpinned post that has not changed since the last sync. Posts that
+        # failed on earlier runs may be further down, so they are added from
+        # the pending set.
+        changed = {}
+        offset = 0
+        done = False
+        while not done:
+            page = network.get_feed(limit=FEED_PAGE_SIZE, offset=offset)["feed"]
+            for item in page:
+                if not self.is_current(item):
+                    changed[item["nr"]] = _modified(item)
+                elif not item.get("pin"):
+                    done = True
+                    break
+            done = done or len(page) < FEED_PAGE_SIZE
+            offset += len(page)
+        for pid, modified in self._pending.items():
+            changed.setdefault(pid, modified)
+        return changed, None
@@ -1,8 +1,8 @@
 import uuid
 
 import json
-import boto3
 import numpy as np
+from app.aws import get_client, get_resource
 from app.constants import (
     FEEDBACK_MAX_RATING,
     FEEDBACK_MIN_RATING
@@ -62,7 +62,7 @@ class Feedback(object):
         """
         recommended_pids = [post["pid"] for post in similar_posts]
 
-        feedbacks = boto3.resource('dynamodb').Table("Feedbacks")
+        feedbacks = get_resource('dynamodb').Table("Feedbacks")
         query_rec_id = str(uuid.uuid4())
         query_recommendation_pair = {
             'course_id': course_id,
@@ -94,7 +94,7 @@ class Feedback(object):
             return False, "Rating must be between {} and {}.".format(self.min_rating, self.max_rating)
 
         # Check that the query-recommendation pair exists
-        dynamodb = boto3.client('dynamodb')
+        dynamodb = get_client('dynamodb')
         response = dynamodb.get_item(
             TableName='Feedbacks',
             Key={
@@ -133,7 +133,7 @@ class Feedback(object):
         Returns:
             success (bool): Whether the feedback was successfully registered
         """
-        dynamodb = boto3.client('dynamodb')
+        dynamodb = get_client('dynamodb')
         query_rec_pair = dynamodb.get_item(
             TableName='Feedbacks',
             Key={
@@ -145,7 +145,7 @@ class Feedback(object):
 
         # If it doesn't exist, return failure
         if not query_rec_pair:
-            feedbacks = boto3.resource('dynamodb').Table("Feedbacks")
+            feedbacks = get_resource('dynamodb').Table("Feedbacks")
             feedbacks.put_item(
                 Item={
                     'query_rec_id': query_rec_id,
@@ -0,0 +1,100 @@
+"""Fast HTML to text conversion for the fragments of Piazza posts.
+
+The text produced matches BeautifulSoup(html, "html.parser").get_text():
+the text of every node and CDATA section is concatenated, while comments,
+other declarations, processing instructions and the contents of script,
+style and template elements are skipped.
+"""
+from html.parser import HTMLParser
+
+SKIPPED_ELEMENTS = {"script", "style", "template"}
+
+
+class TextExtractor(HTMLParser):
+    """A streaming html.parser subclass that only keeps text. A single
+    instance can convert many fragments one after another.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self._parts = []
+        self._skip_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in SKIPPED_ELEMENTS:
+            self._skip_depth += 1
+
+    def handle_endtag(self, tag):
+        if tag in SKIPPED_ELEMENTS and self._skip_depth > 0:
+            self._skip_depth -= 1
+
+    def handle_data(self, data):
+        if self._skip_depth == 0:
+            self._parts.append(data)
+
+    def unknown_decl(self, data):
+        # html.parser reports CDATA sections as declarations
+        if data.upper().startswith("CDATA[") and self._skip_depth == 0:
+            self._parts.append(data[len("CDATA["):])
+
+    def to_text(self, html):
+        """Returns the text of an HTML fragment"""
+        self.reset()
+        self._parts = []
+        self._skip_depth = 0
+        self.feed(html)
+        self.close()
+        return "".join(self._parts)
+
+
+def extract_post_text(post, extractor=None):
+    """Converts every HTML fragment of a Piazza post to text in one pass.
+
+    Parameters
+    ----------
+    post : dict
+        An object including the post information retrieved from a
+        piazza_api call
+    extractor : TextExtractor
+        The extractor to reuse (Default: a new TextExtractor)
+
+    Returns
+    -------
+    body : str
+        The body of the post without html tags, or None if it is empty
+    s_answer : str
+        The student answer to the post if available (Default = None).
+    i_answer : str
+        The instructor answer to the post if available (Default = None).
+    followups : list
+        The followup discussions for a post if available, which might
+        contain feedbacks as well (Default = []).
+    """
+    extractor = extractor or TextExtractor()
+
+    body = extractor.to_text(post["history"][0]["content"]) or None
+
+    s_answer, i_answer = None, None
+    followups = []
+    for child in post["children"]:
+        if child["type"] == "s_answer":
+            s_answer = extractor.to_text(child["history"][0]["content"])
+        elif child["type"] == "i_answer":
+            i_answer = extractor.to_text(child["history"][0]["content"])
+        elif child["type"] == "followup":
+            data = {}
+            text = extractor.to_text(child["subject"])
+            if text:
+                data["text"] = text
+
+            if child["children"]:
+                responses = []
+                for activity in child["children"]:
+                    text = extractor.to_text(activity["subject"])
+                    if text:
+                        responses.append(text)
+                data["responses"] = responses
+
+            followups.append(data)
+
+    return body, s_answer, i_answer, followups
@@ -0,0 +1,305 @@
+import base64
+from bisect import bisect_left, bisect_right
+
+import simplejson as json
+from botocore.exceptions import ClientError
+
+from app.aws import get_client
+from app.utils import pretty_date
+
+# The columns of the queue, in the order of the fields of a recommendation
+QUEUE_COLUMNS = (
+    "title", "post_id", "num_views", "num_updates", "num_unresolved_followups",
+    "i_answer", "s_answer", "tags", "last_modified", "assignees",
+    "good_questions", "num_words", "resolved",
+)
+
+# The attributes of a post item the queue is built from
+QUEUE_ATTRIBUTES = (
+    "subject", "post_id", "num_views", "num_updates", "num_unresolved_followups",
+    "i_answer", "s_answer", "tags", "created", "assignees",
+    "num_good_questions", "body", "resolved",
+)
+
+# Fields of a recommendation that are computed when it is served
+DERIVED_COLUMNS = ("pretty_date",)
+
+# Columns set from the dashboard. They live in the dashboard_posts map of the
+# course and are overlaid on the stored queue when it is served.
+DASHBOARD_COLUMNS = ("assignees", "resolved")
+
+QUEUE_FORMAT_VERSION = 2
+
+
+def get_s3():
+    return get_client('s3')
+
+
+def queue_entry(item):
+    """Projects a post item onto the fields of the instructor queue.
+
+    Returns:
+        dict: The entry of the post keyed on QUEUE_COLUMNS, or None if the
+            post is an instructor question and stays out of the queue
+    """
+    tags = list(item.get("tags") or [])
+    if "instructor-question" in tags:
+        return None
+    return {
+        "title": item["subject"],
+        "post_id": int(item["post_id"]),
+        "num_views": int(item.get("num_views", 0)),
+        "num_updates": int(item.get("num_updates", 0)),
+        "num_unresolved_followups": int(item.get("num_unresolved_followups", 0)),
+        "i_answer": True if item.get("i_answer") else False,
+        "s_answer": True if item.get("s_answer") else False,
+        "tags": tags,
+        "last_modified": int(item.get("created")),
+        "assignees": sorted(item.get("assignees") or []),
+        "good_questions": int(item.get("num_good_questions", 0)),
+        "num_words": len((item.get("body") or "").split()),
+        "resolved": bool(item.get("resolved")),
+    }
+
+
+def _sort_key(entry):
+    # post_id breaks ties so that every entry has a distinct position
+    return entry["num_unresolved_followups"], entry["num_views"], entry["post_id"]
+
+
+def encode_cursor(sort_key):
+    return base64.urlsafe_b64encode(json.dumps(list(sort_key)).encode("utf8")).decode("ascii")
+
+
+def decode_cursor(cursor):
+    """Returns the sort key encoded in a cursor.
+
+    Raises:
+        ValueError: If the cursor was not made by encode_cursor
+    """
+    try:
+        sort_key = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf8"))
+    except (TypeError, ValueError, UnicodeError):
+        raise ValueError("Invalid cursor {}".format(cursor))
+    if not isinstance(sort_key, list) or len(sort_key) != 3 or \
+            not all(isinstance(value, int) for value in sort_key):
+        raise ValueError("Invalid cursor {}".format(cursor))
+    return tuple(sort_key)
+
+
+class InstructorQueue(object):
+    """A compact index of the posts that may need an instructor's attention.
+
+    Only the fields of a recommendation are kept, stored column by column and
+    sorted by (unresolved followups, views), so a request only has to filter
+    on the answer columns and slice. The Parser patches the queue of a course
+    whenever posts change and stores it in S3 at key_format. Only the Parser
+    writes the stored queue; the dashboard columns are overlaid when it is
+    loaded for serving.
+
+    Pages are addressed by the sort key of their last entry. The sort keys and
+    the positions of the entries with each tag, assignee and resolved state
+    are indexed lazily on the first page request.
+    """
+    bucket = 'parqr'
+    key_format = "instructor-queue/{}.json"
+
+    def __init__(self, columns=None):
+        self._columns = columns or {name: [] for name in QUEUE_COLUMNS}
+        self._sort_keys = None
+        self._positions = {}
+
+    def __len__(self):
+        return len(self._columns["post_id"])
+
+    @classmethod
+    def from_entries(cls, entries):
+        entries = sorted((entry for entry in entries if entry is not None),
+                         key=_sort_key)
+        return cls({name: [entry[name] for entry in entries]
+                    for name in QUEUE_COLUMNS})
+
+    @classmethod
+    def from_table(cls, table):
+        """Builds the queue of a course from a scan of its table"""
+        names = {"#a{}".format(i): name for i, name in enumerate(QUEUE_ATTRIBUTES)}
+        kwargs = {
+            "ProjectionExpression": ", ".join(names),
+            "ExpressionAttributeNames": names,
+        }
+        response = table.scan(**kwargs)
+        items = response.get("Items")
+        while "LastEvaluatedKey" in response:
+            response = table.scan(ExclusiveStartKey=response["LastEvaluatedKey"],
+                                  **kwargs)
+            items.extend(response["Items"])
+        return cls.from_entries(queue_entry(item) for item in items)
+
+    @classmethod
+    def loads(cls, body):
+        queue = json.loads(body)
+        if queue.get("version") != QUEUE_FORMAT_VERSION:
+            return None
+        return cls(queue["columns"])
+
+    def dumps(self):
+        return json.dumps({"version": QUEUE_FORMAT_VERSION,
+                           "columns": self._columns},
+                          separators=(",", ":"))
+
+    @classmethod
+    def load(cls, course_id):
+        """Returns the stored queue of a course, or None if there is none"""
+        try:
+            response = get_s3().get_object(Bucket=cls.bucket,
+                                           Key=cls.key_format.format(course_id))
+        except ClientError:
+            return None
+        return cls.loads(response["Body"].read().decode("utf-8"))
+
+    def save(self, course_id):
+        get_s3().put_object(
+            Bucket=self.bucket,
+            Key=self.key_format.format(course_id),
+            Body=bytes(self.dumps(), encoding='utf8')
+        )
+
+    def entries(self):
+        rows = zip(*(self._columns[name] for name in QUEUE_COLUMNS))
+        return [dict(zip(QUEUE_COLUMNS, row)) for row in rows]
+
+    def patch(self, entries, deleted_pids=()):
+        """Replaces the entries of changed posts and drops deleted posts.
+
+        Args:
+            entries (dict): The new entry of each changed post keyed on pid,
+                None for posts that left the queue
+            deleted_pids (iterable): The pids of the posts that were deleted
+
+        Returns:
+            bool: True if any entry of the queue changed
+        """
+        current = {entry["post_id"]: entry for entry in self.entries()}
+        entries = {pid: entry for pid, entry in entries.items()
+                   if current.get(pid) != entry}
+        removed = set(entries) | (set(deleted_pids) & set(current))
+        if not removed:
+            return False
+        kept = [entry for pid, entry in current.items() if pid not in removed]
+        self._columns = InstructorQueue.from_entries(
+            kept + list(entries.values()))._columns
+        self._sort_keys = None
+        self._positions = {}
+        return True
+
+    def overlay(self, dashboard_posts):
+        """Returns a copy of the queue with the dashboard columns of the
+        posts, as read by get_dashboard_posts. The other columns are shared
+        with this queue. Posts without an entry are unassigned and keep the
+        resolved state the Parser found on Piazza.
+        """
+        columns = dict(self._columns)
+        posts = [dashboard_posts.get(pid, {}) for pid in columns["post_id"]]
+        columns["assignees"] = [post.get("assignees", []) for post in posts]
+        columns["resolved"] = [post.get("resolved", resolved) for post, resolved
+                               in zip(posts, self._columns["resolved"])]
+        return InstructorQueue(columns)
+
+    def _rows(self, indices, fields=None):
+        fields = fields or QUEUE_COLUMNS + DERIVED_COLUMNS
+        columns = [name for name in fields if name in self._columns]
+        rows = []
+        for i in indices:
+            row = {name: self._columns[name][i] for name in columns}
+            if "pretty_date" in fields:
+                row["pretty_date"] = pretty_date(self._columns["last_modified"][i])
+            rows.append(row)
+        return rows
+
+    def _sort_key_index(self):
+        if self._sort_keys is None:
+            self._sort_keys = list(zip(self._columns["num_unresolved_followups"],
+                                       self._columns["num_views"],
+                                       self._columns["post_id"]))
+        return self._sort_keys
+
+    def _position_index(self, name):
+        """Maps each value of a column, or each item of a list column, to the
+        sorted positions of the entries that have it.
+        """
+        if name not in self._positions:
+            positions = {}
+            for i, value in enumerate(self._columns[name]):
+                for item in (value if isinstance(value, list) else [value]):
+                    positions.setdefault(item, []).append(i)
+            self._positions[name] = positions
+        return self._positions[name]
+
+    def _filtered_positions(self, filters):
+        """Returns the sorted positions of the entries matching every filter,
+        or None if there are no filters.
+        """
+        matching = None
+        for name, value in filters.items():
+            if value is None:
+                continue
+            positions = self._position_index(name).get(value, [])
+            matching = set(positions) if matching is None else matching & set(positions)
+        return sorted(matching) if matching is not None else None
+
+    def page(self, limit, cursor=None, tag=None, assignee=None, resolved=None,
+             fields=None):
+        """Returns a page of the queue, in queue order.
+
+        Args:
+            limit (int): The maximum number of posts in the page
+            cursor (str): The next_cursor of the previous page, if any
+            tag (str): Only return posts with this tag
+            assignee (str): Only return posts assigned to this instructor
+            resolved (bool): Only return posts in this resolved state
+            fields (list): The fields of each post to return, defaults to all
+
+        Returns:
+            (tuple): The posts of the page and the cursor of the next page,
+                which is None on the last page
+
+        Raises:
+            ValueError: If the cursor is invalid
+        """
+        start = 0
+        if cursor is not None:
+            start = bisect_right(self._sort_key_index(), decode_cursor(cursor))
+
+        positions = self._filtered_positions(
+            {"tags": tag, "assignees": assignee, "resolved": resolved})
+        if positions is None:
+            indices = range(start, min(start + limit, len(self)))
+            has_more = start + limit < len(self)
+        else:
+            first = bisect_left(positions, start)
+            indices = positions[first:first + limit]
+            has_more = first + limit < len(positions)
+
+        next_cursor = None
+        if has_more and len(indices) > 0:
+            next_cursor = encode_cursor(self._sort_key_index()[indices[-1]])
+        return self._rows(indices, fields), next_cursor
+
+    def top(self, number_of_posts):
+        """Returns the top instructor attention needed posts.
+
+        Posts are narrowed down to those without an instructor answer and then
+        without any answer, for as long as more than number_of_posts remain.
+        """
+        indices = range(len(self))
+        if len(indices) <= number_of_posts:
+            return self._rows(indices)
+
+        i_answer = self._columns["i_answer"]
+        indices = [i for i in indices if not i_answer[i]]
+        if len(indices) <= number_of_posts:
+            return self._rows(indices)
+
+        s_answer = self._columns["s_answer"]
+        indices = [i for i in indices if not s_answer[i]]
+        return self._rows(indices[:number_of_posts])
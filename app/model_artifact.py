@@ -0,0 +1,288 @@
+"""Single file, memory mappable storage for the TF-IDF models of a course.
+
+An artifact is laid out as:
+
+    MAGIC | version (uint32) | header length (uint32) | JSON header | arrays
+
+The JSON header maps every array name to its dtype, shape and byte offset.
+Each array is stored raw and aligned to ARRAY_ALIGNMENT bytes so it can be
+viewed directly out of a read-only memory map, which lets multiple worker
+processes share the same pages of a model.
+
+Besides the arrays of each model, an artifact holds the fused matrix that
+Parqr scores queries against, so it can be served straight out of the map.
+"""
+import json
+import os
+import struct
+
+import numpy as np
+from scipy import sparse
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.preprocessing import normalize
+
+from app.constants import TFIDF_MODELS, TFIDF_MODEL_WEIGHTS
+
+MAGIC = b"PARQR\x00\x00\x00"
+ARTIFACT_VERSION = 1
+ARRAY_ALIGNMENT = 64
+_PREAMBLE = struct.Struct("<8sII")
+
+
+def _align(offset):
+    return (offset + ARRAY_ALIGNMENT - 1) // ARRAY_ALIGNMENT * ARRAY_ALIGNMENT
+
+
+def write_arrays(path, arrays):
+    """Writes a dict of numpy arrays to path in the artifact format.
+
+    Args:
+        path (str): The file to write to
+        arrays (dict): The arrays to store keyed on their name
+    """
+    arrays = {name: np.ascontiguousarray(array)
+              for name, array in arrays.items()}
+
+    index = {}
+    offset = 0
+    for name, array in arrays.items():
+        index[name] = {
+            "dtype": array.dtype.str,
+            "shape": list(array.shape),
+            "offset": offset,
+        }
+        offset = _align(offset + array.nbytes)
+
+    header = json.dumps(index).encode("utf8")
+    data_start = _align(_PREAMBLE.size + len(header))
+
+    # Write to a temporary file and rename it so that processes which still
+    # have the previous artifact mapped keep reading the old inode.
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as output_file:
+        output_file.write(_PREAMBLE.pack(MAGIC, ARTIFACT_VERSION, len(header)))
+        output_file.write(header)
+        for name, array in arrays.items():
+            output_file.seek(data_start + index[name]["offset"])
+            output_file.write(array.tobytes())
+        output_file.truncate(data_start + offset)
+    os.replace(tmp_path, path)
+
+
+def read_arrays(path):
+    """Memory maps an artifact written by write_arrays.
+
+    Args:
+        path (str): The artifact to read
+
+    Returns:
+        dict: Read-only views of the stored arrays keyed on their name
+
+    Raises:
+        ValueError: If the file is not an artifact of a supported version
+    """
+    with open(path, "rb") as input_file:
+        magic, version, header_len = _PREAMBLE.unpack(
+            input_file.read(_PREAMBLE.size))
+        if magic != MAGIC:
+            raise ValueError("{} is not a model artifact".format(path))
+        if version != ARTIFACT_VERSION:
+            raise ValueError("Unsupported model artifact version {} in {}"
+                             .format(version, path))
+        index = json.loads(input_file.read(header_len).decode("utf8"))
+
+    data_start = _align(_PREAMBLE.size + header_len)
+    buffer = np.memmap(path, dtype=np.uint8, mode="r")
+
+    arrays = {}
+    for name, info in index.items():
+        dtype = np.dtype(info["dtype"])
+        count = int(np.prod(info["shape"], dtype=np.int64))
+        start = data_start + info["offset"]
+        end = start + count * dtype.itemsize
+        arrays[name] = buffer[start:end].view(dtype).reshape(info["shape"])
+    return arrays
+
+
+def encode_terms(terms):
+    """Packs a list of strings into one UTF-8 buffer and the offsets of each
+    string in it, which unlike a fixed width string array does not pad every
+    term to the length of the longest one.
+
+    Returns:
+        (tuple): The uint8 buffer and the int64 offsets, one more than terms
+    """
+    encoded = [term.encode("utf8") for term in terms]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(term) for term in encoded], dtype=np.int64)
+    return np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets
+
+
+def decode_terms(name, arrays):
+    """Returns the vocabulary terms of the model stored under name, in the
+    order of their columns.
+    """
+    buffer = arrays["{}/terms_utf8".format(name)].tobytes()
+    offsets = arrays["{}/term_offsets".format(name)].tolist()
+    return [buffer[start:end].decode("utf8")
+            for start, end in zip(offsets, offsets[1:])]
+
+
+def encode_model(name, vectorizer, matrix, pid_list):
+    """Flattens a fitted model into the raw arrays stored in an artifact."""
+    matrix = sparse.csr_matrix(matrix)
+    terms = [None] * len(vectorizer.vocabulary_)
+    for term, column in vectorizer.vocabulary_.items():
+        terms[column] = term
+    terms_utf8, term_offsets = encode_terms(terms)
+
+    return {
+        "{}/data".format(name): matrix.data,
+        "{}/indices".format(name): matrix.indices,
+        "{}/indptr".format(name): matrix.indptr,
+        "{}/shape".format(name): np.array(matrix.shape, dtype=np.int64),
+        "{}/post_ids".format(name): np.asarray(pid_list, dtype=np.int64),
+        "{}/terms_utf8".format(name): terms_utf8,
+        "{}/term_offsets".format(name): term_offsets,
+        "{}/idf".format(name): np.asarray(vectorizer.idf_),
+    }
+
+
+def decode_vectorizer(name, arrays):
+    """Rebuilds the vectorizer and pid list of the model stored under name,
+    without the matrix of the model.
+
+    Returns:
+        (tuple): The vectorizer and pid list of the model, or a tuple of
+            Nones if the model is not in the artifact
+    """
+    if "{}/data".format(name) not in arrays:
+        return None, None
+
+    # Stop words never made it into the vocabulary when the model was fit, so
+    # a fixed vocabulary is enough to transform queries the same way.
+    terms = decode_terms(name, arrays)
+    vectorizer = TfidfVectorizer(analyzer='word', lowercase=True,
+                                 vocabulary={term: column for column, term
+                                             in enumerate(terms)})
+    vectorizer.idf_ = np.asarray(arrays["{}/idf".format(name)])
+
+    return vectorizer, arrays["{}/post_ids".format(name)]
+
+
+def decode_model(name, arrays):
+    """Rebuilds the model stored under name in a dict of artifact arrays.
+
+    Returns:
+        (tuple): The vectorizer, matrix and pid list of the model, or a tuple
+            of Nones if the model is not in the artifact
+    """
+    vectorizer, post_ids = decode_vectorizer(name, arrays)
+    if vectorizer is None:
+        return None, None, None
+
+    matrix = sparse.csr_matrix(
+        (arrays["{}/data".format(name)],
+         arrays["{}/indices".format(name)],
+         arrays["{}/indptr".format(name)]),
+        shape=tuple(int(dim) for dim in arrays["{}/shape".format(name)]),
+        copy=False
+    )
+    return vectorizer, matrix, post_ids
+
+
+def fuse_models(models, weights=None):
+    """Stacks the matrices of several models into the single matrix that the
+    scores of a query are computed from.
+
+    The rows of each model's matrix are aligned to the sorted union of the
+    pids of all the models, normalized, and weighted. The query vectors of
+    each model are stacked the same way at query time, so the weighted
+    combination of the cosine similarities of all the models is a single
+    matrix-vector product.
+
+    Args:
+        models (list): Tuples of (name, matrix, pid_list) of the models, in
+            the order of their columns in the fused matrix
+        weights (dict): The weight of each model, keyed on TFIDF_MODELS
+            (Default: TFIDF_MODEL_WEIGHTS)
+
+    Returns:
+        (tuple): The fused csr matrix, or None if there are no models, and
+            the pids of its rows
+    """
+    weights = weights or TFIDF_MODEL_WEIGHTS
+    if not models:
+        return None, np.array([], dtype=np.int64)
+
+    post_ids = np.unique(np.concatenate(
+        [np.asarray(pid_list, dtype=np.int64) for _, _, pid_list in models]))
+
+    blocks = []
+    for name, matrix, pid_list in models:
+        rows = np.searchsorted(post_ids, np.asarray(pid_list, dtype=np.int64))
+        alignment = sparse.csr_matrix(
+            (np.ones(len(rows)), (rows, np.arange(len(rows)))),
+            shape=(len(post_ids), len(rows))
+        )
+        matrix = normalize(sparse.csr_matrix(matrix)) * weights[name]
+        blocks.append(alignment.dot(matrix))
+
+    return sparse.hstack(blocks, format='csr'), post_ids
+
+
+def encode_fused(models, weights=None):
+    """Fuses the models of a course into the raw arrays stored in an artifact.
+
+    Args:
+        models (dict): Tuples of (vectorizer, matrix, pid_list) keyed on the
+            TFIDF_MODELS name of the model
+        weights (dict): The weight of each model, keyed on TFIDF_MODELS
+            (Default: TFIDF_MODEL_WEIGHTS)
+    """
+    weights = weights or TFIDF_MODEL_WEIGHTS
+    names = [name for name in TFIDF_MODELS if name in models]
+    matrix, post_ids = fuse_models(
+        [(name, models[name][1], models[name][2]) for name in names], weights)
+    if matrix is None:
+        return {}
+
+    return {
+        "fused/data": matrix.data,
+        "fused/indices": matrix.indices,
+        "fused/indptr": matrix.indptr,
+        "fused/shape": np.array(matrix.shape, dtype=np.int64),
+        "fused/post_ids": post_ids,
+        "fused/models": np.array([name.value for name in names], dtype=np.int64),
+        "fused/weights": np.array([weights[name] for name in names]),
+    }
+
+
+def decode_fused(arrays, weights=None):
+    """Maps the fused matrix of an artifact without copying it.
+
+    Args:
+        arrays (dict): The arrays of the artifact
+        weights (dict): The weights the matrix must have been fused with,
+            keyed on TFIDF_MODELS (Default: TFIDF_MODEL_WEIGHTS)
+
+    Returns:
+        (tuple): The TFIDF_MODELS names of the models in the order of their
+            columns, the fused matrix and the pids of its rows, or a tuple of
+            Nones if the artifact has no fused matrix for these weights
+    """
+    weights = weights or TFIDF_MODEL_WEIGHTS
+    if "fused/data" not in arrays:
+        return None, None, None
+
+    names = [TFIDF_MODELS(int(value)) for value in arrays["fused/models"]]
+    if not np.array_equal(arrays["fused/weights"],
+                          [weights[name] for name in names]):
+        return None, None, None
+
+    matrix = sparse.csr_matrix(
+        (arrays["fused/data"], arrays["fused/indices"], arrays["fused/indptr"]),
+        shape=tuple(int(dim) for dim in arrays["fused/shape"]),
+        copy=False
+    )
+    return names, matrix, arrays["fused/post_ids"]
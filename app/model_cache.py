@@ -1,105 +1,196 @@
 import pickle
 import os.path
-import boto3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
 import botocore
+from boto3.s3.transfer import TransferConfig
+
+from app.aws import get_client
+from app.constants import MODEL_FETCH_WORKERS
+from app.model_artifact import (
+    ARTIFACT_VERSION,
+    decode_model,
+    encode_fused,
+    encode_model,
+    read_arrays,
+    write_arrays
+)
 
 
 class ModelCache(object):
     tmp = '/tmp/'
+    bucket = 'parqr-models'
+    etag_suffix = '.etag'
+    course_key_format = '{}_models.v' + str(ARTIFACT_VERSION) + '.parqr'
     model_key_format = '{}_{}_vectorizer.pkl'
     matrix_key_format = '{}_{}_matrix.pkl'
     pid_list_key_format = '{}_{}_pid_list.pkl'
 
-    def __init__(self):
-        self.s3 = boto3.client('s3')
+    def __init__(self, max_workers=MODEL_FETCH_WORKERS):
+        self.s3 = get_client('s3')
+        self._max_workers = max_workers
+        self._transfer_config = TransferConfig(max_concurrency=max_workers)
+        self._stats_lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "bytes": 0}
 
-    def store_model(self, cid, name, model):
-        key = self.model_key_format.format(cid, name)
-        self.s3.put_object(
-            Bucket="parqr-models",
-            Key=key,
-            Body=pickle.dumps(model)
-        )
+    def _record(self, hit, nbytes=0):
+        with self._stats_lock:
+            self.stats["hits" if hit else "misses"] += 1
+            self.stats["bytes"] += nbytes
 
-    def store_matrix(self, cid, name, matrix):
-        key = self.matrix_key_format.format(cid, name)
-        self.s3.put_object(
-            Bucket="parqr-models",
-            Key=key,
-            Body=pickle.dumps(matrix)
-        )
+    def _fetch(self, key):
+        """Makes sure /tmp holds the current version of an object in S3.
 
-    def store_pid_list(self, cid, name, pid_list):
-        key = self.pid_list_key_format.format(cid, name)
-        self.s3.put_object(
-            Bucket="parqr-models",
-            Key=key,
-            Body=pickle.dumps(pid_list)
-        )
+        The ETag of every downloaded object is kept next to it in /tmp, so a
+        local copy is only reused while it still matches the object in S3.
 
-    def get_all(self, cid, name):
-        model = self.get_model(cid, name)
-        matrix = self.get_matrix(cid, name)
-        pid_list = self.get_pid_list(cid, name)
+        Args:
+            key (str): The key of the object in the models bucket
+
+        Returns:
+            bool: True if the object is available in /tmp, False otherwise
+        """
+        path = self.tmp + key
+        local_etag = None
+        if os.path.exists(path) and os.path.exists(path + self.etag_suffix):
+            with open(path + self.etag_suffix, "r") as etag_file:
+                local_etag = etag_file.read()
+
+        try:
+            head = self.s3.head_object(Bucket=self.bucket, Key=key)
+        except botocore.exceptions.ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey"):
+                return False
+            # S3 is unreachable, so serve whatever copy we have
+            print("Unable to revalidate '{}': {}".format(key, e))
+            return os.path.exists(path)
+
+        etag = head.get("ETag")
+        if local_etag is not None and local_etag == etag:
+            self._record(hit=True)
+            return True
+
+        try:
+            self.s3.download_file(self.bucket, key, path,
+                                  ExtraArgs={"IfMatch": etag},
+                                  Config=self._transfer_config)
+        except botocore.exceptions.ClientError as e:
+            print("Could not download '{}': {}".format(key, e))
+            return os.path.exists(path)
+
+        with open(path + self.etag_suffix, "w") as etag_file:
+            etag_file.write(etag)
+        self._record(hit=False, nbytes=head.get("ContentLength", 0))
+        return True
+
+    def _fetch_all(self, keys):
+        """Fetches several objects concurrently.
+
+        Returns:
+            dict: Whether each key is available in /tmp
+        """
+        with ThreadPoolExecutor(max_workers=self._max_workers) as pool:
+            return dict(zip(keys, pool.map(self._fetch, keys)))
+
+    def _load_pickle(self, key, available):
+        if not available:
+            print("Could not find '{}'".format(key))
+            return None
+
+        with open(self.tmp + key, "rb") as input_file:
+            return pickle.load(input_file)
+
+    def store_course(self, cid, models, arrays=None):
+        """Stores all the models of a course and their fused matrix as a
+        single artifact.
 
-        return model, matrix, pid_list
+        Args:
+            cid (str): The course id of the models
+            models (dict): Tuples of (vectorizer, matrix, pid_list) keyed on
+                the TFIDF_MODELS name of the model
+            arrays (dict): Additional raw arrays to store in the artifact
+        """
+        arrays = dict(arrays or {})
+        for name, (vectorizer, matrix, pid_list) in models.items():
+            arrays.update(encode_model(name.name, vectorizer, matrix, pid_list))
+        arrays.update(encode_fused(models))
+
+        key = self.course_key_format.format(cid)
+        write_arrays(self.tmp + key, arrays)
+        self.s3.upload_file(self.tmp + key, self.bucket, key)
+
+    def get_course_arrays(self, cid):
+        """Memory maps the raw arrays of the artifact of a course.
+
+        Args:
+            cid (str): The course id of the models
+
+        Returns:
+            dict: The arrays of the artifact keyed on their name, or None if
+                the course has no artifact
+        """
+        key = self.course_key_format.format(cid)
+
+        if not self._fetch(key):
+            print("Could not find MODELS for cid '{}'".format(cid))
+            return None
+        print("Fetched models for cid '{}', cache stats: {}".format(cid, self.stats))
+
+        return read_arrays(self.tmp + key)
+
+    def get_course(self, cid, names):
+        """Loads the models of a course from its artifact. The arrays of the
+        models are memory mapped from the copy of the artifact in /tmp.
+
+        Args:
+            cid (str): The course id of the models
+            names (list): The TFIDF_MODELS names of the models to load
+
+        Returns:
+            dict: Tuples of (vectorizer, matrix, pid_list) keyed on the name
+                of the model, or None if the course has no artifact
+        """
+        arrays = self.get_course_arrays(cid)
+        if arrays is None:
+            return None
+        return {name: decode_model(name.name, arrays) for name in names}
+
+    def get_all_models(self, cid, names):
+        """Loads the legacy pickled models of a course, fetching every pickle
+        concurrently.
+
+        Returns:
+            dict: Tuples of (vectorizer, matrix, pid_list) keyed on the name
+                of the model
+        """
+        keys = {
+            name: (self.model_key_format.format(cid, name),
+                   self.matrix_key_format.format(cid, name),
+                   self.pid_list_key_format.format(cid, name))
+            for name in names
+        }
+        available = self._fetch_all([key for model_keys in keys.values()
+                                     for key in model_keys])
+        print("Fetched pickled models for cid '{}', cache stats: {}"
+              .format(cid, self.stats))
+
+        return {
+            name: tuple(self._load_pickle(key, available[key]) for key in model_keys)
+            for name, model_keys in keys.items()
+        }
+
+    def get_all(self, cid, name):
+        return self.get_all_models(cid, [name])[name]
 
     def get_model(self, cid, name):
         key = self.model_key_format.format(cid, name)
-
-        if os.path.exists(self.tmp + key):
-            print("Loading model found in /tmp")
-            with open(self.tmp + key, "rb") as input_file:
-                model = pickle.load(input_file)
-        else:
-            try:
-                self.s3.download_file("parqr-models", key, self.tmp + key)
-            except botocore.exceptions.ClientError as e:
-                print("Could not find MODEL for cid '{}' with "
-                      "name '{}'".format(cid, name))
-                model = None
-            else:
-                print("Downloaded model from s3")
-                with open(self.tmp + key, "rb") as input_file:
-                    model = pickle.load(input_file)
-
-        return model
+        return self._load_pickle(key, self._fetch(key))
 
     def get_matrix(self, cid, name):
         key = self.matrix_key_format.format(cid, name)
-
-        if os.path.exists(self.tmp + key):
-            print("Loading matrix found in /tmp")
-            with open(self.tmp + key, "rb") as input_file:
-                matrix = pickle.load(input_file)
-        else:
-            try:
-                self.s3.download_file("parqr-models", key, self.tmp + key)
-            except botocore.exceptions.ClientError as e:
-                print("Could not find MODEL for cid '{}' with "
-                      "name '{}'".format(cid, name))
-                matrix = None
-            else:
-                print("Downloaded matrix from s3")
-                with open(self.tmp + key, "rb") as input_file:
-                    matrix = pickle.load(input_file)
-        return matrix
+        return self._load_pickle(key, self._fetch(key))
 
     def get_pid_list(self, cid, name):
         key = self.pid_list_key_format.format(cid, name)
-        if os.path.exists(self.tmp + key):
-            print("Loading pid_list found in /tmp")
-            with open(self.tmp + key, "rb") as input_file:
-                pid_list = pickle.load(input_file)
-        else:
-            try:
-                self.s3.download_file("parqr-models", key, self.tmp + key)
-            except botocore.exceptions.ClientError as e:
-                print("Could not find MODEL for cid '{}' with "
-                      "name '{}'".format(cid, name))
-                pid_list = None
-            else:
-                print("Downloaded pid_list from s3")
-                with open(self.tmp + key, "rb") as input_file:
-                    pid_list = pickle.load(input_file)
-        return pid_list
+        return self._load_pickle(key, self._fetch(key))
@@ -1,18 +1,34 @@
 import warnings
+from collections import Counter
 
 import time
-import boto3
 import numpy as np
 import simplejson as json
-from sklearn.feature_extraction.text import TfidfVectorizer, ENGLISH_STOP_WORDS
+from scipy import sparse
+from sklearn.feature_extraction.text import (
+    CountVectorizer,
+    TfidfVectorizer,
+    ENGLISH_STOP_WORDS
+)
+from sklearn.preprocessing import normalize
 
-from app.constants import TFIDF_MODELS
+from app.aws import get_client, get_resource
+from app.constants import (
+    TFIDF_MODELS,
+    DDB_BATCH_GET_MAX_KEYS,
+    DDB_MAX_RETRIES,
+    MODEL_DRIFT_THRESHOLD,
+    MODEL_FULL_REFIT_INTERVAL_S,
+    MODEL_TRAIN_CLEAN_CHUNK_SIZE
+)
+from app.model_artifact import decode_model, decode_terms
 from app.model_cache import ModelCache
+from app.string_utils import cached_words, get_model_words, is_model_post
 
 warnings.filterwarnings("ignore")
 
 STOP_WORDS = set(ENGLISH_STOP_WORDS)
-lambda_client = boto3.client('lambda')
+lambda_client = get_client('lambda')
 
 
 class SetEncoder(json.JSONEncoder):
@@ -22,28 +38,258 @@ class SetEncoder(json.JSONEncoder):
         return json.JSONEncoder.default(self, obj)
 
 
+def tfidf_from_counts(counts, vocabulary):
+    """Builds the vectorizer and matrix that fitting a TfidfVectorizer on the
+    documents counted in counts would produce, without tokenizing them again.
+
+    Args:
+        counts (sparse.csr_matrix): The term counts of each document
+        vocabulary (dict): The column of each term in counts
+
+    Returns:
+        (tuple): The TfidfVectorizer and the TF-IDF matrix. The matrix has the
+            same sparsity structure as counts.
+    """
+    # Same smoothed idf as sklearn's TfidfTransformer
+    df = np.bincount(counts.indices, minlength=counts.shape[1])
+    idf = np.log((1 + counts.shape[0]) / (1 + df)) + 1
+
+    matrix = sparse.csr_matrix(
+        (counts.data * idf[counts.indices], counts.indices, counts.indptr),
+        shape=counts.shape
+    )
+    matrix = normalize(matrix, copy=False)
+
+    vectorizer = TfidfVectorizer(analyzer='word',
+                                 stop_words=STOP_WORDS,
+                                 lowercase=True,
+                                 vocabulary=vocabulary)
+    vectorizer.idf_ = idf
+    return vectorizer, matrix
+
+
+def update_counts(counts, vocabulary, post_ids, removed_pids, words, pid_list):
+    """Replaces rows of a term count matrix without recounting the others.
+
+    Args:
+        counts (sparse.csr_matrix): The term counts of each post
+        vocabulary (dict): The column of each term in counts
+        post_ids (np.ndarray): The pid of each row in counts
+        removed_pids (set): The pids whose rows are dropped
+        words (list): The words of the posts to add
+        pid_list (list): The pid of each string in words
+
+    Returns:
+        (tuple): The updated counts, vocabulary and post_ids. Terms that no
+            longer appear in any post are pruned from the vocabulary, so the
+            result matches counting every post from scratch.
+    """
+    keep = ~np.isin(post_ids, np.array(list(removed_pids), dtype=np.int64))
+    counts = counts[keep]
+    post_ids = np.concatenate([post_ids[keep], np.asarray(pid_list, dtype=np.int64)])
+
+    analyzer = CountVectorizer(analyzer='word',
+                               stop_words=STOP_WORDS,
+                               lowercase=True).build_analyzer()
+    vocabulary = dict(vocabulary)
+    data, indices, indptr = [], [], [0]
+    for doc in words:
+        doc_counts = Counter(vocabulary.setdefault(term, len(vocabulary))
+                             for term in analyzer(doc))
+        indices.extend(doc_counts.keys())
+        data.extend(doc_counts.values())
+        indptr.append(len(indices))
+
+    num_terms = len(vocabulary)
+    new_counts = sparse.csr_matrix(
+        (np.array(data, dtype=np.int64), np.array(indices, dtype=np.int32),
+         np.array(indptr, dtype=np.int64)),
+        shape=(len(words), num_terms)
+    )
+    counts = sparse.csr_matrix((counts.data, counts.indices, counts.indptr),
+                               shape=(counts.shape[0], num_terms))
+    counts = sparse.vstack([counts, new_counts], format='csr')
+
+    used = np.bincount(counts.indices, minlength=num_terms) > 0
+    if not used.all():
+        columns = np.cumsum(used) - 1
+        counts = sparse.csr_matrix(
+            (counts.data, columns[counts.indices], counts.indptr),
+            shape=(counts.shape[0], int(used.sum()))
+        )
+        vocabulary = {term: int(columns[column])
+                      for term, column in vocabulary.items() if used[column]}
+
+    return counts, vocabulary, post_ids
+
+
 class ModelTrain(object):
 
     def __init__(self, course_id):
         """ModelTrain constructor"""
         self.model_cache = ModelCache()
-        self.posts = boto3.resource('dynamodb').Table(course_id)
+        self.posts = get_resource('dynamodb').Table(course_id)
 
-    def persist_models(self, cid):
+    def persist_models(self, cid, changed_pids=None, deleted_pids=None,
+                       model_pids=None):
         """Vectorizes the information in database into multiple TF-IDF models.
-        The models are persisted by pickling the TF-IDF sklearn models,
-        storing the sparse vector matrix as a npz file, and saving the
-        pid_list for each model as a csv file.
+        The vocabulary and idf vector of each vectorizer, the sparse vector
+        matrix, the term counts, and the pid_list of every model are persisted
+        together as a single model artifact for the course.
+
+        When changed_pids or deleted_pids are given, only the rows of those
+        posts are recounted and patched into the stored models. A full refit
+        still runs every MODEL_FULL_REFIT_INTERVAL_S seconds, or once more
+        than MODEL_DRIFT_THRESHOLD of the posts of a model were patched.
 
         Args:
             cid: The course id of the class to vectorize
+            changed_pids: The pids of the posts that were added or edited
+            deleted_pids: The pids of the posts that were deleted
+            model_pids: The pids of changed_pids whose text changed for each
+                model, keyed on the TFIDF_MODELS name. Models that are left
+                out keep their rows, defaults to every model changing
         """
         print('Vectorizing words from course: {}'.format(cid))
 
+        if changed_pids is not None or deleted_pids is not None:
+            arrays = self.model_cache.get_course_arrays(cid)
+            if arrays is not None and not self._needs_full_refit(arrays):
+                self._update_models(cid, arrays, set(changed_pids or []),
+                                    set(deleted_pids or []), model_pids)
+                self._publish_model_version(cid)
+                return
+            print('Running a full refit for course: {}'.format(cid))
+
+        posts = self._get_all_posts()
+        models = {}
+        arrays = {"meta/last_full_fit": np.array([time.time()])}
         for model in list(TFIDF_MODELS):
-            self._create_tfidf_model(cid, model)
+            tfidf_model = self._create_tfidf_model(cid, model, posts)
+            if tfidf_model is not None:
+                vectorizer, matrix, pid_list, counts = tfidf_model
+                models[model] = vectorizer, matrix, pid_list
+                arrays["{}/counts".format(model.name)] = counts.data
+                arrays["{}/num_updated".format(model.name)] = np.zeros(1, dtype=np.int64)
+
+        self.model_cache.store_course(cid, models, arrays)
+        self._publish_model_version(cid)
+
+    def _needs_full_refit(self, arrays):
+        """Checks whether the stored models of a course are too old or have
+        been patched too often to keep updating them incrementally.
+
+        Args:
+            arrays (dict): The arrays of the course's model artifact
+        """
+        if "meta/last_full_fit" not in arrays:
+            return True
+        if time.time() - arrays["meta/last_full_fit"][0] > MODEL_FULL_REFIT_INTERVAL_S:
+            return True
+
+        for model_name in TFIDF_MODELS:
+            if "{}/data".format(model_name.name) not in arrays:
+                continue
+            if "{}/counts".format(model_name.name) not in arrays:
+                return True
+            num_posts = len(arrays["{}/post_ids".format(model_name.name)])
+            num_updated = arrays["{}/num_updated".format(model_name.name)][0]
+            if num_updated > MODEL_DRIFT_THRESHOLD * max(num_posts, 1):
+                print("Vocabulary drift for model {}".format(model_name.name))
+                return True
+        return False
+
+    def _update_models(self, cid, arrays, changed_pids, deleted_pids,
+                       model_pids=None):
+        """Patches the rows of changed and deleted posts into the stored models.
+
+        Args:
+            cid (str): The course id of interest
+            arrays (dict): The arrays of the course's model artifact
+            changed_pids (set): The pids of the posts that were added or edited
+            deleted_pids (set): The pids of the posts that were deleted
+            model_pids (dict): The changed pids of each model, or None if
+                every model changed
+        """
+        print('Updating {} changed and {} deleted posts for course: {}'
+              .format(len(changed_pids), len(deleted_pids), cid))
+        posts = self._get_posts(changed_pids)
+
+        models = {}
+        new_arrays = {"meta/last_full_fit": np.array(arrays["meta/last_full_fit"])}
+        for model_name in TFIDF_MODELS:
+            name = model_name.name
+            if model_pids is None:
+                model_changed = changed_pids
+            else:
+                model_changed = set(model_pids.get(name, []))
+            removed_pids = model_changed | deleted_pids
+
+            if "{}/data".format(name) in arrays and not model_changed and \
+                    not np.isin(arrays["{}/post_ids".format(name)],
+                                list(deleted_pids)).any():
+                # Nothing to patch, so the stored model is carried over as is
+                vectorizer, matrix, post_ids = decode_model(name, arrays)
+                models[model_name] = vectorizer, matrix, post_ids
+                new_arrays["{}/counts".format(name)] = np.array(arrays["{}/counts".format(name)])
+                new_arrays["{}/num_updated".format(name)] = np.array(arrays["{}/num_updated".format(name)])
+                continue
+
+            if "{}/data".format(name) in arrays:
+                shape = tuple(int(dim) for dim in arrays["{}/shape".format(name)])
+                counts = sparse.csr_matrix(
+                    (arrays["{}/counts".format(name)],
+                     arrays["{}/indices".format(name)],
+                     arrays["{}/indptr".format(name)]),
+                    shape=shape
+                )
+                terms = decode_terms(name, arrays)
+                vocabulary = {term: column for column, term in enumerate(terms)}
+                post_ids = np.asarray(arrays["{}/post_ids".format(name)])
+                num_updated = int(arrays["{}/num_updated".format(name)][0])
+            else:
+                counts = sparse.csr_matrix((0, 0), dtype=np.int64)
+                vocabulary = {}
+                post_ids = np.array([], dtype=np.int64)
+                num_updated = 0
+
+            changed_posts = [post for post in posts
+                             if int(post["post_id"]) in model_changed]
+            if changed_posts:
+                words, pid_list = self._get_words_for_model(model_name, cid, changed_posts)
+            else:
+                words, pid_list = np.array([]), np.array([], dtype=np.int64)
 
-    def _create_tfidf_model(self, cid, model_name):
+            num_updated += int(np.isin(post_ids, list(removed_pids)).sum()) + len(pid_list)
+            counts, vocabulary, post_ids = update_counts(
+                counts, vocabulary, post_ids, removed_pids, list(words), pid_list)
+            if counts.shape[0] == 0 or len(vocabulary) == 0:
+                continue
+
+            vectorizer, matrix = tfidf_from_counts(counts, vocabulary)
+            models[model_name] = vectorizer, matrix, post_ids
+            new_arrays["{}/counts".format(name)] = counts.data
+            new_arrays["{}/num_updated".format(name)] = np.array([num_updated], dtype=np.int64)
+
+        self.model_cache.store_course(cid, models, new_arrays)
+
+    def _publish_model_version(self, cid):
+        """Bumps the model version of the course so that warm Parqr instances
+        reload the new models without waiting for their reload delay.
+
+        Args:
+            cid: The course id of the class that was vectorized
+        """
+        courses = get_resource('dynamodb').Table('Courses')
+        courses.update_item(
+            Key={"course_id": cid},
+            UpdateExpression="SET model_version = :model_version",
+            ExpressionAttributeValues={
+                ":model_version": int(time.time() * 1000)
+            }
+        )
+
+    def _create_tfidf_model(self, cid, model_name, posts):
         """Creates a new TfidfVectorizer model from the relevant text in course
         with given course id
 
@@ -56,20 +302,26 @@ class ModelTrain(object):
             cid (str): The course id of interest
             model_name (str): The name of the model dictated by the
                 TFIDF_MODELS enum
+            posts (list): Every post in the course
+
+        Returns:
+            (tuple): The fitted vectorizer, the matrix, the pid_list and the
+                term counts of the model, or None if there were no words for
+                the model
         """
-        words, pid_list = self._get_words_for_model(model_name, cid)
+        words, pid_list = self._get_words_for_model(model_name, cid, posts)
         # print(words, pid_list, words.size)
-        if words.size != 0:
-            vectorizer = TfidfVectorizer(analyzer='word',
-                                         stop_words=STOP_WORDS,
-                                         lowercase=True)
-            matrix = vectorizer.fit_transform(words)
+        if words.size == 0:
+            return None
 
-            self.model_cache.store_model(cid, model_name, vectorizer)
-            self.model_cache.store_matrix(cid, model_name, matrix)
-            self.model_cache.store_pid_list(cid, model_name, pid_list)
+        count_vectorizer = CountVectorizer(analyzer='word',
+                                           stop_words=STOP_WORDS,
+                                           lowercase=True)
+        counts = count_vectorizer.fit_transform(words).tocsr()
+        vectorizer, matrix = tfidf_from_counts(counts, count_vectorizer.vocabulary_)
+        return vectorizer, matrix, pid_list, counts
 
-    def _get_words_for_model(self, model_name, cid):
+    def _get_words_for_model(self, model_name, cid, posts):
         """Retrieves the appropriate text for a given course and model name.
 
         Currently there are 4 options for model_names, so the text retrieved
@@ -79,9 +331,15 @@ class ModelTrain(object):
             - The words in the post instructor answer
             - The words in the post followups
 
+        Words cached on the posts are reused as is. The remaining posts are
+        cleaned in-process, or by the Parqr-Cleaner lambda if spaCy is not
+        available here.
+
         Args:
             model_name (str): The name of the model dictated by the
                 TFIDF_MODELS enum
+            cid (str): The course id of interest
+            posts (list): The posts to retrieve the text of
 
         Returns:
             (tuple): tuple containing:
@@ -89,34 +347,64 @@ class ModelTrain(object):
                 model_pid_list (list): The pids associated with each string in
                     the words list
         """
-        posts = self._get_all_posts()
-
-        payload = {
-            "source": "ModelTrain",
-            "posts": posts,
-            "model_name": model_name.name,
-            "course_id": cid
-        }
-
         start = time.time()
-        response = lambda_client.invoke(
-            FunctionName='Parqr-Cleaner:PROD',
-            InvocationType='RequestResponse',
-            Payload=bytes(json.dumps(payload, cls=SetEncoder), encoding='utf8')
-        )
+        try:
+            words, model_pid_list = get_model_words(posts, model_name.name,
+                                                    self.posts)
+        except (ImportError, OSError) as e:
+            print("Unable to clean posts in-process: {}".format(e))
+            words, model_pid_list = self._clean_remotely(model_name, cid, posts)
         end = time.time()
-
-        cleaned_posts = json.loads(response['Payload'].read().decode("utf-8"))
-        if "words" in cleaned_posts:
-            words = cleaned_posts["words"]
-            model_pid_list = cleaned_posts["model_pid_list"]
-            print("Cleaned {} posts in {} seconds for {}".format(len(model_pid_list), end - start, model_name.name))
-        else:
-            print(cleaned_posts)
-            raise TimeoutError
+        print("Cleaned {} posts in {} seconds for {}".format(len(model_pid_list), end - start, model_name.name))
 
         return np.array(words), np.array(model_pid_list)
 
+    def _clean_remotely(self, model_name, cid, posts):
+        """Cleans the posts that have no cached words for a model with the
+        Parqr-Cleaner lambda, MODEL_TRAIN_CLEAN_CHUNK_SIZE posts at a time so
+        payloads stay well below the synchronous invoke limit.
+
+        Returns:
+            (tuple): The words of each post and the pid of each string in words
+        """
+        words = []
+        model_pid_list = []
+        uncleaned = []
+        for post in posts:
+            if not is_model_post(post, model_name.name):
+                continue
+            post_words = cached_words(post, model_name.name)
+            if post_words is not None:
+                words.append(post_words)
+                model_pid_list.append(post["post_id"])
+            else:
+                # Only send the attributes the cleaner reads
+                uncleaned.append({key: post.get(key) for key in
+                                  ("post_id", "subject", "body", "tags",
+                                   "i_answer", "s_answer", "followups")})
+
+        for i in range(0, len(uncleaned), MODEL_TRAIN_CLEAN_CHUNK_SIZE):
+            payload = {
+                "source": "ModelTrain",
+                "posts": uncleaned[i:i + MODEL_TRAIN_CLEAN_CHUNK_SIZE],
+                "model_name": model_name.name,
+                "course_id": cid
+            }
+            response = lambda_client.invoke(
+                FunctionName='Parqr-Cleaner:PROD',
+                InvocationType='RequestResponse',
+                Payload=bytes(json.dumps(payload, cls=SetEncoder), encoding='utf8')
+            )
+
+            cleaned_posts = json.loads(response['Payload'].read().decode("utf-8"))
+            if "words" not in cleaned_posts:
+                print(cleaned_posts)
+                raise TimeoutError
+            words.extend(cleaned_posts["words"])
+            model_pid_list.extend(cleaned_posts["model_pid_list"])
+
+        return words, model_pid_list
+
     def _get_all_posts(self) -> list:
         """Retrives all posts for a specific course
 
@@ -135,11 +423,43 @@ class ModelTrain(object):
         print(str(len(posts)) + " posts retrieved")
         return posts
 
+    def _get_posts(self, pids):
+        """Retrieves the posts with the given pids from the course table
+
+        Returns: a list of post objects
+
+        """
+        dynamodb = get_resource('dynamodb')
+        table_name = self.posts.name
+        pids = [int(pid) for pid in pids]
+        posts = []
+        for i in range(0, len(pids), DDB_BATCH_GET_MAX_KEYS):
+            request = {
+                table_name: {
+                    'Keys': [{"post_id": pid}
+                             for pid in pids[i:i + DDB_BATCH_GET_MAX_KEYS]]
+                }
+            }
+            retries = 0
+            while request and retries <= DDB_MAX_RETRIES:
+                response = dynamodb.batch_get_item(RequestItems=request)
+                posts.extend(response.get("Responses", {}).get(table_name, []))
+                request = response.get("UnprocessedKeys")
+                if request:
+                    time.sleep(0.05 * 2 ** retries)
+                    retries += 1
+
+        print(str(len(posts)) + " posts retrieved")
+        return posts
+
 
 def lambda_handler(event, context):
     print(event, context)
     if event.get("course_ids"):
         for course_id in event["course_ids"]:
             mt = ModelTrain(course_id)
-            mt.persist_models(course_id)
+            mt.persist_models(course_id,
+                              changed_pids=event.get("changed_pids"),
+                              deleted_pids=event.get("deleted_pids"),
+                              model_pids=event.get("model_pids"))
             print("Course with course_id {}, persisted".format(course_id))
@@ -1,33 +1,135 @@
+import os
 import random
+import threading
+from collections import OrderedDict
 from datetime import datetime, timedelta
 
 import time
 import json
-from sklearn.metrics.pairwise import cosine_similarity
+from scipy import sparse
+from sklearn.preprocessing import normalize
 import numpy as np
-import pandas as pd
-import boto3
 
+from app.aws import get_client, get_resource
+from app.model_artifact import decode_fused, decode_model, fuse_models
 from app.model_cache import ModelCache
+from app.post_metadata import PostMetadataCache
 from app.constants import (
     TFIDF_MODELS,
     SCORE_THRESHOLD,
-    COURSE_MODEL_RELOAD_DELAY_S
+    BATCH_QUERY_CHUNK_SIZE,
+    BATCH_QUERY_MAX_QUERIES,
+    COURSE_MODEL_RELOAD_DELAY_S,
+    COURSE_MODEL_MEMORY_BUDGET_MB,
+    COURSE_MODEL_VERSION_CHECK_S,
+    QUERY_CLEANER_LOCAL,
+    QUERY_CLEANER_REMOTE
 )
 from app.utils import pretty_date
 
-lambda_client = boto3.client('lambda')
+lambda_client = get_client('lambda')
 
 
 def get_posts_table(course_id):
-    dynamodb = boto3.resource('dynamodb')
+    dynamodb = get_resource('dynamodb')
     return dynamodb.Table(course_id)
 
 
 def get_ddb():
-    return boto3.client('dynamodb')
+    return get_client('dynamodb')
 
 
+def get_model_version(cid):
+    """Returns the model version ModelTrain last published for a course, or
+    None if the course has never been trained.
+    """
+    item = get_ddb().get_item(
+        TableName='Courses',
+        Key={'course_id': {'S': cid}},
+        ProjectionExpression='model_version'
+    ).get('Item', {})
+    return item.get('model_version', {}).get('N')
+
+
+class RemoteQueryCleaner(object):
+    """Cleans queries by invoking the Parqr-Cleaner lambda."""
+
+    def _invoke(self, payload):
+        response = get_client('lambda', purpose='query-cleaner').invoke(
+            FunctionName='Parqr-Cleaner:PROD',
+            InvocationType='RequestResponse',
+            Payload=bytes(json.dumps(payload), encoding='utf8')
+        )
+        return json.loads(response['Payload'].read().decode("utf-8"))
+
+    def clean(self, query):
+        payload = {
+            "source": "Query",
+            "query": query
+        }
+        return self._invoke(payload).get("clean_query")
+
+    def clean_many(self, queries, chunk_size=BATCH_QUERY_CHUNK_SIZE):
+        """Cleans a list of queries with one invocation per chunk_size
+        queries, which the cleaner answers with a list of clean_queries.
+        """
+        clean_queries = []
+        for i in range(0, len(queries), chunk_size):
+            payload = {
+                "source": "Query",
+                "queries": queries[i:i + chunk_size]
+            }
+            response = self._invoke(payload)
+            if "clean_queries" not in response:
+                print(response)
+                raise TimeoutError
+            clean_queries.extend(response["clean_queries"])
+        return clean_queries
+
+
+class LocalQueryCleaner(object):
+    """Cleans queries in-process with the same logic as the Parqr-Cleaner
+    lambda. If spaCy or its language model is not available, every query
+    falls back to the remote cleaner.
+    """
+
+    def __init__(self, fallback=None):
+        self._fallback = fallback or RemoteQueryCleaner()
+        self._available = True
+
+    def clean(self, query):
+        if self._available:
+            try:
+                from app.string_utils import clean_query
+                return clean_query(query)
+            except (ImportError, OSError) as e:
+                print("Unable to load in-process query cleaner: {}".format(e))
+                self._available = False
+
+        return self._fallback.clean(query)
+
+    def clean_many(self, queries):
+        """Cleans a list of queries in one pass through the pipeline."""
+        if self._available:
+            try:
+                from app.string_utils import clean_queries
+                return clean_queries(queries)
+            except (ImportError, OSError) as e:
+                print("Unable to load in-process query cleaner: {}".format(e))
+                self._available = False
+
+        return self._fallback.clean_many(queries)
+
+
+def get_query_cleaner(mode=None):
+    """Returns the query cleaner for the given mode. The mode defaults to
+    the QUERY_CLEANER environment variable and then to cleaning in-process.
+    """
+    mode = mode or os.environ.get('QUERY_CLEANER', QUERY_CLEANER_LOCAL)
+    if mode == QUERY_CLEANER_REMOTE:
+        return RemoteQueryCleaner()
+    return LocalQueryCleaner()
+
 
 class ModelInfo(object):
 
@@ -50,14 +152,160 @@ class ModelInfo(object):
     def post_ids(self):
         return self._post_ids
 
+    @property
+    def nbytes(self):
+        """Approximate number of bytes this model keeps resident in memory."""
+        nbytes = 0
+        if self._matrix is not None:
+            nbytes += (self._matrix.data.nbytes + self._matrix.indices.nbytes +
+                       self._matrix.indptr.nbytes)
+        if self._post_ids is not None:
+            nbytes += np.asarray(self._post_ids).nbytes
+        if self._vectorizer is not None:
+            idf = getattr(self._vectorizer, 'idf_', None)
+            if idf is not None:
+                nbytes += idf.nbytes
+            # Rough estimate of a str -> int dict entry in CPython
+            nbytes += 100 * len(getattr(self._vectorizer, 'vocabulary_', {}))
+        return nbytes
+
+
+class FusedScorer(object):
+    """Scores a query against every model of a course in one sparse product.
+
+    The matrices of all the models are fused into one matrix by fuse_models.
+    ModelTrain stores the fused matrix in the artifact of a course, so it is
+    served straight out of the memory map rather than rebuilt in each
+    process. The query vectors of each model are stacked the same way, so the
+    weighted combination of the cosine similarities of all the models is a
+    single matrix-vector product.
+    """
+
+    def __init__(self, vectorizers, matrix, post_ids):
+        """
+        Args:
+            vectorizers (list): The vectorizer of each model, in the order of
+                their columns in matrix
+            matrix (scipy.sparse.csr_matrix): The fused matrix, or None if the
+                course has no models
+            post_ids (numpy.ndarray): The pids of the rows of matrix
+        """
+        self._vectorizers = list(vectorizers)
+        self._matrix = matrix
+        self.post_ids = np.asarray(post_ids, dtype=np.int64)
+
+    @classmethod
+    def from_models(cls, models, weights=None):
+        """Fuses the matrices of models in this process.
+
+        Args:
+            models (iterable): The ModelInfo objects of the course
+            weights (dict): The weight of each model, keyed on TFIDF_MODELS
+                (Default: TFIDF_MODEL_WEIGHTS)
+        """
+        # A model that failed to load contributes nothing to the scores
+        models = [model for model in models
+                  if model.vectorizer is not None and model.matrix is not None
+                  and model.post_ids is not None]
+        matrix, post_ids = fuse_models(
+            [(model.name, model.matrix, model.post_ids) for model in models],
+            weights)
+        return cls([model.vectorizer for model in models], matrix, post_ids)
+
+    @classmethod
+    def from_artifact(cls, arrays, models, weights=None):
+        """Maps the fused matrix stored in the artifact of a course.
+
+        Args:
+            arrays (dict): The arrays of the artifact
+            models (dict): The ModelInfo objects of the course keyed on their
+                TFIDF_MODELS name
+            weights (dict): The weights the matrix must have been fused with
+                (Default: TFIDF_MODEL_WEIGHTS)
+
+        Returns:
+            FusedScorer: The scorer, or None if the artifact was stored without
+                a fused matrix for these weights
+        """
+        names, matrix, post_ids = decode_fused(arrays, weights)
+        if matrix is None:
+            return None
+        return cls([models[name].vectorizer for name in names], matrix, post_ids)
+
+    @property
+    def nbytes(self):
+        if self._matrix is None:
+            return self.post_ids.nbytes
+        return (self._matrix.data.nbytes + self._matrix.indices.nbytes +
+                self._matrix.indptr.nbytes + self.post_ids.nbytes)
+
+    def score(self, queries):
+        """Returns the weighted similarity of each query to every post in
+        self.post_ids as a dense array with one row per query.
+
+        The queries are vectorized together, so the scores of all the queries
+        and models come out of a single sparse matrix product.
+        """
+        if self._matrix is None:
+            return np.zeros((len(queries), 0))
+
+        q_matrix = sparse.hstack([normalize(vectorizer.transform(queries))
+                                  for vectorizer in self._vectorizers],
+                                 format='csr')
+        return self._matrix.dot(q_matrix.T).T.toarray()
+
+    def top_n(self, query, N, threshold=SCORE_THRESHOLD):
+        """Returns the pids and scores of the N most similar posts to query
+        whose score exceeds threshold, in descending order of score.
+        """
+        return self.top_n_many([query], N, threshold)[0]
+
+    def top_n_many(self, queries, N, threshold=SCORE_THRESHOLD,
+                   chunk_size=BATCH_QUERY_CHUNK_SIZE):
+        """Returns top_n for every query in queries, scoring chunk_size queries
+        per sparse matrix product to bound the size of the dense scores.
+        """
+        results = []
+        for i in range(0, len(queries), chunk_size):
+            scores = self.score(queries[i:i + chunk_size])
+            num_posts = scores.shape[1]
+            if N <= 0 or num_posts == 0:
+                results.extend((self.post_ids[:0], np.zeros(0))
+                               for _ in range(len(scores)))
+                continue
+
+            if N < num_posts:
+                top = np.argpartition(-scores, N - 1, axis=1)[:, :N]
+            else:
+                top = np.tile(np.arange(num_posts), (len(scores), 1))
+            top_scores = np.take_along_axis(scores, top, axis=1)
+            order = np.argsort(-top_scores, axis=1, kind='stable')
+            top = np.take_along_axis(top, order, axis=1)
+            top_scores = np.take_along_axis(top_scores, order, axis=1)
+
+            for row_top, row_scores in zip(top, top_scores):
+                keep = row_scores > threshold
+                results.append((self.post_ids[row_top[keep]], row_scores[keep]))
+        return results
+
 
 class CourseInfo(object):
 
     def __init__(self, cid):
         self.cid = cid
         self.models = {}
+        self.scorer = None
+        self.model_version = None
+        self.last_version_check = None
         self._last_load = None
 
+    @property
+    def nbytes(self):
+        nbytes = sum(model.nbytes for model in self.models.values())
+        if self.scorer is not None:
+            nbytes += self.scorer.nbytes
+        return nbytes
+
     @property
     def last_load(self):
         return self._last_load
@@ -69,10 +317,24 @@ class CourseInfo(object):
 
 class Parqr(object):
 
-    def __init__(self):
-        """Initializes private caching dictionaries."""
-        self._course_dict = {}
+    def __init__(self, memory_budget_mb=COURSE_MODEL_MEMORY_BUDGET_MB,
+                 query_cleaner=None):
+        """Initializes private caching dictionaries.
+
+        Args:
+            memory_budget_mb (int): The approximate amount of memory the
+                resident course models may occupy before the least recently
+                used courses are evicted
+            query_cleaner: An object with a clean(query) method used to
+                normalize queries before scoring (Default: get_query_cleaner())
+        """
+        self._course_dict = OrderedDict()
+        self._lock = threading.RLock()
+        self._refreshing = set()
         self._model_cache = ModelCache()
+        self._post_cache = PostMetadataCache()
+        self._memory_budget = memory_budget_mb * 1024 * 1024
+        self._query_cleaner = query_cleaner or get_query_cleaner()
 
     def get_recommendations(self, cid, query, N):
         """Get the N most similar posts to provided query.
@@ -92,191 +354,314 @@ class Parqr(object):
             A sorted dict of the top N most similar posts with their similarity
             scores as the keys
         """
-        # Connect to DDB
-        payload = {
-            "source": "Query",
-            "query": query
-        }
-        print(payload)
+        # clean query vector
         start = time.time()
-        response = lambda_client.invoke(
-            FunctionName='Parqr-Cleaner:PROD',
-            InvocationType='RequestResponse',
-            Payload=bytes(json.dumps(payload), encoding='utf8')
-        )
+        clean_query = self._query_cleaner.clean(query)
         print("Cleaned Query in {} ms".format((time.time() - start) * 1000))
-        # clean query vector
-        clean_query = json.loads(response['Payload'].read().decode("utf-8")).get("clean_query")
 
-        # Retrive the scores for each model in the course as a pandas DataFrame
-        tfidf_scores = self._get_tfidf_recommendations(cid, clean_query, N)
+        # Retrieve the pids and combined scores of the N most similar posts
+        top_pids, top_scores = self._get_tfidf_recommendations(cid, clean_query, N)
+        scores = dict(zip(top_pids.tolist(), top_scores.tolist()))
+        return self._create_top_posts(cid, [scores])[0]
 
-        # Take a weighted combination of the scores from each model
-        weights = pd.DataFrame([0.4, 0.2, 0.2, 0.2], index=list(TFIDF_MODELS))
-        final_scores = tfidf_scores.dot(weights)
-        final_scores.columns = ['scores']
-        final_scores.sort_values(by=['scores'], ascending=False, inplace=True)
+    def get_batch_recommendations(self, cid, queries, N):
+        """Get the N most similar posts to each of the provided queries.
 
+        All the queries are scored against the course in one sparse matrix
+        product per chunk of queries, which makes replaying logged queries
+        or offline evaluation a single call.
+
+        Parameters
+        ----------
+        cid : str
+            The course id of the class found in the url
+        queries : list
+            The query strings to perform comparisons on
+        N : int
+            The number of similar posts to return for each query
+
+        Returns
+        -------
+        top_posts : list
+            The sorted top N most similar posts of each query, in the order of
+            queries
+        """
+        start = time.time()
+        clean_queries = self._query_cleaner.clean_many(list(queries))
+        print("Cleaned {} Queries in {} ms"
+              .format(len(queries), (time.time() - start) * 1000))
+
+        course_info = self._get_course_info(cid)
+        start = time.time()
+        results = course_info.scorer.top_n_many(clean_queries, N)
+        print("Generated TF-IDF Scores for {} Queries in {} ms"
+              .format(len(queries), (time.time() - start) * 1000))
+
+        scores = [dict(zip(pids.tolist(), query_scores.tolist()))
+                  for pids, query_scores in results]
+        return self._create_top_posts(cid, scores)
+
+    def _create_top_posts(self, cid, scores):
+        """Looks up the metadata of the recommended posts of each query.
+
+        Args:
+            cid (str): The course id of interest
+            scores (list): The score of each recommended post keyed on pid,
+                for every query
+
+        Returns:
+            list: The recommended posts of each query sorted by score
+        """
         start_top_posts = time.time()
-        # Return post id, subject, and score for the top N scores in the df
-        top_pids = [{"post_id": {'N': str(pid)}} for pid in final_scores.index[:N]
-                    if final_scores.loc[pid][0] > SCORE_THRESHOLD]
+        all_pids = set()
+        for query_scores in scores:
+            all_pids.update(query_scores)
 
-        top_posts = []
+        posts = {}
         get_items_time = 0
-        if len(top_pids) > 0:
+        if len(all_pids) > 0:
             start_get_items = time.time()
-            posts = get_ddb()
-            responses = posts.batch_get_item(
-                RequestItems={
-                    cid: {
-                        'Keys': top_pids
-                    }
-                }
-            ).get("Responses").get(cid)
+            posts = self._post_cache.get(cid, list(all_pids))
             get_items_time = (time.time() - start_get_items) * 1000
-            print("Retrieved {} Top Posts from DDB in {} ms"
-                  .format(len(responses), get_items_time))
+            print("Retrieved {} Top Posts in {} ms"
+                  .format(len(posts), get_items_time))
 
-            for post in responses:
-                pid = int(post.get("post_id").get("N"))
-                score = final_scores.loc[pid][0]
-                subject = post.get("subject").get('S')
-                s_answer = True if post.get("s_answer") is not None else False
-                i_answer = True if post.get("i_answer") is not None else False
+        all_top_posts = []
+        for query_scores in scores:
+            top_posts = []
+            for pid, score in query_scores.items():
+                post = posts.get(pid)
+                if post is None:
+                    continue
 
                 # the modified date
-                modified_date = post.get("created").get('N')
-                num_unresolved_followups = post.get("num_unresolved_followups", {"N": 0}).get('N')
-                followups = post.get("followups", {"L": []}).get('L')
-                num_followups = len(followups)
-                resolved = True if not num_unresolved_followups else False
+                modified_date = post["created"]
 
                 top_posts.append({
                     'pid': pid,
                     'score': score,
-                    'subject': subject,
-                    's_answer': s_answer,
-                    'i_answer': i_answer,
+                    'subject': post["subject"],
+                    's_answer': post["s_answer"],
+                    'i_answer': post["i_answer"],
                     'feedback': False,
                     'modified_date': modified_date,
-                    'num_followups': num_followups,
-                    'resolved': resolved,
+                    'num_followups': post["num_followups"],
+                    'resolved': post["num_unresolved_followups"] == 0,
                     "pretty_date": pretty_date(int(modified_date)),
                 })
-        print("Generated {} Top Posts in {} ms"
-              .format(len(top_posts), (time.time() - start_top_posts) * 1000 - get_items_time))
-        return top_posts
+            top_posts.sort(key=lambda post: post['score'], reverse=True)
+            all_top_posts.append(top_posts)
+
+        print("Generated Top Posts for {} Queries in {} ms"
+              .format(len(scores), (time.time() - start_top_posts) * 1000 - get_items_time))
+        return all_top_posts
 
     def _get_tfidf_recommendations(self, cid, query, N):
         """Scores the query for all the models in a given course.
 
-        This function iterates over all the models for a given course,
-        vectorizes the query into the model's vector-space, and computes the
-        similarity to all the all the other posts in the class in the model's
-        vector-space. All the scores are stored as columns in a pd.DataFrame
+        The query is vectorized into each model's vector-space and compared
+        to all the other posts in the class by the course's FusedScorer,
+        which combines the weighted scores of every model in one pass.
 
         Args:
             cid (str): The course id of interest
             query (str): The cleaned version of the original query
-            N (int): The number of similar posts to return for each model
+            N (int): The number of similar posts to return
 
         Returns:
-            pd.DataFrame: A dataframe of all the scores for the course indexed
-                on the valid pids of the course and each column representing
-                the score from each model
+            (tuple): tuple containing:
+                pids (np.ndarray): The pids of the top N posts whose score
+                    exceeds SCORE_THRESHOLD in descending order of score
+                scores (np.ndarray): The combined score of each pid
         """
-        # Retrieve all the valid pids for a course since some pids are private
-        # or deleted
-        # all_pids = self._get_all_pids(cid, course)
-        now = datetime.now()
-        delay = timedelta(seconds=COURSE_MODEL_RELOAD_DELAY_S)
+        course_info = self._get_course_info(cid)
 
-        # If the models for a course are not loaded into memory or it has been
-        # some time since they were loaded last, reload them.
         start = time.time()
-        if cid not in self._course_dict:
-            self._load_all_models(cid)
-        elif now - self._course_dict[cid].last_load > delay:
-            print('Reloading models for cid: {}'.format(cid))
-            self._load_all_models(cid)
-        print("Loaded models in {} ms".format((time.time() - start) * 1000))
+        pids, scores = course_info.scorer.top_n(query, N)
+        print("Generated TF-IDF Scores in {} ms".format((time.time() - start) * 1000))
+        return pids, scores
 
-        start = time.time()
-        course_info = self._course_dict[cid]
-        all_pids = course_info.models[TFIDF_MODELS.POST].post_ids
-        tfidf_scores = pd.DataFrame(index=all_pids)
-        for model_name in TFIDF_MODELS:
-            # Retrieve the appropriate vectorizer for this course, a matrix
-            # where each row represents a post in the course in vector form.
-            vectorizer = course_info.models[model_name].vectorizer
-            matrix = course_info.models[model_name].matrix
-
-            # We also need to retrieve the post_ids for this particular model
-            # to map the rows in the matrix to the pid of the post in the
-            # course.
-            post_ids = course_info.models[model_name].post_ids
-
-            # If a particular model for a course does not exist, then set the
-            # contributions of said model to the final score of each pid to
-            # all zeros
-            if vectorizer is None or matrix is None:
-                tfidf_scores.loc[all_pids, model_name] = np.zeros(len(all_pids))
-                continue
+    def _get_course_info(self, cid):
+        """Returns the CourseInfo of a course, loading its models into memory
+        if they are not resident.
 
-            # The transform method takes an iterable as input. The string does
-            # not need to be tokenized, just placed in a list. This method will
-            # convert the query string of words into a vector in the TF-IDF
-            # vector space
-            q_vector = vectorizer.transform([query])
+        Once it has been some time since the models were loaded, or ModelTrain
+        has published a new model version, the models are reloaded in a
+        background thread while the resident models keep serving requests.
 
-            # Calculate the similarity score for query vector with all vectors
-            # in the course matrix. The matrix contains all the posts of course
-            # in vectorized form.
-            scores = cosine_similarity(q_vector, matrix)[0]
+        Args:
+            cid (str): The course id of interest
+        """
+        now = datetime.now()
+        reload_delay = timedelta(seconds=COURSE_MODEL_RELOAD_DELAY_S)
+        version_delay = timedelta(seconds=COURSE_MODEL_VERSION_CHECK_S)
 
-            # Now we index into our scores dataframe and set the contribution
-            # of this particular model to the final score. Each model will only
-            # be able to contribute to the score
-            tfidf_scores.loc[post_ids, model_name] = scores
+        with self._lock:
+            course_info = self._course_dict.get(cid)
+            if course_info is not None:
+                self._course_dict.move_to_end(cid)
 
-        tfidf_scores.fillna(0, inplace=True)
-        print("Generated TF-IDF Scores in {} ms".format((time.time() - start) * 1000))
-        return tfidf_scores
+        if course_info is None:
+            start = time.time()
+            self._load_all_models(cid)
+            print("Loaded models in {} ms".format((time.time() - start) * 1000))
+            with self._lock:
+                return self._course_dict[cid]
+
+        if now - course_info.last_load > reload_delay:
+            print('Reloading models for cid: {}'.format(cid))
+            self._refresh_in_background(cid, check_version=False)
+        elif now - course_info.last_version_check > version_delay:
+            course_info.last_version_check = now
+            self._refresh_in_background(cid, check_version=True)
+
+        return course_info
+
+    def _refresh_in_background(self, cid, check_version):
+        """Starts a thread that reloads the models of a course, unless one is
+        already running for it.
+
+        Args:
+            cid (str): The course id of interest
+            check_version (bool): Only reload if the model version published
+                by ModelTrain differs from the resident one
+        """
+        with self._lock:
+            if cid in self._refreshing:
+                return
+            self._refreshing.add(cid)
+
+        thread = threading.Thread(target=self._refresh, args=(cid, check_version))
+        thread.daemon = True
+        thread.start()
+
+    def _refresh(self, cid, check_version):
+        try:
+            if check_version:
+                with self._lock:
+                    course_info = self._course_dict.get(cid)
+                if course_info is None or \
+                        get_model_version(cid) == course_info.model_version:
+                    return
+                print('Model version changed for cid: {}'.format(cid))
+            self._load_all_models(cid)
+        except Exception as e:
+            # The resident models keep serving until the next attempt
+            print("Unable to refresh models for cid {}: {}".format(cid, e))
+        finally:
+            with self._lock:
+                self._refreshing.discard(cid)
 
     def _load_all_models(self, cid):
         """Uses the ModelCache class to load the sklearn model, matrix, and
         post_ids that are stored on disk into memory.
 
+        Courses are loaded from their single file artifact. Courses that have
+        not been retrained since the artifact was introduced fall back to the
+        legacy per-model pickles. The new models are built into a fresh
+        CourseInfo which atomically replaces the resident one.
+
         Args:
             cid (str): The course id of interest
         """
         print("Loading all models for cid: {}".format(cid))
+        course_info = CourseInfo(cid)
 
-        if cid in self._course_dict:
-            course_info = self._course_dict[cid]
-        else:
-            course_info = CourseInfo(cid)
+        # Read the version first so that a model published while loading is
+        # picked up by the next version check
+        course_info.model_version = get_model_version(cid)
 
+        arrays = self._model_cache.get_course_arrays(cid)
+        if arrays is not None:
+            models = {name: decode_model(name.name, arrays)
+                      for name in TFIDF_MODELS}
+        else:
+            models = self._model_cache.get_all_models(cid, list(TFIDF_MODELS))
         for model_name in TFIDF_MODELS:
-            skmodel, matrix, pid_list = self._model_cache.get_all(cid, model_name)
+            skmodel, matrix, pid_list = models[model_name]
             course_info.models[model_name] = ModelInfo(model_name, skmodel,
                                                        matrix, pid_list)
 
+        if arrays is not None:
+            course_info.scorer = FusedScorer.from_artifact(arrays,
+                                                           course_info.models)
+        if course_info.scorer is None:
+            # Legacy pickles and artifacts stored before the fused matrix
+            course_info.scorer = FusedScorer.from_models(
+                course_info.models.values())
+
+        # Only the fused matrix is scored, so the matrices of the models are
+        # not kept resident
+        for model_name, model in course_info.models.items():
+            course_info.models[model_name] = ModelInfo(
+                model_name, model.vectorizer, post_ids=model.post_ids)
+
         course_info.last_load = datetime.now()
+        course_info.last_version_check = course_info.last_load
+        self._post_cache.preload_in_background(cid)
 
-        if cid not in self._course_dict:
+        with self._lock:
             self._course_dict[cid] = course_info
+            self._course_dict.move_to_end(cid)
+            self._evict_courses()
+
+    def _evict_courses(self):
+        """Evicts the least recently used courses until the resident models
+        fit in the memory budget. The most recently used course is always kept
+        so that the current request can be served. Must be called while
+        holding self._lock.
+        """
+        total_bytes = sum(info.nbytes for info in self._course_dict.values())
+        while total_bytes > self._memory_budget and len(self._course_dict) > 1:
+            cid, course_info = self._course_dict.popitem(last=False)
+            self._post_cache.evict(cid)
+            total_bytes -= course_info.nbytes
+            print("Evicted models for cid: {} to free {} bytes"
+                  .format(cid, course_info.nbytes))
+
+
+_parqr = None
+
+
+def get_parqr():
+    """Returns the process wide Parqr instance, creating it on first use.
+
+    Lambda keeps module state alive between invocations of a warm container,
+    so reusing the instance keeps the course models resident in memory.
+    """
+    global _parqr
+    if _parqr is None:
+        _parqr = Parqr()
+    return _parqr
 
 
 def lambda_handler(event, context):
+    """Serves recommendations for a course. The body holds either a single
+    "query", or a list of "queries" to score together.
+    """
     print(event, context)
     start = time.time()
-    parqr = Parqr()
+    parqr = get_parqr()
     print("Set up Parqr class in {} ms".format((time.time() - start) * 1000))
 
     body = json.loads(event.get("body"))
     course_id = event['pathParameters'].get("course_id")
+    N = int(body.get("N", 5))
+
+    # Batch requests come from offline jobs, so they skip users and feedback
+    if body.get("queries") is not None:
+        queries = body["queries"]
+        if not isinstance(queries, list) or \
+                not all(isinstance(query, str) for query in queries):
+            return _make_response(
+                {'message': 'queries must be a list of strings'}, '400')
+        if not 0 < len(queries) <= BATCH_QUERY_MAX_QUERIES:
+            return _make_response(
+                {'message': 'queries must hold between 1 and {} queries'
+                    .format(BATCH_QUERY_MAX_QUERIES)}, '400')
+        recs = parqr.get_batch_recommendations(course_id, queries, N)
+        return _make_response(recs)
+
     query = body["query"]
     user_id = body.get("user_id")
     if user_id:
@@ -291,7 +676,6 @@ def lambda_handler(event, context):
             Payload=bytes(json.dumps(payload), encoding='utf8')
         )
 
-    N = int(body.get("N", 5))
     recs = parqr.get_recommendations(course_id, query, N)
     print(recs)
 
@@ -312,8 +696,12 @@ def lambda_handler(event, context):
 
         recs = json.loads(response['Payload'].read().decode("utf-8")).get("similar_posts")
 
+    return _make_response(recs)
+
+
+def _make_response(recs, status_code='200'):
     return {
-        'statusCode': '200',
+        'statusCode': status_code,
         'headers': {
             "Access-Control-Allow-Origin": "*",
             "Access-Control-Allow-Headers": "Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token,Access-Control-Allow-Headers,Access-Control-Allow-Origin,X-Requested-With",
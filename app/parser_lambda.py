@@ -1,32 +1,64 @@
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
+import threading
 import time
 import base64
+import hashlib
 
-import boto3
 import numpy as np
-import pandas as pd
 from boto3.dynamodb.conditions import Attr
 from botocore.exceptions import ClientError
 import json
 
-from bs4 import BeautifulSoup
 from piazza_api import Piazza
 from piazza_api.exceptions import AuthenticationError, RequestError
 
-from app.constants import POST_MAX_AGE_DAYS, POST_AGE_SIGMOID_OFFSET
+from app.aws import get_client, get_resource
+from app.constants import (
+    POST_MAX_AGE_DAYS,
+    POST_AGE_SIGMOID_OFFSET,
+    PIAZZA_FETCH_WORKERS,
+    PIAZZA_MAX_REQUESTS_PER_S
+)
+from app.dashboard_cache import (
+    INSTRUCTOR_QUEUE,
+    STUDENT_RECS,
+    VERSION_ATTRIBUTES,
+    bump_dashboard_version,
+    get_courses_table
+)
+from app.ddb_writer import BatchWriter, UpdateWriter
+from app.feed_sync import FeedIndex
+from app.html_text import TextExtractor, extract_post_text
+from app.instructor_queue import InstructorQueue, queue_entry
 from app.exception import InvalidUsage
+from app.string_utils import changed_models, content_fingerprint
 from app.utils import pretty_date
 
 DATETIME_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
-dynamodb = boto3.client("dynamodb")
-dynamodb_resource = boto3.resource("dynamodb")
+# The attributes of a post that do not affect the text of any TF-IDF model
+METADATA_ATTRIBUTES = (
+    "created", "post_type", "s_answer_created", "s_answer_uid",
+    "i_answer_created", "i_answer_uid", "num_unresolved_followups",
+    "num_views", "num_updates", "num_good_questions", "resolved",
+    "num_followups",
+)
+# The attributes of a post that carry its text
+TEXT_ATTRIBUTES = ("subject", "body", "tags", "s_answer", "i_answer", "followups")
+# Resolved is also set from the dashboard, so the Parser never removes it
+STICKY_ATTRIBUTES = ("resolved",)
+# Counts stored even when they are zero, so readers can tell them apart from
+# posts parsed before they were added
+COUNT_ATTRIBUTES = ("num_followups",)
+dynamodb = get_client("dynamodb")
+dynamodb_resource = get_resource("dynamodb")
 
 
 def get_secret(secret_name):
     region_name = "us-east-2"
 
     # Create a Secrets Manager client
-    client = boto3.client(service_name="secretsmanager", region_name=region_name)
+    client = get_client("secretsmanager", region_name=region_name)
 
     response = client.get_secret_value(SecretId=secret_name)
 
@@ -34,7 +66,7 @@ def get_secret(secret_name):
 
 
 def get_course_table(course_id):
-    dynamodb = boto3.client("dynamodb")
+    dynamodb = get_client("dynamodb")
     try:
         # Check if course table exists
         dynamodb.describe_table(TableName=course_id)
@@ -53,19 +85,95 @@ def get_course_table(course_id):
         else:
             raise ce
 
-    course_table = boto3.resource("dynamodb").Table(course_id)
+    course_table = get_resource("dynamodb").Table(course_id)
     course_table.wait_until_exists()
     return course_table
 
 
-def update_student_recs(course_id, num_posts=5):
+def _sigmoid(x, lookback, y_axis_flip=False):
+    exponential = np.exp((-1) ** y_axis_flip) * (x - lookback)
+    return exponential / (1 + exponential)
+
+
+def _min_max_norm(x):
+    x = x + 1
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return x / (x.max() - x.min())
+
+
+def rank_posts(created, num_followups, num_views, now, windows):
+    """Ranks posts by importance for several lookback windows and numbers of
+    posts in one pass over the columns of the posts.
+
+    Parameters
+    ----------
+    created : numpy.ndarray
+        The creation timestamp of each post
+    num_followups : numpy.ndarray
+        The number of followups of each post
+    num_views : numpy.ndarray
+        The number of unique views of each post
+    now : float
+        The timestamp the age of the posts is measured from
+    windows : list
+        Tuples of (max_age_days, num_posts) to rank posts for
+
+    Returns
+    -------
+    rankings : dict
+        The indices of the top num_posts posts created in the last
+        max_age_days, most important first, keyed on (max_age_days, num_posts)
+    """
+    rankings = {}
+    age_days = np.floor((now - created) / 86400)
+    for max_age_days in set(max_age for max_age, _ in windows):
+        max_age_date = int(now - max_age_days * 86400)
+        in_window = np.flatnonzero(created > max_age_date)
+        nums = [num for max_age, num in windows if max_age == max_age_days]
+
+        # The norms are relative to the posts in the window
+        importance = (
+            _sigmoid(age_days[in_window], POST_AGE_SIGMOID_OFFSET, True)
+            * _min_max_norm(num_followups[in_window])
+            * _min_max_norm(num_views[in_window])
+        ) if len(in_window) else np.array([])
+
+        # Only the largest top K is sorted, smaller ones are its prefixes
+        k = min(max(nums), len(in_window))
+        if k < len(in_window):
+            top = np.argpartition(-importance, k - 1)[:k]
+        else:
+            top = np.arange(len(in_window))
+        top = top[np.argsort(-importance[top], kind="stable")]
+        for num in nums:
+            rankings[(max_age_days, num)] = in_window[top[:num]]
+    return rankings
+
+
+def update_student_recs(course_id, num_posts=5, windows=None):
+    """Ranks the student attention needed posts of a course and stores them in
+    S3 for the dashboard.
+
+    Parameters
+    ----------
+    course_id : str
+        The course id of the class
+    num_posts : int
+        The number of posts recommended in the default window
+    windows : list
+        Extra tuples of (max_age_days, num_posts) to precompute, which are
+        stored under student_recs_key
+    """
     posts = get_course_table(course_id)
     if not posts:
         raise InvalidUsage("Invalid course id provided")
 
+    default_window = (POST_MAX_AGE_DAYS, num_posts)
+    windows = [default_window] + list(windows or [])
+
     now = datetime.now()
     max_age_date = int(
-        datetime.timestamp(now - timedelta(hours=POST_MAX_AGE_DAYS * 24))
+        datetime.timestamp(now - timedelta(days=max(age for age, _ in windows)))
     )
     print(max_age_date)
 
@@ -108,7 +216,7 @@ def update_student_recs(course_id, num_posts=5):
             "subject": post["subject"],
             "date_modified": int(post["created"]),
             "followups": len(post.get("followups", [])),
-            "views": int(post["num_views"]),
+            "views": int(post.get("num_views", 0)),
             "tags": post["tags"],
             "pretty_date": pretty_date(int(post.get("created"))),
             "i_answer": True if post.get("i_answer") is not None else False,
@@ -118,69 +226,126 @@ def update_student_recs(course_id, num_posts=5):
 
         return post_data
 
-    def _posts_bqs_to_df(bqs):
-        dictionary = {
-            "post_id": [int(post["post_id"]) for post in bqs],
-            "created": [datetime.fromtimestamp(int(post["created"])) for post in bqs],
-            "num_followups": [len(post.get("followups", [])) for post in bqs],
-            "num_views": [int(post["num_views"]) for post in bqs],
-        }
-        return pd.DataFrame.from_dict(dictionary)
-
-    def _sigmoid(x, lookback, y_axis_flip=False):
-        exponential = np.exp((-1) ** y_axis_flip) * (x - lookback)
-        return exponential / (1 + exponential)
-
-    def _min_max_norm(x):
-        x = x + 1
-        return x / (x.max() - x.min())
-
     print("{} filtered posts".format(len(filtered_posts)))
     start = time.time()
-    posts_df = _posts_bqs_to_df(filtered_posts)
-    posts_df.created = posts_df.created.fillna(posts_df.created.min())
-    posts_age = now - posts_df.created
-    posts_df["norm_created"] = _sigmoid(
-        posts_age.dt.days, POST_AGE_SIGMOID_OFFSET, True
-    )
-    posts_df["norm_num_followups"] = _min_max_norm(posts_df.num_followups)
-    posts_df["norm_num_views"] = _min_max_norm(posts_df.num_views)
-    posts_df["importance"] = (
-            posts_df.norm_created * posts_df.norm_num_followups * posts_df.norm_num_views
-    )
-
-    posts_df = posts_df.sort_values(by="importance", ascending=False)
-    filtered_posts_ids = list(posts_df.head(num_posts).post_id)
-    top_posts = [
-        post for post in filtered_posts if post["post_id"] in filtered_posts_ids
-    ]
-    retval = list(map(_create_top_post, top_posts))
+    count = len(filtered_posts)
+    created = np.fromiter((int(post["created"]) for post in filtered_posts),
+                          dtype=np.float64, count=count)
+    num_followups = np.fromiter((len(post.get("followups", []))
+                                 for post in filtered_posts),
+                                dtype=np.float64, count=count)
+    num_views = np.fromiter((int(post.get("num_views", 0))
+                             for post in filtered_posts),
+                            dtype=np.float64, count=count)
+    rankings = rank_posts(created, num_followups, num_views, now.timestamp(),
+                          windows)
+    recs = {window: [_create_top_post(filtered_posts[i]) for i in indices]
+            for window, indices in rankings.items()}
     print(
         "{} Recommended Posts in {} ms".format(
-            len(retval), (time.time() - start) * 1000
+            len(recs[default_window]), (time.time() - start) * 1000
         )
     )
 
+    # Only store the recs and signal the dashboards when they changed
+    courses = get_courses_table()
+    digest = _student_recs_digest(recs)
+    item = courses.get_item(
+        Key={"course_id": course_id},
+        ProjectionExpression="student_recs_digest"
+    ).get("Item") or {}
+    if item.get("student_recs_digest") == digest:
+        return recs[default_window]
+
     s3 = get_boto3_s3()
 
-    s3.put_object(
-        Bucket='parqr',
-        Key='{}.json'.format(course_id),
-        Body=bytes(json.dumps(retval), encoding='utf8')
+    for window, retval in recs.items():
+        s3.put_object(
+            Bucket='parqr',
+            Key=student_recs_key(course_id, *window)
+            if window != default_window else '{}.json'.format(course_id),
+            Body=bytes(json.dumps(retval), encoding='utf8')
+        )
+    courses.update_item(
+        Key={"course_id": course_id},
+        UpdateExpression="SET student_recs_digest = :digest ADD {} :one".format(
+            VERSION_ATTRIBUTES[STUDENT_RECS]),
+        ExpressionAttributeValues={":digest": digest, ":one": 1},
     )
+    return recs[default_window]
+
+
+def _student_recs_digest(recs):
+    """Fingerprints the student recs of every window, leaving out
+    pretty_date, which changes with the time of the run and is recomputed
+    when the recs are served.
+    """
+    windows = sorted(
+        (list(window), [{key: value for key, value in post.items()
+                         if key != "pretty_date"} for post in posts])
+        for window, posts in recs.items())
+    return hashlib.sha1(json.dumps(windows, sort_keys=True).encode("utf8")).hexdigest()
+
+
+def backfill_followup_counts(posts):
+    """Stores num_followups on the posts of a course parsed before the count
+    was added, so readers no longer have to fetch their followups to count
+    them.
+
+    Parameters
+    ----------
+    posts : boto3.resources.factory.dynamodb.Table
+        The table of the course
+
+    Returns
+    -------
+    success : boolean
+        True if every post of the course has num_followups
+    """
+    kwargs = {
+        "ProjectionExpression": "post_id, followups",
+        "FilterExpression": Attr("num_followups").not_exists(),
+    }
+    try:
+        with UpdateWriter(posts) as updater:
+            response = posts.scan(**kwargs)
+            while True:
+                for item in response.get("Items", []):
+                    updater.update({"post_id": item["post_id"]},
+                                   "SET num_followups = :num_followups",
+                                   {":num_followups": len(item.get("followups") or [])})
+                if "LastEvaluatedKey" not in response:
+                    break
+                response = posts.scan(
+                    ExclusiveStartKey=response["LastEvaluatedKey"], **kwargs)
+    except ClientError as ce:
+        print("Unable to backfill followup counts: {}".format(ce))
+        return False
+
+    print("Backfilled followup counts of {} posts, {} failed".format(
+        updater.persisted, updater.failed))
+    return updater.failed == 0
+
 
+def student_recs_key(course_id, max_age_days, num_posts):
+    """Returns the S3 key of the student recommendations of a window"""
+    return 'student-recs/{}/{}d-{}.json'.format(course_id, max_age_days, num_posts)
 
-def get_num_updates(post, network):
+
+def get_num_updates(post, roles):
     # Search through log to see how many updates there have been
     # since the most recent professor/ta post
     counter = 0
     if not post.get("change_log"):
         print("No log for post {}".format(post.get("nr")))
         return 0
+
+    # Look up every author we have not seen before in a single request
+    roles.resolve(entry.get("uid", "anon") for entry in post["change_log"])
     for entry in post["change_log"][::-1]:
         user = entry.get("uid", "anon")
         if user != "anon":
-            role = network.get_users([user])[0].get("role")
+            role = roles.get(user)
         else:
             role = "anon"
         if role not in ["professor", "ta"]:
@@ -190,8 +355,85 @@ def get_num_updates(post, network):
     return counter
 
 
+class UserRoles(object):
+    """Memoizes the role of every user in a course.
+
+    The roles are persisted in S3 between Parser runs, so only users that
+    joined since the last run are looked up on Piazza.
+    """
+    key_format = "roles/{}.json"
+
+    def __init__(self, course_id, network):
+        self._course_id = course_id
+        self._network = network
+        self._roles = {}
+        self._changed = False
+
+    def load(self):
+        try:
+            response = get_boto3_s3().get_object(
+                Bucket='parqr',
+                Key=self.key_format.format(self._course_id)
+            )
+            self._roles = json.loads(response['Body'].read().decode("utf-8"))
+        except ClientError:
+            print("No user roles saved for course {}".format(self._course_id))
+
+    def save(self):
+        if not self._changed:
+            return
+        get_boto3_s3().put_object(
+            Bucket='parqr',
+            Key=self.key_format.format(self._course_id),
+            Body=bytes(json.dumps(self._roles), encoding='utf8')
+        )
+        self._changed = False
+
+    def update(self, users):
+        """Records the roles of a list of Piazza user objects"""
+        for user in users:
+            if user.get("id") and self._roles.get(user["id"]) != user.get("role"):
+                self._roles[user["id"]] = user.get("role")
+                self._changed = True
+
+    def resolve(self, uids):
+        """Looks up the roles of the given uids that are not known yet"""
+        unknown = set(uids) - set(self._roles) - {"anon"}
+        if not unknown:
+            return
+        try:
+            self.update(self._network.get_users(list(unknown)))
+        except RequestError as e:
+            # Failed lookups are not remembered, so they are retried
+            print("Unable to get users {}: {}".format(unknown, e))
+            return
+        # Remember users Piazza does not know about so they are not retried
+        for uid in unknown - set(self._roles):
+            self._roles[uid] = None
+            self._changed = True
+
+    def get(self, uid):
+        return self._roles.get(uid)
+
+
 def get_boto3_s3():
-    return boto3.client('s3')
+    return get_client('s3')
+
+
+class RateLimiter(object):
+    """Spaces out calls made from several threads to at most rate per second"""
+
+    def __init__(self, rate):
+        self._interval = 1.0 / rate
+        self._next_call = time.time()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            now = time.time()
+            call_time = max(self._next_call, now)
+            self._next_call = call_time + self._interval
+        time.sleep(max(0, call_time - now))
 
 
 class Parser(object):
@@ -263,66 +505,87 @@ class Parser(object):
         -------
         success : boolean
             True if course parsed without any errors. False, otherwise.
+        changed_pids : list
+            The pids of the posts that were added or whose text changed
+        deleted_pids : list
+            The pids of the posts that were deleted
+        model_pids : dict
+            The pids of changed_pids whose text changed for each model, keyed
+            on the TFIDF_MODELS name
         """
         print("Parsing posts for course: {}".format(course_id))
         network = self._piazza.network(course_id)
-        train = False
+        changed_pids = []
+        updated_pids = []
+        model_pids = {}
+        fingerprints = {}
+        queue_entries = {}
+        deleted = set()
 
         courses = dynamodb_resource.Table("Courses")
         course_info = courses.update_item(
             Key={"course_id": course_id}, ReturnValues="ALL_OLD"
         ).get("Attributes")
 
-        if course_info is None or course_info.get("last_modified") is None:
-            last_modified = 0
-        else:
-            last_modified = int(course_info.get("last_modified"))
+        index = FeedIndex(course_id)
+        index.load()
+        if not index.pids and course_info and course_info.get("all_pids"):
+            # Carry over the pids of courses parsed before the feed index
+            last_modified = int(course_info.get("last_modified", 0))
             if last_modified > datetime.now().timestamp():
                 last_modified = last_modified / 1000
+            index.seed(course_info.get("all_pids"), last_modified)
 
-        if course_info is None or course_info.get("all_pids") is None:
-            previous_all_pids = set()
-        else:
-            previous_all_pids = set([int(i) for i in course_info.get("all_pids")])
-
+        full = index.needs_full_sync()
         try:
-            feed = network.get_feed(limit=99999)["feed"]
-            all_pids = set([post["nr"] for post in feed])
-            pids = [
-                post["nr"]
-                for post in feed
-                if datetime.strptime(post["modified"], DATETIME_FORMAT).timestamp()
-                   > last_modified
-            ]
+            modified, missing = index.changes(network, full=full)
+            pids = list(modified)
         except KeyError:
             print("Unable to get feed for course_id: {}".format(course_id))
-            return False, None
+            return False, None, None, None
+
+        # Unchanged posts are never rewritten, so the counts added since they
+        # were stored are backfilled once
+        if full and not index.counts_backfilled and \
+                backfill_followup_counts(get_course_table(course_id)):
+            index.mark_counts_backfilled()
+
+        if not pids and not missing:
+            print("No posts changed in course: {}".format(course_id))
+            index.save()
+            self._update_instructor_queue(course_id, {}, set())
+            return True, [], [], {}
 
         posts = get_course_table(course_id)
 
+        try:
+            all_users = network.get_all_users()
+        except RequestError:
+            all_users = None
+
+        roles = UserRoles(course_id, network)
+        roles.load()
+        if all_users is not None:
+            roles.update(all_users)
+
         current_pids = set()
         start_time = time.time()
-        for pid in pids:
-            # Get the post if available
-            try:
-                post = network.get_post(pid)
-            except RequestError:
-                all_pids.discard(pid)
+        writer = BatchWriter(posts, key_names=("post_id",))
+        updater = UpdateWriter(posts)
+        extractor = TextExtractor()
+        for pid, post in self._fetch_posts(network, pids):
+            # Skip posts that are not available, they are retried next run
+            if post is None:
+                index.mark_pending(pid, modified[pid])
                 continue
 
             # Skip deleted and private posts
             if post["status"] == "deleted" or post["status"] == "private":
-                if pid in previous_all_pids:
-                    print(
-                        "Deleted post with pid {} and course id {} from Posts".format(
-                            pid, course_id
-                        )
-                    )
-                    all_pids.discard(pid)
-                    previous_all_pids.discard(pid)
-                    posts.delete_item(
-                        Key={"post_id": pid}
-                    )
+                if pid in index:
+                    writer.delete({"post_id": pid})
+                    deleted.add(pid)
+                else:
+                    index.mark_hidden(pid, modified[pid])
                 continue
 
             # If the post is neither deleted nor private, it should be in the db
@@ -331,8 +594,12 @@ class Parser(object):
             # TODO: Parse the type of the post, to indicate if the post is
             # a note/announcement
 
-            # Extract the subject, body, and tags from post
-            subject, body, tags, post_type = self._extract_question_details(post)
+            # Extract the subject and tags from post
+            subject, tags, post_type = self._extract_question_details(post)
+
+            # Convert the body, the student and instructor answers, and the
+            # followups and feedbacks from html to text in one pass
+            body, s_answer, i_answer, followups = extract_post_text(post, extractor)
 
             # Extract number of unique views of the post
             num_views = post["unique_views"]
@@ -342,9 +609,6 @@ class Parser(object):
             # Extract number of unresolved followups (if any)
             num_unresolved_followups = self._extract_num_unresolved(post)
 
-            # Extract the student and instructor answers if applicable
-            s_answer, i_answer = self._extract_answers(post)
-
             # Extract the student and instructor answer metadata
             (
                 s_answer_created,
@@ -353,9 +617,6 @@ class Parser(object):
                 i_answer_uid,
             ) = self._extract_answer_metadata(post)
 
-            # Extract the followups and feedbacks if applicable
-            followups = self._extract_followups(post)
-
             # insert post and add to course's post list
             item = {
                 "created": int(created.timestamp()),
@@ -370,45 +631,75 @@ class Parser(object):
                 "i_answer_created": i_answer_created,
                 "i_answer_uid": i_answer_uid,
                 "followups": followups,
+                "num_followups": len(followups),
                 "num_unresolved_followups": num_unresolved_followups,
                 "num_views": num_views,
-                "num_updates": get_num_updates(post, network),
+                "num_updates": get_num_updates(post, roles),
                 "num_good_questions": post.get("gd", 0),
                 "resolved": True if num_unresolved_followups == 0 and (s_answer or i_answer) else False,
             }
-            cleaned_item = {k: v for k, v in item.items() if v}
-            update_expression = "SET " + ", ".join([" = :".join([key, key]) for key in cleaned_item.keys()])
-            attribute_values = {}
-            for k, v in cleaned_item.items():
-                attribute_values[":" + k] = v
-            try:
-                posts.update_item(
-                    Key={
-                        "post_id": pid,
-                    },
-                    UpdateExpression=update_expression,
-                    ExpressionAttributeValues=attribute_values
-                )
-                train = True
-            except ClientError as e:
-                print(pid, cleaned_item)
-                print(e)
+            cleaned_item = {k: v for k, v in item.items()
+                            if v or k in COUNT_ATTRIBUTES}
+            cleaned_item["post_id"] = pid
+
+            # Posts are updated in place, which keeps the attributes set from
+            # the dashboard and the cleaned words ModelTrain cached for each
+            # model; words cached for text that changed no longer match its
+            # hash. Only posts whose text changed are rewritten and retrained.
+            fingerprints[pid] = content_fingerprint(cleaned_item)
+            queue_entries[pid] = queue_entry(cleaned_item)
+            models = changed_models(index.fingerprint(pid), fingerprints[pid])
+            if models:
+                updater.update({"post_id": pid}, *self._post_update(
+                    item, TEXT_ATTRIBUTES + METADATA_ATTRIBUTES))
+                changed_pids.append(pid)
+                for model_name in models:
+                    model_pids.setdefault(model_name, []).append(pid)
+            else:
+                updater.update({"post_id": pid}, *self._post_update(
+                    item, METADATA_ATTRIBUTES))
+                updated_pids.append(pid)
+
+        # Posts only disappear from the feed when they are removed, which is
+        # checked on the slower full sync cadence
+        for pid in missing or ():
+            writer.delete({"post_id": pid})
+            deleted.add(pid)
+
+        # Wait for the buffered writes and forget the posts that failed, so
+        # they are retried on the next run
+        writer.close()
+        updater.close()
+        for key in writer.failed_keys + updater.failed_keys:
+            pid = key["post_id"]
+            queue_entries.pop(pid, None)
+            if pid in modified:
+                index.mark_pending(pid, modified[pid])
+            if pid in deleted:
+                deleted.discard(pid)
+            elif pid in updated_pids:
+                updated_pids.remove(pid)
                 current_pids.discard(pid)
-                all_pids.discard(pid)
-                continue
-
-        deleted_pids = previous_all_pids - all_pids
-        for pid in deleted_pids:
-            all_pids.discard(pid)
+            else:
+                changed_pids.remove(pid)
+                current_pids.discard(pid)
+                for pids in model_pids.values():
+                    if pid in pids:
+                        pids.remove(pid)
+        model_pids = {model_name: pids for model_name, pids
+                      in model_pids.items() if pids}
+        for pid in changed_pids + updated_pids:
+            index.mark_synced(pid, modified[pid], fingerprints[pid])
+        for pid in sorted(deleted):
+            if missing and pid in missing:
+                index.discard(pid)
+            else:
+                index.mark_hidden(pid, modified[pid])
             print(
                 "Deleted post with pid {} and course id {} from Posts".format(
                     pid, course_id
                 )
             )
-            posts.delete_item(
-                Key={"post_id": pid, }
-            )
-            train = True
 
         # TODO: Figure out another way to verify whether the current user has access to a class.
         # In the event the course_id was invalid or no posts were parsed, delete course object
@@ -419,34 +710,125 @@ class Parser(object):
                 "confirm that the piazza user has access to this "
                 "course".format(course_id)
             )
-            return False, None
+            return False, None, None, None
         end_time = time.time()
         time_elapsed = end_time - start_time
         print(
-            "Course updated. {} new posts scraped in: {:.2f}s".format(
-                len(current_pids), time_elapsed
+            "Course updated. {} new posts scraped in: {:.2f}s, {} with new "
+            "text and {} with new metadata".format(
+                len(current_pids), time_elapsed, len(changed_pids),
+                len(updated_pids)
             )
         )
 
-        try:
-            all_users = str(len(network.get_all_users()))
-        except RequestError:
-            all_users = "N/A"
-
+        roles.save()
+        index.save()
+        self._update_instructor_queue(course_id, queue_entries, deleted, posts)
+
+        # The pids now live in the feed index, so drop the old all_pids set.
+        # last_modified only moves when posts changed, as the post metadata
+        # caches of the Parqr lambda are invalidated on it.
+        update_expression = "SET num_students = :num_students, num_posts = :num_posts"
+        attribute_values = {
+            ":num_students": str(len(all_users)) if all_users is not None else "N/A",
+            ":num_posts": str(network.get_statistics()["total"]["questions"]),
+        }
+        if changed_pids or updated_pids or deleted:
+            update_expression += ", last_modified = :last_modified"
+            attribute_values[":last_modified"] = int(datetime.now().timestamp())
         courses.update_item(
             Key={"course_id": course_id},
-            UpdateExpression="SET #pids = :pids, num_students = :num_students, "
-                             "num_posts = :num_posts, last_modified = :last_modified",
-            ExpressionAttributeNames={"#pids": "all_pids"},
-            ExpressionAttributeValues={
-                ":pids": all_pids,
-                ":num_students": all_users,
-                ":num_posts": str(network.get_statistics()["total"]["questions"]),
-                ":last_modified": int(datetime.now().timestamp()),
-            },
+            UpdateExpression=update_expression + " REMOVE all_pids",
+            ExpressionAttributeValues=attribute_values,
         )
 
-        return True, train
+        return True, changed_pids, sorted(deleted), model_pids
+
+    def _update_instructor_queue(self, course_id, entries, deleted_pids,
+                                 posts=None):
+        """Patches the changed posts into the stored instructor queue of the
+        course, building the queue from the table if there is none yet
+
+        Parameters
+        ----------
+        course_id : str
+            The course id of the class
+        entries : dict
+            The queue entry of each written post keyed on pid
+        deleted_pids : set
+            The pids of the posts that were deleted
+        posts : boto3.resources.factory.dynamodb.Table
+            The table of the course, looked up if the queue has to be built
+        """
+        queue = InstructorQueue.load(course_id)
+        if queue is None:
+            print("Building instructor queue for course: {}".format(course_id))
+            queue = InstructorQueue.from_table(
+                posts if posts is not None else get_course_table(course_id))
+        elif not queue.patch(entries, deleted_pids):
+            return
+        queue.save(course_id)
+        bump_dashboard_version(course_id, INSTRUCTOR_QUEUE)
+
+    def _post_update(self, item, attributes):
+        """Builds an update of the given attributes of a post. Empty
+        attributes are removed so that stale values, such as a deleted
+        answer, do not linger on the post, except for STICKY_ATTRIBUTES.
+
+        Parameters
+        ----------
+        item : dict
+            The parsed post
+        attributes : tuple
+            The names of the attributes to update
+
+        Returns
+        -------
+        update_expression : str
+            The update expression of the attributes
+        attribute_values : dict
+            The values of the update expression
+        """
+        present = [key for key in attributes
+                   if item.get(key) or key in COUNT_ATTRIBUTES]
+        absent = [key for key in attributes if key not in present
+                  and key not in STICKY_ATTRIBUTES]
+        update_expression = "SET " + ", ".join(
+            "{0} = :{0}".format(key) for key in present)
+        if absent:
+            update_expression += " REMOVE " + ", ".join(absent)
+        attribute_values = {":" + key: item[key] for key in present}
+        return update_expression, attribute_values
+
+    def _fetch_posts(self, network, pids):
+        """Fetches posts from Piazza through a bounded pool of threads, making
+        at most PIAZZA_MAX_REQUESTS_PER_S requests per second.
+
+        Parameters
+        ----------
+        network : piazza_api.network.Network
+            The network of the course
+        pids : list
+            The pids of the posts to fetch
+
+        Returns
+        -------
+        posts : generator
+            Tuples of (pid, post) in the order of pids, where post is None if
+            it could not be retrieved
+        """
+        limiter = RateLimiter(PIAZZA_MAX_REQUESTS_PER_S)
+
+        def fetch(pid):
+            limiter.wait()
+            try:
+                return network.get_post(pid)
+            except RequestError:
+                return None
+
+        with ThreadPoolExecutor(max_workers=PIAZZA_FETCH_WORKERS) as pool:
+            for pid, post in zip(pids, pool.map(fetch, pids)):
+                yield pid, post
 
     def _extract_num_unresolved(self, post):
         if len(post["children"]) > 0:
@@ -472,88 +854,15 @@ class Parser(object):
         -------
         subject : str
             The subject of the piazza post
-        parsed_body : str
-            The body of the post without html tags
         tags : list
             A list of the tags or folders that the post belonged to
+        post_type : str
+            The type of the post, e.g. question or note
         """
         subject = post["history"][0]["subject"]
-        html_body = post["history"][0]["content"]
-        parsed_body = BeautifulSoup(html_body, "html.parser").get_text()
-        if parsed_body == "":
-            parsed_body = None
         tags = post["tags"]
         post_type = post["type"]
-        return subject, parsed_body, tags, post_type
-
-    def _extract_answers(self, post):
-        """Retrieves information pertaining to the answers of the piazza post
-
-        Parameters
-        ----------
-        post : dict
-            An object including the post information retrieved from a
-            piazza_api call
-
-        Returns
-        -------
-        s_answer : str
-            The student answer to the post if available (Default = None).
-        i_answer : str
-            The instructor answer to the post if available (Default = None).
-        """
-        s_answer, i_answer = None, None
-        for response in post["children"]:
-            if response["type"] == "s_answer":
-                html_text = response["history"][0]["content"]
-                s_answer = BeautifulSoup(html_text, "html.parser").get_text()
-            elif response["type"] == "i_answer":
-                html_text = response["history"][0]["content"]
-                i_answer = BeautifulSoup(html_text, "html.parser").get_text()
-
-        return s_answer, i_answer
-
-    def _extract_followups(self, post):
-        """Retrieves information pertaining to the followups and feedbacks of
-        the piazza post
-
-        Parameters
-        ----------
-        post : dict
-            An object including the post information retrieved from a
-            piazza_api call
-
-        Returns
-        -------
-        followups : list
-            The followup discussions for a post if available, which might
-            contain feedbacks as well (Default = []).
-        """
-        followups = []
-        for child in post["children"]:
-
-            data = {}
-            if child["type"] == "followup":
-                html_text = child["subject"]
-                soup = BeautifulSoup(html_text, "html.parser")
-                text = soup.get_text()
-                if text:
-                    data["text"] = text
-
-                responses = []
-                if child["children"]:
-                    for activity in child["children"]:
-                        html_text = activity["subject"]
-                        soup = BeautifulSoup(html_text, "html.parser")
-                        text = soup.get_text()
-                        if text:
-                            responses.append(text)
-
-                    data["responses"] = responses
-
-                followups.append(data)
-
-        return followups
+        return subject, tags, post_type
 
     def _extract_answer_metadata(self, post):
         """ Retrieves the metadata of the post's answer. I.e when was it answered? By whom?
@@ -610,13 +919,18 @@ def lambda_handler(event, context):
 
     parser = Parser()
     parser.get_stats_for_enrolled_courses()
-    success, train = parser.update_posts(course_id)
+    success, changed_pids, deleted_pids, model_pids = parser.update_posts(course_id)
     if success:
         print("Successfully parsed")
-        if train:
+        if changed_pids or deleted_pids:
             print("Sending posts to ModelTrain")
-            lambda_client = boto3.client("lambda")
-            payload = {"course_ids": [course_id]}
+            lambda_client = get_client("lambda")
+            payload = {
+                "course_ids": [course_id],
+                "changed_pids": changed_pids,
+                "deleted_pids": deleted_pids,
+                "model_pids": model_pids,
+            }
             lambda_client.invoke(
                 FunctionName="Parqr-ModelTrain:PROD",
                 InvocationType="Event",
@@ -0,0 +1,227 @@
+import threading
+import time
+
+from app.aws import get_client
+from app.constants import (
+    DDB_BATCH_GET_MAX_KEYS,
+    DDB_MAX_RETRIES,
+    POST_METADATA_CHECK_S
+)
+
+# The attributes of a post needed to render a recommendation
+POST_METADATA_PROJECTION = ("post_id, subject, s_answer, i_answer, created, "
+                            "num_unresolved_followups, num_followups")
+# Posts parsed before the Parser stored num_followups only have the followups
+LEGACY_FOLLOWUPS_PROJECTION = "post_id, followups"
+
+
+def get_ddb():
+    return get_client('dynamodb')
+
+
+def get_course_last_modified(cid):
+    """Returns the time the Parser last updated the posts of a course."""
+    item = get_ddb().get_item(
+        TableName='Courses',
+        Key={'course_id': {'S': cid}},
+        ProjectionExpression='last_modified'
+    ).get('Item', {})
+    return item.get('last_modified', {}).get('N')
+
+
+def compact_post(item):
+    """Reduces a post item in DynamoDB's typed format to the fields needed to
+    render a recommendation.
+    """
+    if "num_followups" in item:
+        num_followups = int(item["num_followups"]["N"])
+    else:
+        num_followups = len(item.get("followups", {"L": []}).get('L'))
+    return {
+        "subject": item.get("subject", {}).get('S'),
+        "s_answer": item.get("s_answer") is not None,
+        "i_answer": item.get("i_answer") is not None,
+        "created": item.get("created").get('N'),
+        "num_followups": num_followups,
+        "num_unresolved_followups": int(item.get("num_unresolved_followups",
+                                                 {"N": 0}).get('N')),
+    }
+
+
+def batch_get_posts(cid, pids):
+    """Retrieves the metadata of several posts from the course table.
+
+    Args:
+        cid (str): The course id of the posts
+        pids (list): The pids of the posts to retrieve
+
+    Returns:
+        dict: The compact metadata of each post found, keyed on pid
+    """
+    items = _batch_get_items(cid, pids, POST_METADATA_PROJECTION)
+    return {pid: compact_post(item)
+            for pid, item in _with_legacy_followups(cid, items).items()}
+
+
+def _with_legacy_followups(cid, items):
+    """Reads the followups of the items that have no num_followups, so they
+    can be counted. The Parser backfills num_followups on the first full sync
+    of a course, so only posts stored since then by an older Parser are read.
+
+    Args:
+        cid (str): The course id of the posts
+        items (dict): The post items keyed on pid
+
+    Returns:
+        dict: The items keyed on pid
+    """
+    legacy = [pid for pid, item in items.items() if "num_followups" not in item]
+    if legacy:
+        for pid, item in _batch_get_items(cid, legacy,
+                                          LEGACY_FOLLOWUPS_PROJECTION).items():
+            items[pid]["followups"] = item.get("followups", {"L": []})
+    return items
+
+
+def _batch_get_items(cid, pids, projection):
+    """Retrieves the given attributes of several posts from the course table.
+
+    Keys are requested in chunks of DDB_BATCH_GET_MAX_KEYS and unprocessed
+    keys are retried with exponential backoff.
+
+    Args:
+        cid (str): The course id of the posts
+        pids (list): The pids of the posts to retrieve
+        projection (str): The attributes to retrieve
+
+    Returns:
+        dict: The item of each post found, keyed on pid
+    """
+    ddb = get_ddb()
+    items = {}
+    pids = list(pids)
+    for i in range(0, len(pids), DDB_BATCH_GET_MAX_KEYS):
+        request = {
+            cid: {
+                'Keys': [{"post_id": {'N': str(pid)}}
+                         for pid in pids[i:i + DDB_BATCH_GET_MAX_KEYS]],
+                'ProjectionExpression': projection
+            }
+        }
+        retries = 0
+        while request:
+            response = ddb.batch_get_item(RequestItems=request)
+            for item in response.get("Responses", {}).get(cid, []):
+                items[int(item["post_id"]["N"])] = item
+
+            request = response.get("UnprocessedKeys")
+            if request:
+                if retries >= DDB_MAX_RETRIES:
+                    print("Gave up on {} unprocessed keys for cid {}"
+                          .format(len(request[cid]['Keys']), cid))
+                    break
+                time.sleep(0.05 * 2 ** retries)
+                retries += 1
+    return items
+
+
+class PostMetadataCache(object):
+    """A cache-aside store of the metadata of the posts in each course.
+
+    The entries of a course are dropped whenever the Parser's last_modified
+    watermark on the Courses table moves, which is checked at most once every
+    check_interval_s seconds.
+    """
+
+    def __init__(self, check_interval_s=POST_METADATA_CHECK_S):
+        self._check_interval_s = check_interval_s
+        self._lock = threading.Lock()
+        self._posts = {}
+        self._watermarks = {}
+        self._last_checks = {}
+
+    def _revalidate(self, cid):
+        now = time.time()
+        with self._lock:
+            if now - self._last_checks.get(cid, 0) < self._check_interval_s:
+                return
+            self._last_checks[cid] = now
+
+        watermark = get_course_last_modified(cid)
+        with self._lock:
+            if self._watermarks.get(cid) != watermark:
+                print("Posts changed for cid {}, clearing metadata cache".format(cid))
+                self._posts[cid] = {}
+                self._watermarks[cid] = watermark
+
+    def get(self, cid, pids):
+        """Returns the metadata of the given posts, reading only the posts that
+        are not cached from DynamoDB.
+
+        Args:
+            cid (str): The course id of the posts
+            pids (list): The pids of the posts to retrieve
+
+        Returns:
+            dict: The compact metadata of each post found, keyed on pid
+        """
+        self._revalidate(cid)
+
+        with self._lock:
+            course_posts = self._posts.setdefault(cid, {})
+            found = {pid: course_posts[pid] for pid in pids if pid in course_posts}
+        missing = [pid for pid in pids if pid not in found]
+
+        if missing:
+            fetched = batch_get_posts(cid, missing)
+            with self._lock:
+                self._posts.setdefault(cid, {}).update(fetched)
+            found.update(fetched)
+            print("Post metadata for cid {}: {} cached, {} fetched"
+                  .format(cid, len(pids) - len(missing), len(fetched)))
+        return found
+
+    def preload(self, cid):
+        """Reads the metadata of every post in a course into the cache.
+
+        Only the attributes of a recommendation are projected, so the scan
+        does not read the text of the followups of every post.
+
+        Args:
+            cid (str): The course id of interest
+        """
+        start = time.time()
+        watermark = get_course_last_modified(cid)
+
+        items = {}
+        paginator = get_ddb().get_paginator('scan')
+        for page in paginator.paginate(TableName=cid,
+                                       ProjectionExpression=POST_METADATA_PROJECTION):
+            for item in page.get("Items", []):
+                items[int(item["post_id"]["N"])] = item
+        posts = {pid: compact_post(item)
+                 for pid, item in _with_legacy_followups(cid, items).items()}
+
+        with self._lock:
+            self._posts[cid] = posts
+            self._watermarks[cid] = watermark
+            self._last_checks[cid] = start
+        print("Preloaded metadata of {} posts for cid {} in {} ms"
+              .format(len(posts), cid, (time.time() - start) * 1000))
+
+    def preload_in_background(self, cid):
+        def _preload():
+            try:
+                self.preload(cid)
+            except Exception as e:
+                print("Unable to preload post metadata for cid {}: {}".format(cid, e))
+
+        thread = threading.Thread(target=_preload)
+        thread.daemon = True
+        thread.start()
+
+    def evict(self, cid):
+        with self._lock:
+            self._posts.pop(cid, None)
+            self._watermarks.pop(cid, None)
+            self._last_checks.pop(cid, None)
@@ -1,34 +1,51 @@
+from botocore.exceptions import ClientError
 from flask import request
 from flask_restful import Resource
-import boto3
-import os
+
+from app.aws import get_resource
+from app.dashboard_cache import update_dashboard_post
+from app.exception import InvalidUsage
 
 
 def get_posts_table(course_id):
-    dynamodb = boto3.resource('dynamodb')
+    dynamodb = get_resource('dynamodb')
     return dynamodb.Table(course_id)
 
 
+def update_post(course_id, post_id, update_expression, attribute_names=None,
+                attribute_values=None):
+    """Updates the dashboard attributes of an existing post in the
+    dashboard_posts map of its course, which signals every container to
+    reload the instructor queue of the course. The expressions address the
+    entry of the post as #post.
+
+    Raises:
+        InvalidUsage: If the course has no post with the given post_id
+    """
+    item = get_posts_table(course_id).get_item(
+        Key={"post_id": int(post_id)},
+        ProjectionExpression="post_id"
+    ).get("Item")
+    if item is None:
+        raise InvalidUsage('Post {} not found'.format(post_id), 404)
+    try:
+        update_dashboard_post(course_id, post_id, update_expression,
+                              attribute_names or {}, attribute_values or {})
+    except ClientError as e:
+        if e.response["Error"]["Code"] == "ConditionalCheckFailedException":
+            raise InvalidUsage('Course {} not found'.format(course_id), 404)
+        raise
+
+
 class ResolvePost(Resource):
 
     def post(self, course_id):
         post_id = request.json.get('post_id')
         resolved = bool(request.json.get('resolved'))
 
-        posts = get_posts_table(course_id)
-        posts.update_item(
-            Key={
-                "post_id": int(post_id)
-            },
-            UpdateExpression="SET resolved = :resolved",
-            ExpressionAttributeValues={
-                ":resolved": resolved
-            }
-        )
-
-        filename = "".join(["/tmp/instructor-", course_id, ".json"])
-        if os.path.exists(filename):
-            os.remove(filename)
+        update_post(course_id, post_id,
+                    "SET dashboard_posts.#post.resolved = :resolved",
+                    attribute_values={":resolved": resolved})
 
         return {'message': 'success'}, 200
 
@@ -40,31 +57,15 @@ class AssignInstructor(Resource):
         post_id = request.json.get('post_id')
         assign = bool(request.json.get('assign'))
 
+        # Assignees are the keys of a map, so that one can be added or
+        # removed without reading the others
         if assign:
-            posts = get_posts_table(course_id)
-            posts.update_item(
-                Key={
-                    "post_id": int(post_id)
-                },
-                UpdateExpression="ADD assignees :assignee",
-                ExpressionAttributeValues={
-                    ":assignee": {assignee}
-                }
-            )
+            update_post(course_id, post_id,
+                        "SET dashboard_posts.#post.assignees.#assignee = :true",
+                        {"#assignee": assignee}, {":true": True})
         else:
-            posts = get_posts_table(course_id)
-            posts.update_item(
-                Key={
-                    "post_id": int(post_id)
-                },
-                UpdateExpression="DELETE assignees :assignee",
-                ExpressionAttributeValues={
-                    ":assignee": {assignee}
-                }
-            )
-
-        filename = os.path.join("/tmp/instructor-", course_id, ".json")
-        if os.path.exists(filename):
-            os.remove(filename)
+            update_post(course_id, post_id,
+                        "REMOVE dashboard_posts.#post.assignees.#assignee",
+                        {"#assignee": assignee})
 
         return {'message': 'success'}, 200
@@ -1,23 +1,26 @@
 import json
 import os
+import threading
 import time
 
-import boto3
 from flask_restful import Resource, reqparse
 # from flask_jwt import jwt_required
 from flask import jsonify, request
 
+from app.aws import get_client
+from app.constants import COURSE_REGISTRY_TTL_S
+
 
 def get_boto3_events():
-    return boto3.client('events')
+    return get_client('events')
 
 
 def get_boto3_lambda():
-    return boto3.client('lambda')
+    return get_client('lambda')
 
 
 def get_boto3_s3():
-    return boto3.client('s3')
+    return get_client('s3')
 
 
 def get_enrolled_courses_from_piazza():
@@ -41,46 +44,112 @@ def get_enrolled_courses_from_piazza():
         return courses
 
 
-def mark_active_courses(course_list):
-    events = get_boto3_events()
-    boto3_lambda = get_boto3_lambda()
-
-    print("Course List: {}".format(course_list))
-
-    # Get the Function arn for Parser
-    target_arn = boto3_lambda.get_function(
-        FunctionName='Parser:PROD'
-    ).get('Configuration').get('FunctionArn')
-
-    # Get all the courses that currently have rules that target Parser
-    response = events.list_rule_names_by_target(
-        TargetArn=target_arn
-    )
-    rule_names = response.get('RuleNames')
-    while response.get('NextToken') is not None:
-        next_token = response.get('NextToken')
+class CourseRegistry(object):
+    """Caches whether the Parser rule of each course is enabled.
+
+    Reading the states takes a handful of paginated control plane calls, so
+    they are kept for ttl_s seconds. Once stale, they are still served while
+    a background thread reads them again. Registering or deregistering a
+    course updates its state right away.
+    """
+
+    def __init__(self, ttl_s=COURSE_REGISTRY_TTL_S):
+        self._ttl_s = ttl_s
+        self._lock = threading.Lock()
+        self._active = None
+        self._loaded_at = 0
+        self._refreshing = False
+
+    def _read_states(self):
+        events = get_boto3_events()
+        boto3_lambda = get_boto3_lambda()
+
+        # Get the Function arn for Parser
+        target_arn = boto3_lambda.get_function(
+            FunctionName='Parser:PROD'
+        ).get('Configuration').get('FunctionArn')
+
+        # Get all the courses that currently have rules that target Parser
         response = events.list_rule_names_by_target(
-            TargetArn=target_arn,
-            NextToken=next_token
+            TargetArn=target_arn
         )
-        rule_names.extend(response.get('RuleNames'))
+        rule_names = set(response.get('RuleNames'))
+        while response.get('NextToken') is not None:
+            response = events.list_rule_names_by_target(
+                TargetArn=target_arn,
+                NextToken=response.get('NextToken')
+            )
+            rule_names.update(response.get('RuleNames'))
+
+        print("Rule Names targeting Parser: {}".format(rule_names))
+
+        # Read the state of every rule in pages instead of one call per course
+        active = {}
+        kwargs = {}
+        while True:
+            response = events.list_rules(**kwargs)
+            for rule in response.get('Rules', []):
+                if rule.get('Name') in rule_names:
+                    active[rule['Name']] = rule.get('State') == 'ENABLED'
+            if response.get('NextToken') is None:
+                break
+            kwargs['NextToken'] = response.get('NextToken')
+        return active
 
-    print("Rule Names targeting Parser: {}".format(rule_names))
+    def _refresh(self):
+        try:
+            active = self._read_states()
+            with self._lock:
+                self._active = active
+                self._loaded_at = time.time()
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+    def _refresh_in_background(self):
+        def _refresh():
+            try:
+                self._refresh()
+            except Exception as e:
+                print("Unable to refresh course registry: {}".format(e))
+
+        thread = threading.Thread(target=_refresh)
+        thread.daemon = True
+        thread.start()
+
+    def active_courses(self):
+        """Returns whether each registered course is active, keyed on course id"""
+        with self._lock:
+            active = self._active
+            stale = time.time() - self._loaded_at > self._ttl_s
+            refresh = active is not None and stale and not self._refreshing
+            if refresh:
+                self._refreshing = True
+
+        if active is None:
+            with self._lock:
+                self._refreshing = True
+            self._refresh()
+            with self._lock:
+                return dict(self._active)
+        if refresh:
+            self._refresh_in_background()
+        return dict(active)
+
+    def set_active(self, course_id, active):
+        with self._lock:
+            if self._active is not None:
+                self._active = dict(self._active)
+                self._active[course_id] = active
+
+
+_course_registry = CourseRegistry()
 
-    for course in course_list:
-        # Check if the course_id has a rule, if it does not, then it is disabled
-        if course.get('course_id') in rule_names:
-            response = events.describe_rule(
-                Name=course.get('course_id')
-            )
 
-            # Check if a rule is enabled
-            if response.get('State') == 'ENABLED':
-                course['active'] = True
-            else:
-                course['active'] = False
-        else:
-            course['active'] = False
+def mark_active_courses(course_list):
+    active = _course_registry.active_courses()
+    for course in course_list:
+        course['active'] = active.get(course.get('course_id'), False)
 
     return course_list
 
@@ -162,6 +231,7 @@ class ActiveCourse(Resource):
             cloudwatch_events.enable_rule(
                 Name=course_id
             )
+            _course_registry.set_active(course_id, True)
             print("Course already registered in PARQR")
             return {
                        'course_id': course_id,
@@ -203,6 +273,7 @@ class ActiveCourse(Resource):
         if target_response.get('FailedEntryCount') > 0:
             print("Error putting cloudwatch event target")
             return {'message': 'Internal Server Error'}, 500
+        _course_registry.set_active(course_id, True)
 
         payload = {
             "source": "parqr-api"
@@ -230,6 +301,7 @@ class ActiveCourse(Resource):
         cloudwatch_events.disable_rule(
             Name=course_id
         )
+        _course_registry.set_active(course_id, False)
 
         lambda_client = get_boto3_lambda()
         payload = {
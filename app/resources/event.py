@@ -1,17 +1,18 @@
 import copy
 import uuid
 
-import boto3
 from flask_restful import (
     Resource,
     request
 )
 
+from app.aws import get_resource
+
 
 class Event(Resource):
 
     def __init__(self):
-        dynamodb_resource = boto3.resource('dynamodb')
+        dynamodb_resource = get_resource('dynamodb')
         self.events = dynamodb_resource.Table('Events')
 
     def post(self):
@@ -1,14 +1,15 @@
 from flask_restful import Resource
 from flask import request
-import boto3
 import json
 
+from app.aws import get_client
+
 
 class Feedbacks(Resource):
 
     def post(self):
         # Validate the feedback data
-        lambda_client = boto3.client('lambda')
+        lambda_client = get_client('lambda')
 
         response = lambda_client.invoke(
             FunctionName='Feedbacks',
@@ -1,10 +1,17 @@
+from flask import request
 from flask_restful import Resource
 
+from app.constants import INSTRUCTOR_RECS_MAX_PAGE_SIZE, INSTRUCTOR_RECS_PAGE_SIZE
+from app.exception import InvalidUsage
+from app.instructor_queue import DERIVED_COLUMNS, QUEUE_COLUMNS
 from app.statistics import (
+    get_inst_att_needed_page,
     get_inst_att_needed_posts,
     get_stud_att_needed_posts
 )
 
+PAGE_ARGS = ('limit', 'cursor', 'fields', 'tag', 'assignee', 'resolved')
+
 
 class StudentRecommendations(Resource):
 
@@ -16,5 +23,40 @@ class StudentRecommendations(Resource):
 class InstructorRecommendations(Resource):
 
     def get(self, course_id):
-        posts = get_inst_att_needed_posts(course_id, 99999)
-        return {'message': 'success', 'recommendations': posts}, 200
+        # Clients that do not page still get every post at once
+        if not any(arg in request.args for arg in PAGE_ARGS):
+            posts = get_inst_att_needed_posts(course_id, 99999)
+            return {'message': 'success', 'recommendations': posts}, 200
+
+        try:
+            limit = int(request.args.get('limit', INSTRUCTOR_RECS_PAGE_SIZE))
+        except ValueError:
+            raise InvalidUsage('limit must be an integer', 400)
+        if not 0 < limit <= INSTRUCTOR_RECS_MAX_PAGE_SIZE:
+            raise InvalidUsage('limit must be between 1 and {}'.format(
+                INSTRUCTOR_RECS_MAX_PAGE_SIZE), 400)
+
+        fields = None
+        if request.args.get('fields'):
+            fields = request.args['fields'].split(',')
+            unknown = set(fields) - set(QUEUE_COLUMNS + DERIVED_COLUMNS)
+            if unknown:
+                raise InvalidUsage('Unknown fields: {}'.format(
+                    ', '.join(sorted(unknown))), 400)
+
+        resolved = request.args.get('resolved')
+        if resolved is not None:
+            if resolved.lower() not in ('true', 'false'):
+                raise InvalidUsage('resolved must be true or false', 400)
+            resolved = resolved.lower() == 'true'
+
+        posts, next_cursor = get_inst_att_needed_page(
+            course_id, limit,
+            cursor=request.args.get('cursor'),
+            tag=request.args.get('tag'),
+            assignee=request.args.get('assignee'),
+            resolved=resolved,
+            fields=fields
+        )
+        return {'message': 'success', 'recommendations': posts,
+                'next_cursor': next_cursor}, 200
@@ -1,31 +1,31 @@
-import platform
-
-import botocore
 import simplejson as json
 from datetime import datetime, timedelta
 import time
-import os
 
-from boto3.dynamodb.conditions import Attr
 from botocore.exceptions import ClientError
-import boto3
 import pandas as pd
 import numpy as np
 
+from app.aws import get_client, get_resource
 from app.exception import InvalidUsage
+from app.dashboard_cache import (
+    DASHBOARD_POSTS,
+    INSTRUCTOR_QUEUE,
+    STUDENT_RECS,
+    DashboardCache,
+    get_dashboard_posts
+)
+from app.instructor_queue import InstructorQueue
 from app.constants import POST_AGE_SIGMOID_OFFSET, POST_MAX_AGE_DAYS
 from app.utils import pretty_date
 
 
-class SetEncoder(json.JSONEncoder):
-    def default(self, obj):
-        if isinstance(obj, set):
-            return list(obj)
-        return json.JSONEncoder.default(self, obj)
+# Warm copies of the dashboard data of each course
+_dashboard_cache = DashboardCache()
 
 
 def get_posts_table(course_id):
-    dynamodb = boto3.resource("dynamodb")
+    dynamodb = get_resource("dynamodb")
     posts_table = dynamodb.Table(course_id)
     try:
         if posts_table.table_status == "ACTIVE":
@@ -35,12 +35,12 @@ def get_posts_table(course_id):
 
 
 def get_courses_table():
-    dynamodb = boto3.resource("dynamodb")
+    dynamodb = get_resource("dynamodb")
     return dynamodb.Table("Courses")
 
 
 def get_s3():
-    return boto3.client('s3')
+    return get_client('s3')
 
 
 def _validate_starting_time(starting_time):
@@ -77,7 +77,8 @@ def get_inst_att_needed_posts(course_id, number_of_posts):
     2) There is no student answer for it
     3) There are unanswered followup questions for the post
 
-    Finally, the top posts based on the age of the post are returned
+    The posts are served from the course's precomputed InstructorQueue, which
+    is sorted by the number of unresolved followups and views
 
     Parameters
     ----------
@@ -91,93 +92,99 @@ def get_inst_att_needed_posts(course_id, number_of_posts):
     top_posts : list
         A list of dictionary of posts
     """
-    filename = "".join(["/tmp/instructor-", course_id, ".json"])
-    start = time.time()
-    if os.path.exists(filename):
-        with open(filename, "r") as json_file:
-            filtered_posts = json.load(json_file)
-
-        print(
-            "Retrieved {} Posts from /tmp in {} ms".format(
-                len(filtered_posts), (time.time() - start) * 1000
-            )
-        )
-    else:
-        # Sanity check to see if the course_id sent is valid course_id or not
-        posts = get_posts_table(course_id)
-        if not posts:
-            raise InvalidUsage("Invalid course id provided")
-
-        try:
-            start = time.time()
-            response = posts.scan(
-                FilterExpression=~Attr("tags").contains("instructor-question")
-            )
-            filtered_posts = response.get("Items")
-
-            while "LastEvaluatedKey" in response:
-                response = posts.scan(
-                    FilterExpression=~Attr("tags").contains("instructor-question"),
-                    ExclusiveStartKey=response["LastEvaluatedKey"],
-                )
-                filtered_posts.extend(response["Items"])
-        except ClientError as ce:
-            print(ce)
-            return []
-
-        if "Linux" in platform.platform():
-            with open(filename, "w") as json_file:
-                json.dump(filtered_posts, json_file, cls=SetEncoder)
-
-        print(
-            "Retrieved {} Posts from DDB in {} ms".format(
-                len(response), (time.time() - start) * 1000
-            )
-        )
+    queue = _get_instructor_queue(course_id)
+    if queue is None:
+        return []
+    return queue.top(number_of_posts)
 
-    def _create_top_post(post):
-        post_data = {
-            "title": post["subject"],
-            "post_id": int(post["post_id"]),
-            "num_views": int(post["num_views"]),
-            "num_updates": int(post.get("num_updates", 0)),
-            "num_unresolved_followups": int(post.get("num_unresolved_followups", 0)),
-            "i_answer": True if post.get("i_answer") else False,
-            "s_answer": True if post.get("s_answer") else False,
-            "tags": post.get("tags"),
-            "last_modified": int(post.get("created")),
-            "pretty_date": pretty_date(int(post.get("created"))),
-            "assignees": list(post.get("assignees", [])),
-            "good_questions": int(post.get("num_good_questions", 0)),
-            "num_words": len(post.get("body", "").split()),
-            "resolved": bool(post.get("resolved")) if post.get("resolved") else False,
-        }
 
-        return post_data
+def get_inst_att_needed_page(course_id, limit, cursor=None, tag=None,
+                             assignee=None, resolved=None, fields=None):
+    """Retrieves one page of the instructor attention needed posts of a
+    course, in the order of its InstructorQueue.
 
-    if len(filtered_posts) <= number_of_posts:
-        return list(map(_create_top_post, filtered_posts))
+    Parameters
+    ----------
+    course_id : str
+        The course id of the class
+    limit : int
+        The maximum number of posts in the page
+    cursor : str
+        The next_cursor returned with the previous page, if any
+    tag : str
+        Only return posts with this tag
+    assignee : str
+        Only return posts assigned to this instructor
+    resolved : bool
+        Only return posts in this resolved state
+    fields : list
+        The fields of each post to return, defaults to all
 
-    # Pick out posts with no instructor answer
-    filtered_posts = [post for post in filtered_posts if post.get("i_answer") is None]
-    # posts = posts.filter(i_answer=None)
-    if len(filtered_posts) <= number_of_posts:
-        return list(map(_create_top_post, filtered_posts))
+    Return
+    ------
+    top_posts : list
+        A list of dictionary of posts
+    next_cursor : str
+        The cursor of the next page, or None if this is the last page
+    """
+    queue = _get_instructor_queue(course_id)
+    if queue is None:
+        return [], None
+    try:
+        return queue.page(limit, cursor, tag, assignee, resolved, fields)
+    except ValueError as e:
+        raise InvalidUsage(str(e), 400)
 
-    # Pick out posts with no instructor or student answer
-    filtered_posts = [post for post in filtered_posts if post.get("s_answer") is None]
-    # posts = posts.filter(s_answer=None)
-    if len(filtered_posts) <= number_of_posts:
-        return list(map(_create_top_post, filtered_posts))
 
-    # Otherwise, return the n top posts sorted by number of unresolved followup
-    # questions and views
-    filtered_posts = sorted(
-        filtered_posts,
-        key=lambda a: (a.get("num_unresolved_followups", 0), a.get("num_views", 0)),
+def _get_instructor_queue(course_id):
+    """Returns the stored queue of a course with the current dashboard
+    columns. The stored queue is only downloaded again when the Parser
+    changes it; a click on the dashboard only rereads the small
+    dashboard_posts map of the course.
+    """
+    return _dashboard_cache.get(
+        INSTRUCTOR_QUEUE, course_id,
+        lambda: _overlay_dashboard_posts(course_id),
+        depends_on=(INSTRUCTOR_QUEUE, DASHBOARD_POSTS))
+
+
+def _overlay_dashboard_posts(course_id):
+    stored = _dashboard_cache.get(
+        "stored-instructor-queue", course_id,
+        lambda: _load_instructor_queue(course_id),
+        depends_on=(INSTRUCTOR_QUEUE,))
+    if stored is None:
+        return None
+    try:
+        return stored.overlay(get_dashboard_posts(course_id))
+    except ClientError as ce:
+        print(ce)
+        return None
+
+
+def _load_instructor_queue(course_id):
+    start = time.time()
+    # Sanity check to see if the course_id sent is valid course_id or not
+    posts = get_posts_table(course_id)
+    if not posts:
+        raise InvalidUsage("Invalid course id provided")
+
+    try:
+        queue = InstructorQueue.load(course_id)
+        if queue is None:
+            # The Parser has not built the queue of this course yet
+            queue = InstructorQueue.from_table(posts)
+            queue.save(course_id)
+    except ClientError as ce:
+        print(ce)
+        return None
+
+    print(
+        "Retrieved queue of {} Posts in {} ms".format(
+            len(queue), (time.time() - start) * 1000
+        )
     )
-    n_posts = min(len(filtered_posts), number_of_posts)
-    return list(map(_create_top_post, filtered_posts[:n_posts]))
+    return queue
 
 
 def get_stud_att_needed_posts(course_id, num_posts):
@@ -202,32 +209,28 @@ def get_stud_att_needed_posts(course_id, num_posts):
     top_posts : list
         A list of dictionary of posts
     """
-    filename = "".join(["/tmp/student-", course_id, ".json"])
+    recs = _dashboard_cache.get(
+        STUDENT_RECS, course_id, lambda: _load_student_recs(course_id))
+    if recs is None:
+        return []
+    # The Parser only stores the recs when they change, so the age of each
+    # post is recomputed when it is served
+    return [dict(post, pretty_date=pretty_date(post["date_modified"]))
+            for post in recs]
+
+
+def _load_student_recs(course_id):
     start = time.time()
-    if os.path.exists(filename):
-        with open(filename, "r") as json_file:
-            recs = json.load(json_file)
-
-        print(
-            "Retrieved {} Posts from /tmp in {} ms".format(
-                len(recs), (time.time() - start) * 1000
-            )
-        )
-    else:
-        try:
-            get_s3().download_file("parqr", course_id + ".json", filename)
-        except botocore.exceptions.ClientError as e:
-            print("Could not find recs for cid '{}'".format(course_id))
-            return []
-        else:
-            print("Downloaded recs from s3")
-            with open(filename, "rb") as input_file:
-                recs = json.load(input_file)
-
-        print(
-            "Retrieved {} Posts from s3 in {} ms".format(
-                len(recs), (time.time() - start) * 1000
-            )
-        )
+    try:
+        response = get_s3().get_object(Bucket="parqr", Key=course_id + ".json")
+    except ClientError:
+        print("Could not find recs for cid '{}'".format(course_id))
+        return None
+    recs = json.loads(response["Body"].read().decode("utf-8"))
 
+    print(
+        "Retrieved {} Posts from s3 in {} ms".format(
+            len(recs), (time.time() - start) * 1000
+        )
+    )
     return recs
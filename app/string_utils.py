@@ -1,9 +1,21 @@
-import boto3
-import spacy
-from botocore.exceptions import ClientError
+from functools import lru_cache
+import hashlib
+import inspect
+import json
+import os
+import sqlite3
 
 from enum import Enum
 
+from app.aws import get_resource
+from app.constants import (
+    CLEAN_BATCH_SIZE,
+    CLEAN_CACHE_PATH,
+    CLEAN_N_PROCESS,
+    QUERY_CLEAN_CACHE_SIZE
+)
+from app.ddb_writer import UpdateWriter
+
 
 class TFIDF_MODELS(Enum):
     POST = 0
@@ -12,11 +24,40 @@ class TFIDF_MODELS(Enum):
     FOLLOWUP = 3
 
 
-# loading model
-nlp = spacy.load("en_core_web_sm")
+SPACY_MODEL = "en_core_web_sm"
+REMOVED_POS = {"PUNCT", "PART", "PRON"}
+
+# Bump whenever the cleaning logic changes so every cached text is recleaned
+CLEANER_VERSION = 1
+
+# spaCy pipelines are loaded lazily so importing this module stays cheap
+_nlp = None
+_query_nlp = None
+
+
+def get_nlp():
+    """Returns the full spaCy pipeline used to clean course posts."""
+    global _nlp
+    if _nlp is None:
+        import spacy
+        _nlp = spacy.load(SPACY_MODEL)
+    return _nlp
 
 
-def spacy_clean(text, array=True):
+def get_query_nlp():
+    """Returns a lightweight spaCy pipeline used to clean queries.
+
+    Cleaning only needs part of speech tags and lemmas, so the dependency
+    parser and the named entity recognizer are disabled.
+    """
+    global _query_nlp
+    if _query_nlp is None:
+        import spacy
+        _query_nlp = spacy.load(SPACY_MODEL, disable=["parser", "ner"])
+    return _query_nlp
+
+
+def spacy_clean(text, array=True, nlp=None):
     '''
     Cleans a string of text by:
         1. Removing all punctuations
@@ -30,18 +71,82 @@ def spacy_clean(text, array=True):
         Verify all installed models are compatible with spaCy version
         python -m spacy validate
         :param text: input string
+        :param nlp: spaCy pipeline to use, defaults to the full pipeline
         :return: array of cleaned tokens
     '''
 
     # creating a doc object by applying model to the text
     if text is not None:
-        doc = nlp(text)
-        res = [token.lemma_ for token in doc if token.pos_ not in {"PUNCT", "PART", "PRON"}]
+        doc = (nlp or get_nlp())(text)
+        res = [token.lemma_ for token in doc if token.pos_ not in REMOVED_POS]
         return res if array else " ".join(res)
     else:
         return [] if array else ""
 
 
+def _pipe_accepts(nlp, argument):
+    """Checks whether nlp.pipe takes an argument, which depends on the
+    installed version of spaCy.
+    """
+    try:
+        return argument in inspect.signature(nlp.pipe).parameters
+    except (TypeError, ValueError):
+        return False
+
+
+def _spacy_version():
+    import spacy
+    return spacy.__version__
+
+
+def spacy_clean_many(texts, batch_size=CLEAN_BATCH_SIZE, n_process=CLEAN_N_PROCESS):
+    '''
+    Cleans a stream of texts the same way as spacy_clean, but runs them
+    through nlp.pipe in batches with the parser and NER disabled.
+
+        :param texts: iterable of input strings, which may contain None
+        :param batch_size: number of texts spaCy processes per batch
+        :param n_process: number of worker processes spaCy uses
+        :return: generator of arrays of cleaned tokens in input order
+    '''
+    nlp = get_query_nlp()
+    texts = (text if text is not None else "" for text in texts)
+
+    kwargs = {"batch_size": batch_size}
+    if n_process > 1:
+        if _pipe_accepts(nlp, "n_process"):
+            kwargs["n_process"] = n_process
+        else:
+            print("spaCy {} cannot clean in {} processes, using one"
+                  .format(_spacy_version(), n_process))
+
+    for doc in nlp.pipe(texts, **kwargs):
+        yield [token.lemma_ for token in doc if token.pos_ not in REMOVED_POS]
+
+
+@lru_cache(maxsize=QUERY_CLEAN_CACHE_SIZE)
+def clean_query(query):
+    """Cleans a query string in-process with the lightweight pipeline.
+
+    Results are memoized since students frequently search for the same
+    strings while typing out a new post.
+
+    :param query: input query string
+    :return: the cleaned query as a space separated string
+    """
+    return spacy_clean(query, array=False, nlp=get_query_nlp())
+
+
+def clean_queries(queries):
+    """Cleans several query strings in one nlp.pipe pass, the same way as
+    clean_query.
+
+    :param queries: list of input query strings
+    :return: list of the cleaned queries as space separated strings
+    """
+    return [' '.join(tokens) for tokens in spacy_clean_many(queries)]
+
+
 def stringify_followups(followup_list):
     return_list = []
     # print("{} followups".format(len(followup_list)))
@@ -54,6 +159,209 @@ def stringify_followups(followup_list):
     return ' '.join(return_list)
 
 
+# Posts with this many followups or more are left out of the FOLLOWUP model
+MAX_MODEL_FOLLOWUPS = 15
+
+
+def words_attribute(model_name):
+    """Returns the post attribute that caches the cleaned words of a model."""
+    return "{}_words".format(model_name)
+
+
+def hash_attribute(model_name):
+    """Returns the post attribute that holds the hash of the text the cached
+    words of a model were cleaned from.
+    """
+    return "{}_words_hash".format(model_name)
+
+
+def text_hash(post, model_name):
+    """Hashes the raw text of a post that is relevant to a model, together
+    with the cleaner version.
+    """
+    texts = _post_texts(post, model_name)
+    if model_name == "POST":
+        texts = texts + list(post.get("tags") or [])
+    content = json.dumps([CLEANER_VERSION, model_name, texts])
+    return hashlib.sha1(content.encode("utf8")).hexdigest()
+
+
+# Number of hex digits of text_hash kept in the fingerprint of a post
+FINGERPRINT_LENGTH = 12
+
+
+def content_fingerprint(post):
+    """Returns a short hash of the text of a post relevant to each model, in
+    the order of TFIDF_MODELS. Models the post does not contribute to get an
+    empty string.
+    """
+    return [text_hash(post, model.name)[:FINGERPRINT_LENGTH]
+            if is_model_post(post, model.name) else ""
+            for model in TFIDF_MODELS]
+
+
+def changed_models(old_fingerprint, new_fingerprint):
+    """Returns the names of the models whose text differs between two
+    fingerprints of a post. Every model changed if old_fingerprint is None.
+    """
+    if old_fingerprint is None:
+        old_fingerprint = [None] * len(TFIDF_MODELS)
+    return [model.name for model, old, new
+            in zip(TFIDF_MODELS, old_fingerprint, new_fingerprint)
+            if old != new]
+
+
+def cached_words(post, model_name):
+    """Returns the words cached on a post for a model, or None if there are
+    none or they were cleaned from a different version of the text.
+    """
+    words = post.get(words_attribute(model_name))
+    if words is None or post.get(hash_attribute(model_name)) != text_hash(post, model_name):
+        return None
+    return words
+
+
+class CleanCache(object):
+    """An on-disk cache of cleaned words keyed on text_hash.
+
+    It lives in /tmp, so warm containers skip cleaning any text they have
+    already seen, even for posts whose DynamoDB cache is missing or stale.
+    """
+
+    def __init__(self, path=CLEAN_CACHE_PATH):
+        self._connection = sqlite3.connect(path)
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS words (hash TEXT PRIMARY KEY, words TEXT)")
+
+    def get_many(self, hashes):
+        found = {}
+        hashes = list(hashes)
+        # SQLite limits the number of parameters of a statement
+        for i in range(0, len(hashes), 500):
+            chunk = hashes[i:i + 500]
+            rows = self._connection.execute(
+                "SELECT hash, words FROM words WHERE hash IN ({})"
+                .format(",".join("?" * len(chunk))), chunk)
+            found.update(rows)
+        return found
+
+    def put_many(self, entries):
+        with self._connection:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO words (hash, words) VALUES (?, ?)",
+                entries)
+
+    def close(self):
+        self._connection.close()
+
+
+def is_model_post(post, model_name):
+    """Returns whether a post contributes a document to a model."""
+    if model_name == "POST":
+        return True
+    elif model_name == "I_ANSWER":
+        return bool(post.get("i_answer"))
+    elif model_name == "S_ANSWER":
+        return bool(post.get("s_answer"))
+    elif model_name == "FOLLOWUP":
+        return bool(post.get("followups")) and \
+            len(post["followups"]) < MAX_MODEL_FOLLOWUPS
+    return False
+
+
+def _post_texts(post, model_name):
+    """Returns the texts of a post that are cleaned for a model."""
+    if model_name == "POST":
+        return [post.get("subject"), post.get("body")]
+    elif model_name == "I_ANSWER":
+        return [post["i_answer"]]
+    elif model_name == "S_ANSWER":
+        return [post["s_answer"]]
+    elif model_name == "FOLLOWUP":
+        return [stringify_followups(post["followups"])]
+    return []
+
+
+def clean_posts(posts, model_name, batch_size=CLEAN_BATCH_SIZE,
+                n_process=CLEAN_N_PROCESS):
+    """Cleans the text of each post that is relevant to a model, streaming
+    every text through spacy_clean_many.
+
+    :param posts: the post items to clean
+    :param model_name: the TFIDF_MODELS name of the model
+    :param batch_size: number of texts spaCy processes per batch
+    :param n_process: number of worker processes spaCy uses
+    :return: generator of the cleaned words of each post as a space separated
+        string, in the order of posts
+    """
+    texts = (text for post in posts for text in _post_texts(post, model_name))
+    cleaned = spacy_clean_many(texts, batch_size, n_process)
+
+    for post in posts:
+        tokens = []
+        for _ in _post_texts(post, model_name):
+            tokens += next(cleaned)
+        if model_name == "POST":
+            tokens += list(post.get("tags") or [])
+        yield ' '.join(tokens)
+
+
+def get_model_words(posts, model_name, course_table=None,
+                    batch_size=CLEAN_BATCH_SIZE, n_process=CLEAN_N_PROCESS):
+    """Retrieves the cleaned words of every post that contributes to a model.
+
+    Words cached on a post are reused while the hash of the text they were
+    cleaned from still matches. Otherwise the words are looked up in the
+    local CleanCache, and only the texts missing from both are cleaned in
+    bulk. If course_table is given, fresh words and their hash are cached on
+    the post items in batches of concurrent writes.
+
+    :param posts: the post items of the course
+    :param model_name: the TFIDF_MODELS name of the model
+    :param course_table: the DynamoDB table of the course
+    :param batch_size: number of texts spaCy processes per batch
+    :param n_process: number of worker processes spaCy uses
+    :return: the words of each post and the pid of each string in words
+    """
+    model_posts = [post for post in posts if is_model_post(post, model_name)]
+    hashes = [text_hash(post, model_name) for post in model_posts]
+    words = [cached_words(post, model_name) for post in model_posts]
+
+    stale = [i for i, post_words in enumerate(words) if post_words is None]
+    clean_cache = CleanCache()
+    local_words = clean_cache.get_many(set(hashes[i] for i in stale))
+    uncleaned = [i for i in stale if hashes[i] not in local_words]
+
+    cleaned = clean_posts([model_posts[i] for i in uncleaned], model_name,
+                          batch_size, n_process)
+    for i, post_words in zip(uncleaned, cleaned):
+        local_words[hashes[i]] = post_words
+    clean_cache.put_many((hashes[i], local_words[hashes[i]]) for i in uncleaned)
+    clean_cache.close()
+    print("{} words: {} cached on posts, {} cached locally, {} cleaned".format(
+        model_name, len(model_posts) - len(stale), len(stale) - len(uncleaned),
+        len(uncleaned)))
+
+    writer = UpdateWriter(course_table) if course_table is not None else None
+    for i in stale:
+        words[i] = local_words[hashes[i]]
+        if writer is not None:
+            writer.update(
+                {"post_id": model_posts[i]["post_id"]},
+                'SET {} = :words, {} = :hash'.format(
+                    words_attribute(model_name), hash_attribute(model_name)),
+                {':words': words[i], ':hash': hashes[i]}
+            )
+
+    if writer is not None:
+        writer.close()
+        print("Cached {} words for {} posts, {} failed".format(
+            model_name, writer.persisted, writer.failed))
+
+    model_pid_list = [post["post_id"] for post in model_posts]
+    return words, model_pid_list
+
+
 def lambda_handler(event, context):
     if event["source"] == "ModelTrain":
         print("ModelTrain source")
@@ -61,100 +369,13 @@ def lambda_handler(event, context):
         course_id = event["course_id"]
         print("{} posts for course {}".format(len(posts), course_id))
 
-        dynamodb = boto3.resource('dynamodb')
+        dynamodb = get_resource('dynamodb')
         course_table = dynamodb.Table(course_id)
 
-        model_name = event["model_name"]
-        words = []
-        model_pid_list = []
-
-        for post in posts:
-            if model_name == "POST":
-                if not post.get("POST_words"):
-                    clean_subject = spacy_clean(post.get("subject"))
-                    clean_body = spacy_clean(post.get("body"))
-                    tags = post.get("tags")
-                    words.append(' '.join(clean_subject + clean_body + tags))
-                    try:
-                        course_table.update_item(
-                            Key={
-                                "post_id": post["post_id"]
-                            },
-                            UpdateExpression='SET POST_words = :post_words',
-                            ExpressionAttributeValues={
-                                ':post_words': ' '.join(clean_subject + clean_body + tags),
-                            }
-                        )
-                    except ClientError:
-                        pass
-                else:
-                    words.append(post.get("POST_words"))
-                model_pid_list.append(post["post_id"])
-            elif model_name == "I_ANSWER":
-                if post.get("i_answer"):
-                    if not post.get("I_ANSWER_words"):
-                        i_answer = ' '.join(spacy_clean(post["i_answer"]))
-                        words.append(i_answer)
-                        if len(i_answer) > 0:
-                            try:
-                                course_table.update_item(
-                                    Key={
-                                        "post_id": post["post_id"]
-                                    },
-                                    UpdateExpression='SET I_ANSWER_words = :words',
-                                    ExpressionAttributeValues={
-                                        ':words': i_answer,
-                                    }
-                                )
-                            except ClientError:
-                                pass
-                    else:
-                        words.append(post.get("I_ANSWER_words"))
-                    model_pid_list.append(post["post_id"])
-            elif model_name == "S_ANSWER":
-                if post.get("s_answer"):
-                    if not post.get("S_ANSWER_words"):
-                        s_answer = ' '.join(spacy_clean(post["s_answer"]))
-                        words.append(s_answer)
-
-                        if len(s_answer) > 0:
-                            try:
-                                course_table.update_item(
-                                    Key={
-                                        "post_id": post["post_id"]
-                                    },
-                                    UpdateExpression='SET S_ANSWER_words = :words',
-                                    ExpressionAttributeValues={
-                                        ':words': s_answer,
-                                    }
-                                )
-                            except ClientError:
-                                pass
-                    else:
-                        words.append(post.get("S_ANSWER_words"))
-                    model_pid_list.append(post["post_id"])
-            elif model_name == "FOLLOWUP":
-                if post.get("followups") and len(post["followups"]) < 15:
-                    if not post.get("FOLLOWUP_words"):
-                        followup_str = stringify_followups(post["followups"])
-                        followup_words = ' '.join(spacy_clean(followup_str))
-                        words.append(followup_words)
-                        if len(followup_words) > 0:
-                            try:
-                                course_table.update_item(
-                                    Key={
-                                        "post_id": post["post_id"]
-                                    },
-                                    UpdateExpression='SET FOLLOWUP_words = :words',
-                                    ExpressionAttributeValues={
-                                        ':words': followup_words,
-                                    }
-                                )
-                            except ClientError:
-                                pass
-                    else:
-                        words.append(post.get("FOLLOWUP_words"))
-                    model_pid_list.append(post["post_id"])
+        words, model_pid_list = get_model_words(
+            posts, event["model_name"], course_table,
+            batch_size=int(os.environ.get("CLEAN_BATCH_SIZE", CLEAN_BATCH_SIZE)),
+            n_process=int(os.environ.get("CLEAN_N_PROCESS", CLEAN_N_PROCESS)))
 
         response = {
             "words": words,
@@ -162,12 +383,17 @@ def lambda_handler(event, context):
         }
         print("{} words for {} posts".format(len(response["words"]), len(response["model_pid_list"])))
         return response
+    elif event["source"] == "Query" and "queries" in event:
+        print("Query source with {} queries".format(len(event["queries"])))
+        response = {
+            "clean_queries": clean_queries(event["queries"])
+        }
+        return response
     elif event["source"] == "Query":
         print("Query source")
         query = event["query"]
-        clean_query = spacy_clean(query, array=False)
         response = {
-            "clean_query": clean_query
+            "clean_query": clean_query(query)
         }
         print(response)
         return response
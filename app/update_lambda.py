@@ -1,8 +1,8 @@
-import boto3
+from app.aws import get_client
 
 
 def lambda_handler(event, context):
-    client = boto3.client("lambda")
+    client = get_client("lambda")
     print(event, context)
 
     function_names = [
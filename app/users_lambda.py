@@ -1,4 +1,4 @@
-import boto3
+from app.aws import get_client
 
 
 def lambda_handler(event, context):
@@ -7,7 +7,7 @@ def lambda_handler(event, context):
     course_id = event.get("course_id")
     user_id = event.get("user_id")
 
-    db = boto3.client("dynamodb")
+    db = get_client("dynamodb")
     db.update_item(
         TableName="Courses",
         Key={
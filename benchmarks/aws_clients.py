@@ -0,0 +1,102 @@
+"""Micro-benchmark of the boto3 client setup done by the query, feedback and
+event request paths.
+
+Usage:
+    python -m benchmarks.aws_clients [iterations] [--calls]
+
+Each path is timed building its clients per request, as the handlers used
+to, and getting them from the shared registry in app.aws.
+
+With --calls, it also times a DynamoDB DescribeLimits request made with a
+client built for that request against the same request made with the
+shared client. A new client opens a new connection and TLS session, while
+the shared one reuses its kept-alive connection. This needs AWS
+credentials.
+"""
+import os
+import sys
+import time
+import timeit
+
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-2")
+
+import boto3  # noqa: E402
+
+from app.aws import get_client, get_resource  # noqa: E402
+
+
+def query_per_request():
+    boto3.client('lambda')
+    boto3.client('dynamodb')
+
+
+def query_shared():
+    get_client('lambda')
+    get_client('dynamodb')
+
+
+def feedback_per_request():
+    boto3.client('lambda')
+    boto3.client('dynamodb')
+    boto3.resource('dynamodb').Table("Feedbacks")
+
+
+def feedback_shared():
+    get_client('lambda')
+    get_client('dynamodb')
+    get_resource('dynamodb').Table("Feedbacks")
+
+
+def event_per_request():
+    boto3.resource('dynamodb').Table('Events')
+
+
+def event_shared():
+    get_resource('dynamodb').Table('Events')
+
+
+PATHS = (
+    ("query", query_per_request, query_shared),
+    ("feedback", feedback_per_request, feedback_shared),
+    ("event", event_per_request, event_shared),
+)
+
+
+def _median_ms(func, iterations):
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1e3)
+    return sorted(timings)[len(timings) // 2]
+
+
+def call_per_request():
+    boto3.client('dynamodb').describe_limits()
+
+
+def call_shared():
+    get_client('dynamodb').describe_limits()
+
+
+def main():
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    iterations = int(args[0]) if args else 50
+    for name, per_request, shared in PATHS:
+        per_request_ms = timeit.timeit(per_request, number=iterations) / iterations * 1e3
+        shared_ms = timeit.timeit(shared, number=iterations) / iterations * 1e3
+        print("{}: {:.2f} ms per request -> {:.3f} ms shared, {:.2f} ms saved".format(
+            name, per_request_ms, shared_ms, per_request_ms - shared_ms))
+
+    if "--calls" in sys.argv:
+        # Open the connection of the shared client before timing it
+        call_shared()
+        per_request_ms = _median_ms(call_per_request, iterations)
+        shared_ms = _median_ms(call_shared, iterations)
+        print("first call: {:.2f} ms on a new client -> {:.2f} ms on the "
+              "shared client, {:.2f} ms saved (medians)".format(
+                  per_request_ms, shared_ms, per_request_ms - shared_ms))
+
+
+if __name__ == "__main__":
+    main()
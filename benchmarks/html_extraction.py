@@ -0,0 +1,68 @@
+"""Micro-benchmark of converting the HTML fragments of a Piazza post to text.
+
+Usage:
+    python -m benchmarks.html_extraction [path/to/post.json] [iterations]
+
+Compares app.html_text.extract_post_text with the previous approach of
+building a BeautifulSoup object for every fragment, if bs4 is installed.
+"""
+import json
+import os
+import sys
+import timeit
+
+from app.html_text import TextExtractor, extract_post_text
+
+DEFAULT_FIXTURE = os.path.join(os.path.dirname(__file__), "..", "tests",
+                               "fixtures", "piazza_post.json")
+
+
+def soup_post_text(post):
+    from bs4 import BeautifulSoup
+
+    def get_text(html):
+        return BeautifulSoup(html, "html.parser").get_text()
+
+    body = get_text(post["history"][0]["content"]) or None
+    s_answer, i_answer, followups = None, None, []
+    for child in post["children"]:
+        if child["type"] == "s_answer":
+            s_answer = get_text(child["history"][0]["content"])
+        elif child["type"] == "i_answer":
+            i_answer = get_text(child["history"][0]["content"])
+        elif child["type"] == "followup":
+            data = {}
+            text = get_text(child["subject"])
+            if text:
+                data["text"] = text
+            if child["children"]:
+                data["responses"] = [get_text(activity["subject"])
+                                     for activity in child["children"]
+                                     if get_text(activity["subject"])]
+            followups.append(data)
+    return body, s_answer, i_answer, followups
+
+
+def main():
+    path = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_FIXTURE
+    iterations = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    with open(path, "r") as fixture:
+        post = json.load(fixture)
+
+    extractor = TextExtractor()
+    seconds = timeit.timeit(lambda: extract_post_text(post, extractor), number=iterations)
+    print("extract_post_text: {:.1f} us/post".format(seconds / iterations * 1e6))
+
+    try:
+        import bs4  # noqa: F401
+    except ImportError:
+        print("bs4 is not installed, skipping the BeautifulSoup baseline")
+        return
+
+    assert soup_post_text(post) == extract_post_text(post, extractor)
+    seconds = timeit.timeit(lambda: soup_post_text(post), number=iterations)
+    print("BeautifulSoup get_text: {:.1f} us/post".format(seconds / iterations * 1e6))
+
+
+if __name__ == "__main__":
+    main()
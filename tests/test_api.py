@@ -88,5 +88,37 @@ class TestActiveCourseAPI(unittest.TestCase):
         assert res.data == self.res_data
 
 
+class TestCourseRegistry(unittest.TestCase):
+    def setUp(self):
+        self.env = mock.patch.dict('os.environ', {'stage': 'prod'})
+        with self.env:
+            from app.resources.course import CourseRegistry
+            self.registry = CourseRegistry(ttl_s=60)
+
+        self.events = mock.Mock()
+        self.events.list_rule_names_by_target.return_value = {
+            'RuleNames': ['j8rf9vx65vl23t', 'k0a1c2']
+        }
+        self.events.list_rules.side_effect = [
+            {'Rules': [{'Name': 'j8rf9vx65vl23t', 'State': 'ENABLED'}], 'NextToken': 'a'},
+            {'Rules': [{'Name': 'k0a1c2', 'State': 'DISABLED'},
+                       {'Name': 'unrelated', 'State': 'ENABLED'}]},
+        ]
+        self.boto3_lambda = mock.Mock()
+        self.boto3_lambda.get_function.return_value = {
+            'Configuration': {'FunctionArn': 'arn'}
+        }
+
+    def test_active_courses(self):
+        with mock.patch('app.resources.course.get_boto3_events', return_value=self.events), \
+                mock.patch('app.resources.course.get_boto3_lambda', return_value=self.boto3_lambda):
+            assert self.registry.active_courses() == {'j8rf9vx65vl23t': True, 'k0a1c2': False}
+            self.registry.set_active('k0a1c2', True)
+            assert self.registry.active_courses() == {'j8rf9vx65vl23t': True, 'k0a1c2': True}
+
+        assert self.events.list_rules.call_count == 2
+        assert not self.events.describe_rule.called
+
+
 if __name__ == "__main__":
     unittest.main()
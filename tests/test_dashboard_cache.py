@@ -0,0 +1,135 @@
+import unittest
+
+import mock
+from botocore.exceptions import ClientError
+
+from app import dashboard_cache
+from app.dashboard_cache import (
+    DASHBOARD_POSTS,
+    INSTRUCTOR_QUEUE,
+    STUDENT_RECS,
+    DashboardCache
+)
+
+
+class TestDashboardCache(unittest.TestCase):
+    def setUp(self):
+        self.versions = {INSTRUCTOR_QUEUE: 1, STUDENT_RECS: 1, DASHBOARD_POSTS: 1}
+        patcher = mock.patch.object(dashboard_cache, "get_dashboard_versions",
+                                    side_effect=lambda _: dict(self.versions))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.cache = DashboardCache(ttl_s=60, check_interval_s=0)
+
+    def get(self, kind, depends_on=None):
+        loader = mock.Mock(return_value=object())
+        value = self.cache.get(kind, "cid", loader, depends_on)
+        return value, loader.called
+
+    def test_reloads_only_on_its_own_versions(self):
+        queue, _ = self.get(INSTRUCTOR_QUEUE, (INSTRUCTOR_QUEUE, DASHBOARD_POSTS))
+        recs, _ = self.get(STUDENT_RECS)
+
+        self.versions[DASHBOARD_POSTS] += 1
+        assert self.get(STUDENT_RECS) == (recs, False)
+        new_queue, loaded = self.get(INSTRUCTOR_QUEUE,
+                                     (INSTRUCTOR_QUEUE, DASHBOARD_POSTS))
+        assert loaded and new_queue is not queue
+
+        self.versions[STUDENT_RECS] += 1
+        assert self.get(INSTRUCTOR_QUEUE, (INSTRUCTOR_QUEUE, DASHBOARD_POSTS)) == \
+            (new_queue, False)
+        assert self.get(STUDENT_RECS)[1]
+
+    def test_versions_are_checked_at_an_interval(self):
+        self.cache = DashboardCache(ttl_s=60, check_interval_s=60)
+        value, _ = self.get(STUDENT_RECS)
+        self.versions[STUDENT_RECS] += 1
+        assert self.get(STUDENT_RECS) == (value, False)
+
+    def test_none_is_not_cached(self):
+        loader = mock.Mock(return_value=None)
+        assert self.cache.get(STUDENT_RECS, "cid", loader) is None
+        assert self.cache.get(STUDENT_RECS, "cid", loader) is None
+        assert loader.call_count == 2
+
+
+class TestDashboardPosts(unittest.TestCase):
+    def setUp(self):
+        self.courses = mock.Mock()
+        self.posts = mock.Mock()
+        resource = mock.Mock()
+        resource.Table.side_effect = lambda name: \
+            self.courses if name == "Courses" else self.posts
+        patcher = mock.patch.object(dashboard_cache, "get_resource",
+                                    return_value=resource)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_reads_map(self):
+        self.courses.get_item.return_value = {"Item": {"dashboard_posts": {
+            "7": {"assignees": {"ta2": True, "ta1": True}, "resolved": True},
+            "9": {"assignees": {}},
+        }}}
+        assert dashboard_cache.get_dashboard_posts("cid") == {
+            7: {"assignees": ["ta1", "ta2"], "resolved": True},
+            9: {"assignees": []},
+        }
+        assert not self.posts.scan.called
+
+    def test_seeds_map_from_legacy_assignees(self):
+        self.courses.get_item.return_value = {"Item": {}}
+        self.posts.scan.side_effect = [
+            {"Items": [{"post_id": 3, "assignees": {"ta1"}}],
+             "LastEvaluatedKey": {"post_id": 3}},
+            {"Items": [{"post_id": 5, "assignees": {"ta2"}}]},
+        ]
+        self.courses.update_item.side_effect = lambda **kwargs: {
+            "Attributes": {"dashboard_posts":
+                           kwargs["ExpressionAttributeValues"][":seed"]}}
+        assert dashboard_cache.get_dashboard_posts("cid") == {
+            3: {"assignees": ["ta1"]},
+            5: {"assignees": ["ta2"]},
+        }
+        (_, kwargs), = self.courses.update_item.call_args_list
+        assert "if_not_exists" in kwargs["UpdateExpression"]
+
+    def test_update_bumps_posts_version(self):
+        dashboard_cache.update_dashboard_post(
+            "cid", 7, "SET dashboard_posts.#post.resolved = :resolved", {},
+            {":resolved": True})
+        (_, kwargs), = self.courses.update_item.call_args_list
+        assert kwargs["UpdateExpression"] == \
+            "SET dashboard_posts.#post.resolved = :resolved " \
+            "ADD dashboard_posts_version :one"
+        assert kwargs["ExpressionAttributeNames"] == {"#post": "7"}
+        assert not self.posts.scan.called
+
+    def test_update_creates_missing_entry(self):
+        missing_path = ClientError({"Error": {"Code": "ValidationException"}},
+                                   "UpdateItem")
+        self.courses.update_item.side_effect = [missing_path, {}, {}, {}]
+        self.courses.get_item.return_value = {"Item": {}}
+        self.posts.scan.return_value = {"Items": []}
+        dashboard_cache.update_dashboard_post(
+            "cid", 7, "SET dashboard_posts.#post.assignees.#assignee = :true",
+            {"#assignee": "ta1"}, {":true": True})
+
+        update, seed, entry, retry = \
+            [kwargs for _, kwargs in self.courses.update_item.call_args_list]
+        assert seed["ExpressionAttributeValues"] == {":seed": {}}
+        assert entry["ExpressionAttributeValues"] == {":entry": {"assignees": {}}}
+        assert retry == update
+
+    def test_update_of_missing_course(self):
+        self.courses.update_item.side_effect = ClientError(
+            {"Error": {"Code": "ConditionalCheckFailedException"}}, "UpdateItem")
+        with self.assertRaises(ClientError):
+            dashboard_cache.update_dashboard_post(
+                "cid", 7, "SET dashboard_posts.#post.resolved = :resolved", {},
+                {":resolved": True})
+        assert self.courses.update_item.call_count == 1
+
+
+if __name__ == "__main__":
+    unittest.main()
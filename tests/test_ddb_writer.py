@@ -0,0 +1,181 @@
+import threading
+import unittest
+
+import mock
+from botocore.exceptions import ClientError
+
+from app.constants import DDB_MAX_RETRIES
+from app.ddb_writer import BatchWriter, UpdateWriter, with_backoff
+
+
+def make_table():
+    table = mock.MagicMock()
+    table.name = "cid"
+    return table
+
+
+def client_error(code):
+    return ClientError({"Error": {"Code": code, "Message": code}}, "BatchWriteItem")
+
+
+def put(pid):
+    return {"PutRequest": {"Item": {"post_id": pid}}}
+
+
+@mock.patch("app.ddb_writer.time.sleep")
+class TestWithBackoff(unittest.TestCase):
+    def test_retries_throttling(self, sleep):
+        func = mock.Mock(side_effect=[client_error("ThrottlingException"), "ok"])
+        assert with_backoff(func) == "ok"
+        assert func.call_count == 2
+
+    def test_raises_other_errors(self, sleep):
+        func = mock.Mock(side_effect=client_error("ValidationException"))
+        with self.assertRaises(ClientError):
+            with_backoff(func)
+        assert func.call_count == 1
+
+    def test_gives_up(self, sleep):
+        func = mock.Mock(side_effect=client_error("ThrottlingException"))
+        with self.assertRaises(ClientError):
+            with_backoff(func, max_retries=2)
+        assert func.call_count == 3
+
+
+@mock.patch("app.ddb_writer.time.sleep")
+class TestBatchWriter(unittest.TestCase):
+    def setUp(self):
+        self.table = make_table()
+        self.client = self.table.meta.client
+
+    def test_batches(self, sleep):
+        self.client.batch_write_item.return_value = {}
+        with BatchWriter(self.table, batch_size=2) as writer:
+            for pid in range(5):
+                writer.put({"post_id": pid, "subject": "s"})
+            writer.delete({"post_id": 5})
+
+        assert self.client.batch_write_item.call_count == 3
+        assert writer.persisted == 6
+        assert writer.failed == 0
+        assert writer.failed_keys == []
+
+    def test_last_write_wins(self, sleep):
+        self.client.batch_write_item.return_value = {}
+        with BatchWriter(self.table) as writer:
+            writer.put({"post_id": 1, "subject": "a"})
+            writer.delete({"post_id": 1})
+
+        (_, kwargs), = self.client.batch_write_item.call_args_list
+        assert kwargs["RequestItems"] == {"cid": [{"DeleteRequest": {"Key": {"post_id": 1}}}]}
+
+    def test_retries_unprocessed_items(self, sleep):
+        self.client.batch_write_item.side_effect = [
+            {"UnprocessedItems": {"cid": [put(2), put(3)]}},
+            {"UnprocessedItems": {"cid": [put(3)]}},
+            {},
+        ]
+        with BatchWriter(self.table) as writer:
+            for pid in (1, 2, 3):
+                writer.put({"post_id": pid})
+
+        calls = self.client.batch_write_item.call_args_list
+        assert [len(kwargs["RequestItems"]["cid"]) for _, kwargs in calls] == [3, 2, 1]
+        assert calls[2][1]["RequestItems"]["cid"] == [put(3)]
+        assert writer.persisted == 3
+        assert writer.failed_keys == []
+
+    def test_reports_items_left_unprocessed(self, sleep):
+        self.client.batch_write_item.side_effect = \
+            [{"UnprocessedItems": {"cid": [put(2)]}}] * (DDB_MAX_RETRIES + 1)
+        with BatchWriter(self.table) as writer:
+            writer.put({"post_id": 1})
+            writer.put({"post_id": 2})
+
+        assert self.client.batch_write_item.call_count == DDB_MAX_RETRIES + 1
+        assert writer.persisted == 1
+        assert writer.failed == 1
+        assert writer.failed_keys == [{"post_id": 2}]
+
+    def test_reports_failed_requests(self, sleep):
+        self.client.batch_write_item.side_effect = client_error("ValidationException")
+        with BatchWriter(self.table) as writer:
+            writer.put({"post_id": 1})
+            writer.delete({"post_id": 2})
+
+        assert writer.persisted == 0
+        assert writer.failed_keys == [{"post_id": 1}, {"post_id": 2}]
+
+    def test_reports_errors_raised_in_workers(self, sleep):
+        def batch_write_item(RequestItems):
+            if RequestItems["cid"][0] == put(1):
+                raise TimeoutError
+            return {}
+
+        self.client.batch_write_item.side_effect = batch_write_item
+        with BatchWriter(self.table, batch_size=1) as writer:
+            writer.put({"post_id": 1})
+            writer.put({"post_id": 2})
+
+        assert writer.persisted == 1
+        assert writer.failed_keys == [{"post_id": 1}]
+
+    def test_bounds_requests_in_flight(self, sleep):
+        lock = threading.Lock()
+        release = threading.Event()
+        in_flight = [0, 0]
+
+        def batch_write_item(RequestItems):
+            with lock:
+                in_flight[0] += 1
+                in_flight[1] = max(in_flight)
+            release.wait(0.05)
+            with lock:
+                in_flight[0] -= 1
+            return {}
+
+        self.client.batch_write_item.side_effect = batch_write_item
+        with BatchWriter(self.table, batch_size=1, max_workers=2) as writer:
+            for pid in range(6):
+                writer.put({"post_id": pid})
+                assert len(writer._pending) <= 2
+        release.set()
+
+        assert in_flight[1] <= 2
+        assert writer.persisted == 6
+
+
+class TestUpdateWriter(unittest.TestCase):
+    def setUp(self):
+        self.table = make_table()
+        self.client = self.table.meta.client
+
+    def test_updates(self):
+        with UpdateWriter(self.table, batch_size=2) as writer:
+            for pid in range(3):
+                writer.update({"post_id": pid}, "SET a = :a", {":a": pid})
+
+        assert self.client.update_item.call_count == 3
+        self.client.update_item.assert_any_call(
+            TableName="cid", Key={"post_id": 2}, UpdateExpression="SET a = :a",
+            ExpressionAttributeValues={":a": 2})
+        assert writer.persisted == 3
+
+    def test_reports_failed_updates(self):
+        def update_item(Key, **kwargs):
+            if Key["post_id"] == 1:
+                raise client_error("ValidationException")
+            if Key["post_id"] == 2:
+                raise TimeoutError
+
+        self.client.update_item.side_effect = update_item
+        with UpdateWriter(self.table) as writer:
+            for pid in range(3):
+                writer.update({"post_id": pid}, "SET a = :a", {":a": pid})
+
+        assert writer.persisted == 1
+        assert sorted(key["post_id"] for key in writer.failed_keys) == [1, 2]
+
+
+if __name__ == "__main__":
+    unittest.main()
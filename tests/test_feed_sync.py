@@ -0,0 +1,205 @@
+import io
+import time
+import unittest
+from datetime import datetime
+
+import mock
+
+from app.constants import DATETIME_FORMAT
+from app.feed_sync import FeedIndex
+
+NOW = int(time.time()) // 60 * 60
+
+
+def feed_item(pid, modified, pin=False):
+    item = {"nr": pid,
+            "modified": datetime.fromtimestamp(modified).strftime(DATETIME_FORMAT)}
+    if pin:
+        item["pin"] = 1
+    return item
+
+
+class FakeNetwork(object):
+    """Serves a feed ordered like Piazza's: pinned posts first, then the
+    rest by modification time, newest first."""
+
+    def __init__(self, modified, pinned=()):
+        self.modified = dict(modified)
+        self.pinned = set(pinned)
+        self.requests = []
+
+    def get_feed(self, limit=100, offset=0):
+        self.requests.append((limit, offset))
+        order = sorted(self.modified, key=lambda pid: (
+            pid not in self.pinned, -self.modified[pid]))
+        feed = [feed_item(pid, self.modified[pid], pid in self.pinned)
+                for pid in order]
+        return {"feed": feed[offset:offset + limit]}
+
+
+@mock.patch("app.feed_sync.FEED_PAGE_SIZE", 3)
+class TestFeedIndexChanges(unittest.TestCase):
+    def setUp(self):
+        # Post 1 is the oldest and post 10 the newest
+        self.network = FakeNetwork({pid: NOW - 1000 + pid * 10
+                                    for pid in range(1, 11)})
+        self.index = FeedIndex("cid")
+
+    def sync_all(self):
+        changed, missing = self.index.changes(self.network, full=True)
+        for pid, modified in changed.items():
+            self.index.mark_synced(pid, modified)
+        self.index.mark_counts_backfilled()
+        self.network.requests = []
+        return changed, missing
+
+    def test_first_sync_is_full(self):
+        assert self.index.needs_full_sync()
+        changed, missing = self.sync_all()
+        assert changed == self.network.modified
+        assert missing == set()
+        assert not self.index.needs_full_sync()
+
+    def test_full_sync_until_counts_backfilled(self):
+        changed, _ = self.index.changes(self.network, full=True)
+        for pid, modified in changed.items():
+            self.index.mark_synced(pid, modified)
+        assert self.index.needs_full_sync()
+        self.index.mark_counts_backfilled()
+        assert not self.index.needs_full_sync()
+
+    def test_nothing_changed(self):
+        self.sync_all()
+        assert self.index.changes(self.network) == ({}, None)
+        assert self.network.requests == [(3, 0)]
+
+    def test_stops_at_first_current_post(self):
+        self.sync_all()
+        self.network.modified[4] = NOW
+        self.network.modified[11] = NOW + 10
+        changed, missing = self.index.changes(self.network)
+        assert changed == {4: NOW, 11: NOW + 10}
+        assert missing is None
+        assert self.network.requests == [(3, 0)]
+
+    def test_pages_through_changes(self):
+        self.sync_all()
+        for pid in range(1, 8):
+            self.network.modified[pid] = NOW + pid
+        changed, _ = self.index.changes(self.network)
+        assert set(changed) == set(range(1, 8))
+        assert self.network.requests == [(3, 0), (3, 3), (3, 6)]
+
+    def test_reads_past_pinned_posts(self):
+        self.sync_all()
+        self.network.pinned = {1, 2}
+        self.network.modified[5] = NOW
+        changed, _ = self.index.changes(self.network)
+        assert changed == {5: NOW}
+
+    def test_stops_at_end_of_feed(self):
+        self.network.pinned = set(self.network.modified)
+        self.sync_all()
+        assert self.index.changes(self.network) == ({}, None)
+        assert self.network.requests == [(3, 0), (3, 3), (3, 6), (3, 9)]
+
+    def test_pending_posts_are_retried(self):
+        self.sync_all()
+        # Post 2 changed, but could not be fetched
+        self.network.modified[2] = NOW
+        changed, _ = self.index.changes(self.network)
+        assert changed == {2: NOW}
+        self.index.mark_pending(2, NOW)
+
+        # Later changes push post 2 below the first current post
+        self.network.modified[3] = NOW + 10
+        self.index.mark_synced(3, NOW + 10)
+        assert self.index.changes(self.network)[0] == {2: NOW}
+        assert self.index.changes(self.network)[0] == {2: NOW}
+
+        self.index.mark_synced(2, NOW)
+        assert self.index.changes(self.network)[0] == {}
+
+    def test_hidden_posts_until_changed(self):
+        self.sync_all()
+        self.network.modified[7] = NOW
+        changed, _ = self.index.changes(self.network)
+        self.index.mark_hidden(7, changed[7])
+
+        assert 7 not in self.index
+        assert self.index.changes(self.network)[0] == {}
+        self.network.modified[7] = NOW + 10
+        assert self.index.changes(self.network)[0] == {7: NOW + 10}
+
+    def test_missing_posts_on_full_sync_only(self):
+        self.sync_all()
+        self.index.mark_pending(4, NOW)
+        self.index.mark_hidden(6, NOW)
+        for pid in (3, 4, 6):
+            del self.network.modified[pid]
+
+        assert self.index.changes(self.network)[1] is None
+        changed, missing = self.index.changes(self.network, full=True)
+        assert changed == {}
+        assert missing == {3, 4}
+
+        # Pending and hidden posts that left the feed are forgotten
+        for pid in missing:
+            self.index.discard(pid)
+        assert self.index.changes(self.network) == ({}, None)
+        self.network.modified[6] = NOW - 2000
+        assert self.index.changes(self.network, full=True)[0] == {6: NOW - 2000}
+
+    def test_seed_from_legacy_pids(self):
+        # Earlier Parsers only stored the pids and the last run of the course
+        last_modified = NOW - 1000 + 55
+        self.index.seed(range(1, 9), last_modified)
+        assert self.index.needs_full_sync()
+
+        changed, missing = self.index.changes(self.network, full=True)
+        assert changed == {pid: self.network.modified[pid] for pid in (6, 7, 8, 9, 10)}
+        assert missing == set()
+
+        del self.network.modified[1]
+        assert self.index.changes(self.network, full=True)[1] == {1}
+
+
+class TestFeedIndexStorage(unittest.TestCase):
+    def setUp(self):
+        self.s3 = mock.Mock()
+        patcher = mock.patch("app.feed_sync.get_boto3_s3", return_value=self.s3)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_round_trip(self):
+        index = FeedIndex("cid")
+        index.mark_synced(1, NOW, "a")
+        index.mark_hidden(2, NOW)
+        index.mark_pending(3, NOW)
+        index.mark_counts_backfilled()
+        index.save()
+
+        (_, kwargs), = self.s3.put_object.call_args_list
+        assert kwargs["Key"] == "feeds/cid.json"
+        self.s3.get_object.return_value = {"Body": io.BytesIO(kwargs["Body"])}
+        loaded = FeedIndex("cid")
+        loaded.load()
+
+        assert loaded.pids == {1}
+        assert loaded.fingerprint(1) == "a"
+        assert loaded.is_current(feed_item(2, NOW))
+        assert loaded.counts_backfilled
+        network = FakeNetwork({1: NOW, 3: NOW})
+        assert loaded.changes(network) == ({3: NOW}, None)
+
+    def test_save_only_changes(self):
+        index = FeedIndex("cid")
+        index.mark_synced(1, NOW)
+        index.save()
+        index.mark_synced(1, NOW)
+        index.save()
+        assert self.s3.put_object.call_count == 1
+
+
+if __name__ == "__main__":
+    unittest.main()
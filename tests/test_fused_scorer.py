@@ -0,0 +1,141 @@
+import os
+import tempfile
+import unittest
+
+import mock
+import numpy as np
+import pandas as pd
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.metrics.pairwise import cosine_similarity
+
+from app.constants import SCORE_THRESHOLD, TFIDF_MODELS, TFIDF_MODEL_WEIGHTS
+from app.model_artifact import (
+    decode_model,
+    encode_fused,
+    encode_model,
+    read_arrays,
+    write_arrays
+)
+
+with mock.patch.dict("os.environ", {"AWS_DEFAULT_REGION": "us-east-1"}):
+    from app.parqr_lambda import FusedScorer, ModelInfo
+
+DOCS = {
+    TFIDF_MODELS.POST: {
+        1: "free linked list memory leak",
+        2: "segfault freeing linked list head",
+        3: "midterm cumulative exam",
+        4: "exam review session room",
+    },
+    TFIDF_MODELS.I_ANSWER: {
+        1: "free every node before the list",
+        3: "the midterm covers every lecture",
+    },
+    TFIDF_MODELS.S_ANSWER: {
+        2: "set head to null after free",
+        4: "review session is in the lecture room",
+    },
+}
+
+QUERIES = ["free linked list", "midterm exam room", "lecture", "unknown words"]
+
+
+def fit_models():
+    models = {}
+    for name in TFIDF_MODELS:
+        if name not in DOCS:
+            # Courses without followups have no FOLLOWUP model
+            models[name] = ModelInfo(name)
+            continue
+        vectorizer = TfidfVectorizer()
+        matrix = vectorizer.fit_transform(list(DOCS[name].values()))
+        models[name] = ModelInfo(name, vectorizer, matrix,
+                                 np.array(list(DOCS[name]), dtype=np.int64))
+    return models
+
+
+def pandas_scores(models, query):
+    """The weighted combination of the cosine similarities of each model, as
+    scored one model at a time into a DataFrame before the FusedScorer."""
+    all_pids = np.unique(np.concatenate(
+        [model.post_ids for model in models.values() if model.post_ids is not None]))
+    tfidf_scores = pd.DataFrame(index=all_pids)
+    for model_name, model in models.items():
+        if model.vectorizer is None or model.matrix is None:
+            tfidf_scores.loc[all_pids, model_name] = np.zeros(len(all_pids))
+            continue
+        q_vector = model.vectorizer.transform([query])
+        tfidf_scores.loc[model.post_ids, model_name] = \
+            cosine_similarity(q_vector, model.matrix)[0]
+    tfidf_scores.fillna(0, inplace=True)
+
+    weights = pd.DataFrame([TFIDF_MODEL_WEIGHTS[name] for name in models],
+                           index=list(models))
+    return tfidf_scores.dot(weights)[0]
+
+
+class TestFusedScorer(unittest.TestCase):
+    def setUp(self):
+        self.models = fit_models()
+
+    def assert_matches_pandas(self, scorer):
+        scores = scorer.score(QUERIES)
+        for query, query_scores in zip(QUERIES, scores):
+            expected = pandas_scores(self.models, query)
+            np.testing.assert_array_equal(scorer.post_ids, expected.index.values)
+            np.testing.assert_allclose(query_scores, expected.values, atol=1e-12)
+
+    def assert_top_n_matches_pandas(self, scorer, N):
+        for query, (pids, scores) in zip(QUERIES, scorer.top_n_many(QUERIES, N)):
+            expected = pandas_scores(self.models, query)
+            expected = expected.sort_values(ascending=False, kind="stable")[:N]
+            expected = expected[expected > SCORE_THRESHOLD]
+            assert pids.tolist() == expected.index.tolist()
+            np.testing.assert_allclose(scores, expected.values, atol=1e-12)
+
+    def test_from_models(self):
+        scorer = FusedScorer.from_models(self.models.values())
+        self.assert_matches_pandas(scorer)
+        self.assert_top_n_matches_pandas(scorer, 2)
+        self.assert_top_n_matches_pandas(scorer, 10)
+
+    def test_from_artifact(self):
+        arrays = encode_fused({name: (model.vectorizer, model.matrix, model.post_ids)
+                               for name, model in self.models.items()
+                               if model.vectorizer is not None})
+        for name, model in self.models.items():
+            if model.vectorizer is not None:
+                arrays.update(encode_model(name.name, model.vectorizer,
+                                           model.matrix, model.post_ids))
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "cid_models.parqr")
+            write_arrays(path, arrays)
+            arrays = read_arrays(path)
+            models = {name: ModelInfo(name, *decode_model(name.name, arrays))
+                      for name in TFIDF_MODELS}
+            scorer = FusedScorer.from_artifact(arrays, models)
+
+            # The fused matrix is served out of the memory map
+            assert np.shares_memory(scorer._matrix.data, arrays["fused/data"])
+            self.assert_matches_pandas(scorer)
+            self.assert_top_n_matches_pandas(scorer, 3)
+
+    def test_from_artifact_with_other_weights(self):
+        arrays = encode_fused({TFIDF_MODELS.POST: (
+            self.models[TFIDF_MODELS.POST].vectorizer,
+            self.models[TFIDF_MODELS.POST].matrix,
+            self.models[TFIDF_MODELS.POST].post_ids)})
+        weights = dict(TFIDF_MODEL_WEIGHTS)
+        weights[TFIDF_MODELS.POST] = 1.0
+        assert FusedScorer.from_artifact(arrays, self.models, weights) is None
+
+    def test_no_models(self):
+        scorer = FusedScorer.from_models([ModelInfo(name) for name in TFIDF_MODELS])
+        assert scorer.score(QUERIES).shape == (len(QUERIES), 0)
+        assert [pids.tolist() for pids, _ in scorer.top_n_many(QUERIES, 5)] == \
+            [[]] * len(QUERIES)
+
+
+if __name__ == "__main__":
+    unittest.main()
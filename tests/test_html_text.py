@@ -0,0 +1,70 @@
+import json
+import os
+import unittest
+
+import pytest
+
+from app.html_text import TextExtractor, extract_post_text
+
+FIXTURE = os.path.join(os.path.dirname(__file__), "fixtures", "piazza_post.json")
+
+
+def load_post():
+    with open(FIXTURE, "r") as fixture:
+        return json.load(fixture)
+
+
+class TestTextExtractor(unittest.TestCase):
+    def setUp(self):
+        self.extractor = TextExtractor()
+
+    def test_to_text(self):
+        assert self.extractor.to_text("<p>a <b>b</b> &amp; c&nbsp;</p>") == "a b & c\xa0"
+
+    def test_skips_comments_and_scripts(self):
+        assert self.extractor.to_text("<p>a<!-- b --></p><script>c()</script>d") == "ad"
+
+    def test_reuse(self):
+        assert self.extractor.to_text("<p>unclosed <b>tag") == "unclosed tag"
+        assert self.extractor.to_text("plain") == "plain"
+
+    def test_extract_post_text(self):
+        body, s_answer, i_answer, followups = extract_post_text(load_post())
+        assert body.startswith("When I run my free_list function")
+        assert "head->next" in s_answer
+        assert "—" in i_answer
+        assert followups[0]["responses"][1] == "Thanks! That fixed it \U0001F44D"
+        assert followups[1] == {"text": "Is it OK to set head = NULL at the end?"}
+
+    def test_empty_body(self):
+        post = load_post()
+        post["history"][0]["content"] = "<p></p>"
+        assert extract_post_text(post)[0] is None
+
+
+class TestBeautifulSoupParity(unittest.TestCase):
+    def test_fixture_matches_get_text(self):
+        bs4 = pytest.importorskip("bs4")
+
+        def get_text(html):
+            return bs4.BeautifulSoup(html, "html.parser").get_text()
+
+        post = load_post()
+        body, s_answer, i_answer, followups = extract_post_text(post)
+        assert body == get_text(post["history"][0]["content"])
+        assert s_answer == get_text(post["children"][0]["history"][0]["content"])
+        assert i_answer == get_text(post["children"][1]["history"][0]["content"])
+        assert followups[0]["text"] == get_text(post["children"][2]["subject"])
+
+    def test_fragments_match_get_text(self):
+        bs4 = pytest.importorskip("bs4")
+        extractor = TextExtractor()
+        for html in ("<![CDATA[foo]]>bar", "<p>a<![CDATA[<b>x</b>]]></p>",
+                     "<!DOCTYPE html><p>a</p>", "<script><![CDATA[x]]></script>y",
+                     "<?php echo 1 ?>a<!-- b -->c"):
+            assert extractor.to_text(html) == \
+                bs4.BeautifulSoup(html, "html.parser").get_text(), html
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,166 @@
+import unittest
+
+import pytest
+
+from app.instructor_queue import InstructorQueue, decode_cursor, queue_entry
+
+
+def make_item(pid, views, followups=0, tags=("hw1",), assignees=None,
+              resolved=False, i_answer=None):
+    item = {
+        "subject": "Post {}".format(pid),
+        "post_id": pid,
+        "num_views": views,
+        "num_unresolved_followups": followups,
+        "tags": list(tags),
+        "created": 1500000000 + pid,
+        "body": "a question",
+        "resolved": resolved,
+    }
+    if assignees:
+        item["assignees"] = set(assignees)
+    if i_answer:
+        item["i_answer"] = i_answer
+    return item
+
+
+def all_pages(queue, limit, **filters):
+    pids, cursor = [], None
+    while True:
+        rows, cursor = queue.page(limit, cursor, fields=["post_id"], **filters)
+        pids.extend(row["post_id"] for row in rows)
+        if cursor is None:
+            return pids
+
+
+class TestInstructorQueuePaging(unittest.TestCase):
+    def setUp(self):
+        items = [make_item(pid, views=pid % 4, followups=pid % 2,
+                           tags=["hw1"] if pid % 3 else ["hw2", "exam"],
+                           assignees=["ta1"] if pid % 5 == 0 else None,
+                           resolved=pid % 4 == 0)
+                 for pid in range(1, 31)]
+        self.queue = InstructorQueue.from_entries(map(queue_entry, items))
+        self.entries = self.queue.entries()
+
+    def pids(self, predicate=lambda entry: True):
+        return [entry["post_id"] for entry in self.entries if predicate(entry)]
+
+    def test_sorted_by_followups_and_views(self):
+        keys = [(entry["num_unresolved_followups"], entry["num_views"],
+                 entry["post_id"]) for entry in self.entries]
+        assert keys == sorted(keys)
+
+    def test_pages_cover_queue(self):
+        for limit in (1, 7, 30, 100):
+            assert all_pages(self.queue, limit) == self.pids()
+
+    def test_last_page_has_no_cursor(self):
+        rows, cursor = self.queue.page(30)
+        assert len(rows) == 30
+        assert cursor is None
+
+    def test_filters(self):
+        assert all_pages(self.queue, 4, tag="exam") == \
+            self.pids(lambda entry: "exam" in entry["tags"])
+        assert all_pages(self.queue, 4, assignee="ta1") == \
+            self.pids(lambda entry: "ta1" in entry["assignees"])
+        assert all_pages(self.queue, 4, resolved=False) == \
+            self.pids(lambda entry: not entry["resolved"])
+        assert all_pages(self.queue, 2, tag="hw1", resolved=True) == \
+            self.pids(lambda entry: "hw1" in entry["tags"] and entry["resolved"])
+        assert all_pages(self.queue, 4, tag="missing") == []
+
+    def test_filtered_cursor_continues_unfiltered_order(self):
+        rows, cursor = self.queue.page(3, tag="exam", fields=["post_id"])
+        exam = self.pids(lambda entry: "exam" in entry["tags"])
+        assert [row["post_id"] for row in rows] == exam[:3]
+        rows, _ = self.queue.page(3, cursor, tag="exam", fields=["post_id"])
+        assert [row["post_id"] for row in rows] == exam[3:6]
+
+    def test_fields(self):
+        rows, _ = self.queue.page(1, fields=["post_id", "title"])
+        assert set(rows[0]) == {"post_id", "title"}
+
+    def test_invalid_cursor(self):
+        with pytest.raises(ValueError):
+            self.queue.page(5, cursor="not a cursor")
+        with pytest.raises(ValueError):
+            decode_cursor("WzEsIDJd")  # [1, 2]
+
+
+class TestInstructorQueueStability(unittest.TestCase):
+    def setUp(self):
+        items = [make_item(pid, views=pid) for pid in range(1, 21)]
+        self.queue = InstructorQueue.from_entries(map(queue_entry, items))
+
+    def test_changes_between_pages(self):
+        rows, cursor = self.queue.page(5, fields=["post_id"])
+        first_page = [row["post_id"] for row in rows]
+        assert first_page == [1, 2, 3, 4, 5]
+
+        # A post is added before the cursor, one after it, a served post is
+        # deleted and an unserved post moves in front of the cursor
+        self.queue.patch({
+            21: queue_entry(make_item(21, views=0)),
+            22: queue_entry(make_item(22, views=50)),
+            8: queue_entry(make_item(8, views=0)),
+        }, deleted_pids=[2])
+
+        rest = []
+        while cursor is not None:
+            rows, cursor = self.queue.page(5, cursor, fields=["post_id"])
+            rest.extend(row["post_id"] for row in rows)
+
+        # Nothing that was served is served again and every post that stayed
+        # behind the cursor is still served, in order
+        assert rest == [6, 7] + list(range(9, 21)) + [22]
+
+    def test_overlay_between_pages(self):
+        rows, cursor = self.queue.page(5, resolved=False, fields=["post_id"])
+        assert [row["post_id"] for row in rows] == [1, 2, 3, 4, 5]
+
+        queue = self.queue.overlay({7: {"assignees": ["ta1"], "resolved": True}})
+        rows, cursor = queue.page(5, cursor, resolved=False,
+                                  fields=["post_id", "assignees"])
+        assert [row["post_id"] for row in rows] == [6, 8, 9, 10, 11]
+        rows, _ = queue.page(5, assignee="ta1",
+                             fields=["post_id", "assignees", "resolved"])
+        assert rows == [{"post_id": 7, "assignees": ["ta1"], "resolved": True}]
+
+    def test_overlay_keeps_resolved_from_piazza(self):
+        queue = InstructorQueue.from_entries([
+            queue_entry(make_item(1, views=1, assignees=["ta1"], resolved=True)),
+            queue_entry(make_item(2, views=2)),
+            queue_entry(make_item(3, views=3, resolved=True)),
+        ])
+        overlaid = queue.overlay({2: {"assignees": ["ta2"]},
+                                  3: {"assignees": [], "resolved": False}})
+        assert [(entry["assignees"], entry["resolved"])
+                for entry in overlaid.entries()] == \
+            [([], True), (["ta2"], False), ([], False)]
+        # The stored queue is left as it is
+        assert queue.entries()[0]["assignees"] == ["ta1"]
+
+
+class TestInstructorQueuePatch(unittest.TestCase):
+    def setUp(self):
+        self.queue = InstructorQueue.from_entries(
+            queue_entry(make_item(pid, views=pid)) for pid in range(1, 6))
+
+    def test_unchanged_entries(self):
+        assert not self.queue.patch({2: queue_entry(make_item(2, views=2)),
+                                     9: None}, deleted_pids=[8])
+        assert len(self.queue) == 5
+
+    def test_changed_entries(self):
+        assert self.queue.patch({2: queue_entry(make_item(2, views=9))})
+        assert [entry["post_id"] for entry in self.queue.entries()] == \
+            [1, 3, 4, 5, 2]
+        assert self.queue.patch({}, deleted_pids=[3])
+        assert self.queue.patch({4: None})
+        assert [entry["post_id"] for entry in self.queue.entries()] == [1, 5, 2]
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,133 @@
+import unittest
+
+import mock
+import numpy as np
+from sklearn.feature_extraction.text import CountVectorizer, TfidfVectorizer
+
+from app.constants import TFIDF_MODELS
+from app.model_artifact import encode_model
+
+with mock.patch.dict("os.environ", {"AWS_DEFAULT_REGION": "us-east-1"}):
+    from app import modeltrain_lambda
+    from app.modeltrain_lambda import (
+        STOP_WORDS,
+        tfidf_from_counts,
+        update_counts
+    )
+
+DOCS = {
+    1: "How do I free a linked list without leaking memory",
+    2: "Segfault when freeing the head of my linked list",
+    3: "Is the midterm cumulative",
+}
+
+
+def count(docs):
+    count_vectorizer = CountVectorizer(analyzer='word', stop_words=STOP_WORDS,
+                                       lowercase=True)
+    counts = count_vectorizer.fit_transform(docs).tocsr()
+    return counts, count_vectorizer.vocabulary_
+
+
+def refit(docs):
+    vectorizer = TfidfVectorizer(analyzer='word', stop_words=STOP_WORDS,
+                                 lowercase=True)
+    return vectorizer, vectorizer.fit_transform(docs)
+
+
+def assert_same_model(vectorizer, matrix, expected_vectorizer, expected_matrix):
+    """Compares two models up to the order of the columns of their terms."""
+    assert set(vectorizer.vocabulary_) == set(expected_vectorizer.vocabulary_)
+    columns = [vectorizer.vocabulary_[term] for term in
+               sorted(expected_vectorizer.vocabulary_,
+                      key=expected_vectorizer.vocabulary_.get)]
+    np.testing.assert_allclose(np.asarray(vectorizer.idf_)[columns],
+                               expected_vectorizer.idf_)
+    np.testing.assert_allclose(matrix[:, columns].toarray(),
+                               expected_matrix.toarray())
+
+
+class TestTfidfFromCounts(unittest.TestCase):
+    def test_matches_fit(self):
+        counts, vocabulary = count(list(DOCS.values()))
+        vectorizer, matrix = tfidf_from_counts(counts, vocabulary)
+        assert_same_model(vectorizer, matrix, *refit(list(DOCS.values())))
+
+    def test_transforms_queries_like_fit(self):
+        counts, vocabulary = count(list(DOCS.values()))
+        vectorizer, _ = tfidf_from_counts(counts, vocabulary)
+        expected_vectorizer, _ = refit(list(DOCS.values()))
+        query = ["free the linked list"]
+        assert_same_model(vectorizer, vectorizer.transform(query),
+                          expected_vectorizer, expected_vectorizer.transform(query))
+
+
+class TestUpdateCounts(unittest.TestCase):
+    def setUp(self):
+        self.counts, self.vocabulary = count(list(DOCS.values()))
+        self.post_ids = np.array(list(DOCS), dtype=np.int64)
+
+    def test_edit_and_add(self):
+        edited = "Segfault in free_list after the final exam review"
+        added = "When is the final exam"
+        counts, vocabulary, post_ids = update_counts(
+            self.counts, self.vocabulary, self.post_ids, {2}, [edited, added], [2, 4])
+
+        assert post_ids.tolist() == [1, 3, 2, 4]
+        vectorizer, matrix = tfidf_from_counts(counts, vocabulary)
+        assert_same_model(vectorizer, matrix,
+                          *refit([DOCS[1], DOCS[3], edited, added]))
+
+    def test_delete_prunes_terms(self):
+        counts, vocabulary, post_ids = update_counts(
+            self.counts, self.vocabulary, self.post_ids, {3}, [], [])
+
+        assert post_ids.tolist() == [1, 2]
+        assert "midterm" not in vocabulary
+        assert sorted(vocabulary.values()) == list(range(counts.shape[1]))
+        vectorizer, matrix = tfidf_from_counts(counts, vocabulary)
+        assert_same_model(vectorizer, matrix, *refit([DOCS[1], DOCS[2]]))
+
+    def test_delete_everything(self):
+        counts, vocabulary, post_ids = update_counts(
+            self.counts, self.vocabulary, self.post_ids, set(DOCS), [], [])
+        assert counts.shape == (0, 0)
+        assert vocabulary == {}
+        assert post_ids.tolist() == []
+
+
+class TestUpdateModels(unittest.TestCase):
+    def setUp(self):
+        with mock.patch.object(modeltrain_lambda, "ModelCache"), \
+                mock.patch.object(modeltrain_lambda, "get_resource"):
+            self.model_train = modeltrain_lambda.ModelTrain("cid")
+
+        counts, vocabulary = count(list(DOCS.values()))
+        vectorizer, matrix = tfidf_from_counts(counts, vocabulary)
+        self.arrays = encode_model("POST", vectorizer, matrix, list(DOCS))
+        self.arrays.update({
+            "meta/last_full_fit": np.array([0.0]),
+            "POST/counts": counts.data,
+            "POST/num_updated": np.zeros(1, dtype=np.int64),
+        })
+
+    def test_matches_refit(self):
+        edited = "Double free of the linked list head"
+        self.model_train._get_posts = mock.Mock(return_value=[{"post_id": 1}])
+        self.model_train._get_words_for_model = mock.Mock(
+            return_value=(np.array([edited]), np.array([1])))
+
+        self.model_train._update_models("cid", self.arrays, {1}, {3},
+                                        {"POST": [1]})
+
+        (cid, models, arrays), _ = self.model_train.model_cache.store_course.call_args
+        assert cid == "cid"
+        assert list(models) == [TFIDF_MODELS.POST]
+        vectorizer, matrix, post_ids = models[TFIDF_MODELS.POST]
+        assert post_ids.tolist() == [2, 1]
+        assert_same_model(vectorizer, matrix, *refit([DOCS[2], edited]))
+        assert arrays["POST/num_updated"].tolist() == [3]
+
+
+if __name__ == "__main__":
+    unittest.main()
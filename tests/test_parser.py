@@ -0,0 +1,66 @@
+import unittest
+
+import mock
+from botocore.exceptions import ClientError
+
+with mock.patch.dict("os.environ", {"AWS_DEFAULT_REGION": "us-east-1"}):
+    from app.parser_lambda import _student_recs_digest, backfill_followup_counts
+
+
+def make_table(pages):
+    table = mock.MagicMock()
+    table.name = "cid"
+    table.scan.side_effect = pages
+    return table
+
+
+class TestBackfillFollowupCounts(unittest.TestCase):
+    def test_counts_followups_of_every_page(self):
+        table = make_table([
+            {"Items": [{"post_id": 1, "followups": [{"text": "a"}, {"text": "b"}]},
+                       {"post_id": 2}],
+             "LastEvaluatedKey": {"post_id": 2}},
+            {"Items": [{"post_id": 3, "followups": []}]},
+        ])
+        assert backfill_followup_counts(table)
+
+        first, second = table.scan.call_args_list
+        assert first[1]["ProjectionExpression"] == "post_id, followups"
+        assert second[1]["ExclusiveStartKey"] == {"post_id": 2}
+        updates = sorted((kwargs["Key"]["post_id"],
+                          kwargs["ExpressionAttributeValues"][":num_followups"])
+                         for _, kwargs in table.meta.client.update_item.call_args_list)
+        assert updates == [(1, 2), (2, 0), (3, 0)]
+
+    def test_nothing_to_backfill(self):
+        table = make_table([{"Items": []}])
+        assert backfill_followup_counts(table)
+        assert not table.meta.client.update_item.called
+
+    def test_reports_failures(self):
+        table = make_table([{"Items": [{"post_id": 1}]}])
+        table.meta.client.update_item.side_effect = ClientError(
+            {"Error": {"Code": "ValidationException"}}, "UpdateItem")
+        assert not backfill_followup_counts(table)
+
+        table = make_table(ClientError(
+            {"Error": {"Code": "ResourceNotFoundException"}}, "Scan"))
+        assert not backfill_followup_counts(table)
+
+
+class TestStudentRecsDigest(unittest.TestCase):
+    def recs(self, views, pretty_date):
+        return {(3, 5): [{"post_id": 1, "views": views, "pretty_date": pretty_date}],
+                (7, 5): []}
+
+    def test_ignores_pretty_date(self):
+        assert _student_recs_digest(self.recs(4, "2 hours ago")) == \
+            _student_recs_digest(self.recs(4, "3 hours ago"))
+
+    def test_changes_with_recs(self):
+        assert _student_recs_digest(self.recs(4, "2 hours ago")) != \
+            _student_recs_digest(self.recs(5, "2 hours ago"))
+
+
+if __name__ == "__main__":
+    unittest.main()
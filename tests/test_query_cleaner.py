@@ -0,0 +1,84 @@
+import io
+import json
+import unittest
+
+import mock
+
+from app import string_utils
+
+with mock.patch.dict("os.environ", {"AWS_DEFAULT_REGION": "us-east-1"}):
+    from app.parqr_lambda import LocalQueryCleaner, RemoteQueryCleaner
+
+
+def fake_clean_many(texts, **kwargs):
+    return ([word for word in text.lower().split() if word != "the"]
+            for text in texts)
+
+
+def fake_clean(text, array=True, nlp=None):
+    words = next(fake_clean_many([text]))
+    return words if array else " ".join(words)
+
+
+class FakeLambdaClient(object):
+    """Answers invocations of the Parqr-Cleaner with its lambda_handler."""
+
+    def __init__(self):
+        self.payloads = []
+
+    def invoke(self, FunctionName, InvocationType, Payload):
+        assert FunctionName == 'Parqr-Cleaner:PROD'
+        event = json.loads(Payload.decode("utf8"))
+        self.payloads.append(event)
+        response = string_utils.lambda_handler(event, None)
+        return {"Payload": io.BytesIO(json.dumps(response).encode("utf8"))}
+
+
+@mock.patch("app.string_utils.get_query_nlp")
+@mock.patch("app.string_utils.spacy_clean", side_effect=fake_clean)
+@mock.patch("app.string_utils.spacy_clean_many", side_effect=fake_clean_many)
+class TestRemoteQueryCleaner(unittest.TestCase):
+    def setUp(self):
+        self.client = FakeLambdaClient()
+        patcher = mock.patch("app.parqr_lambda.get_client", return_value=self.client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        string_utils.clean_query.cache_clear()
+
+    def test_clean(self, clean_many, clean, get_query_nlp):
+        assert RemoteQueryCleaner().clean("Free The List") == "free list"
+        assert self.client.payloads == [{"source": "Query", "query": "Free The List"}]
+
+    def test_clean_many(self, clean_many, clean, get_query_nlp):
+        queries = ["Free the list", "The midterm", "segfault", "", "Exam Room"]
+        cleaned = RemoteQueryCleaner().clean_many(queries, chunk_size=2)
+
+        assert cleaned == ["free list", "midterm", "segfault", "", "exam room"]
+        assert [payload["queries"] for payload in self.client.payloads] == \
+            [queries[0:2], queries[2:4], queries[4:]]
+
+    def test_clean_many_matches_clean(self, clean_many, clean, get_query_nlp):
+        queries = ["Free the list", "The midterm"]
+        cleaner = RemoteQueryCleaner()
+        assert cleaner.clean_many(queries) == [cleaner.clean(query) for query in queries]
+
+    def test_local_fallback(self, clean_many, clean, get_query_nlp):
+        clean_queries = string_utils.clean_queries
+        # The language model is missing here, but not in the cleaner lambda
+        local_calls = iter([OSError("Can't find model"), None])
+
+        def clean_queries_once(queries):
+            error = next(local_calls)
+            if error is not None:
+                raise error
+            return clean_queries(queries)
+
+        cleaner = LocalQueryCleaner(fallback=RemoteQueryCleaner())
+        with mock.patch("app.string_utils.clean_queries",
+                        side_effect=clean_queries_once):
+            assert cleaner.clean_many(["The midterm"]) == ["midterm"]
+        assert self.client.payloads == [{"source": "Query", "queries": ["The midterm"]}]
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,90 @@
+import unittest
+from datetime import datetime, timedelta
+
+import mock
+import numpy as np
+import pandas as pd
+
+from app.constants import POST_AGE_SIGMOID_OFFSET, POST_MAX_AGE_DAYS
+
+with mock.patch.dict("os.environ", {"AWS_DEFAULT_REGION": "us-east-1"}):
+    from app.parser_lambda import rank_posts
+
+NOW = 1600000000.0
+
+
+def pandas_ranking(created, num_followups, num_views, now, max_age_days, num_posts):
+    """Ranks posts the way update_student_recs did with a DataFrame of the
+    posts scanned from the course table."""
+    now = datetime.fromtimestamp(now)
+    max_age_date = int(datetime.timestamp(now - timedelta(hours=max_age_days * 24)))
+    in_window = created > max_age_date
+
+    def _sigmoid(x, lookback, y_axis_flip=False):
+        exponential = np.exp((-1) ** y_axis_flip) * (x - lookback)
+        return exponential / (1 + exponential)
+
+    def _min_max_norm(x):
+        x = x + 1
+        return x / (x.max() - x.min())
+
+    posts_df = pd.DataFrame.from_dict({
+        "index": np.flatnonzero(in_window),
+        "created": [datetime.fromtimestamp(int(c)) for c in created[in_window]],
+        "num_followups": num_followups[in_window],
+        "num_views": num_views[in_window],
+    })
+    posts_age = now - posts_df.created
+    posts_df["norm_created"] = _sigmoid(posts_age.dt.days, POST_AGE_SIGMOID_OFFSET, True)
+    posts_df["norm_num_followups"] = _min_max_norm(posts_df.num_followups)
+    posts_df["norm_num_views"] = _min_max_norm(posts_df.num_views)
+    posts_df["importance"] = (
+        posts_df.norm_created * posts_df.norm_num_followups * posts_df.norm_num_views
+    )
+    posts_df = posts_df.sort_values(by="importance", ascending=False)
+    return (list(posts_df.head(num_posts)["index"]),
+            dict(zip(posts_df["index"], posts_df.importance)))
+
+
+class TestRankPosts(unittest.TestCase):
+    def setUp(self):
+        random = np.random.RandomState(0)
+        num = 200
+        self.created = NOW - random.uniform(0, 40 * 86400, num).astype(np.int64)
+        self.num_followups = random.randint(0, 20, num)
+        # Distinct views keep ties to posts aged exactly POST_AGE_SIGMOID_OFFSET days
+        self.num_views = random.permutation(num) * 3 + 1
+
+    def assert_matches_pandas(self, windows):
+        rankings = rank_posts(self.created, self.num_followups, self.num_views,
+                              NOW, windows)
+        assert set(rankings) == set(windows)
+        for max_age_days, num_posts in windows:
+            expected, importance = pandas_ranking(
+                self.created, self.num_followups, self.num_views, NOW,
+                max_age_days, num_posts)
+            ranking = rankings[(max_age_days, num_posts)].tolist()
+            # Posts of equal importance may come in any order
+            assert len(set(ranking)) == len(ranking) == len(expected)
+            assert set(ranking) <= set(importance)
+            np.testing.assert_allclose([importance[i] for i in ranking],
+                                       [importance[i] for i in expected])
+
+    def test_default_window(self):
+        self.assert_matches_pandas([(POST_MAX_AGE_DAYS, 5)])
+
+    def test_several_windows(self):
+        self.assert_matches_pandas([(POST_MAX_AGE_DAYS, 5), (POST_MAX_AGE_DAYS, 20),
+                                    (7, 5), (7, 10), (30, 50), (1, 3)])
+
+    def test_more_posts_than_window(self):
+        self.assert_matches_pandas([(2, 1000), (40, 1000)])
+
+    def test_empty_window(self):
+        rankings = rank_posts(self.created[:0], self.num_followups[:0],
+                              self.num_views[:0], NOW, [(POST_MAX_AGE_DAYS, 5)])
+        assert rankings[(POST_MAX_AGE_DAYS, 5)].tolist() == []
+
+
+if __name__ == "__main__":
+    unittest.main()
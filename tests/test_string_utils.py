@@ -0,0 +1,58 @@
+import unittest
+
+import mock
+
+from app import string_utils
+
+
+class Token(object):
+    def __init__(self, text):
+        self.lemma_ = text.lower()
+        self.pos_ = "PUNCT" if text == "?" else "NOUN"
+
+
+class FakeNlp(object):
+    """A pipeline whose pipe has the signature of spaCy 2.2.1, without
+    n_process."""
+
+    def __init__(self):
+        self.calls = []
+
+    def pipe(self, texts, as_tuples=False, n_threads=-1, batch_size=1000,
+             disable=[], cleanup=False, component_cfg=None):
+        self.calls.append({"batch_size": batch_size})
+        return ([Token(word) for word in text.split()] for text in texts)
+
+
+class FakeMultiprocessNlp(FakeNlp):
+    def pipe(self, texts, batch_size=1000, n_process=1):
+        self.calls.append({"batch_size": batch_size, "n_process": n_process})
+        return ([Token(word) for word in text.split()] for text in texts)
+
+
+class TestSpacyCleanMany(unittest.TestCase):
+    def clean(self, nlp, texts, **kwargs):
+        with mock.patch.object(string_utils, "get_query_nlp", return_value=nlp), \
+                mock.patch.object(string_utils, "_spacy_version", return_value="2.2.1"):
+            return list(string_utils.spacy_clean_many(texts, **kwargs))
+
+    def test_cleans_in_order(self):
+        nlp = FakeNlp()
+        assert self.clean(nlp, ["Free List ?", None, "Exam"], batch_size=2) == \
+            [["free", "list"], [], ["exam"]]
+        assert nlp.calls == [{"batch_size": 2}]
+
+    def test_n_process_falls_back_without_support(self):
+        nlp = FakeNlp()
+        assert self.clean(nlp, ["Free List"], n_process=4) == [["free", "list"]]
+        assert nlp.calls == [{"batch_size": string_utils.CLEAN_BATCH_SIZE}]
+
+    def test_n_process(self):
+        nlp = FakeMultiprocessNlp()
+        assert self.clean(nlp, ["Free List"], n_process=4) == [["free", "list"]]
+        assert nlp.calls == [{"batch_size": string_utils.CLEAN_BATCH_SIZE,
+                              "n_process": 4}]
+
+
+if __name__ == "__main__":
+    unittest.main()